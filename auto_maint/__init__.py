@@ -4,10 +4,14 @@ import os
 from flask import Flask, session
 from flask_migrate import Migrate
 from flask_session import Session
-from flask_sqlalchemy import SQLAlchemy
 from flask_wtf.csrf import CSRFProtect
 
 from itsdangerous import URLSafeTimedSerializer
+from jinja2 import FileSystemBytecodeCache
+from werkzeug.contrib.fixers import ProxyFix
+
+from auto_maint.pool import PooledSQLAlchemy, pool_config
+from auto_maint.routing import RoutingSQLAlchemy
 
 app = Flask(__name__)
 
@@ -15,11 +19,45 @@ app = Flask(__name__)
 app.config["SQLALCHEMY_DATABASE_URI"] = os.environ['DATABASE_URL']
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
+# Optional read replica, used by GET requests and the notifier's scan. Reads
+# stay on the primary for REPLICA_STICKY_SECONDS after a user writes.
+if os.environ.get('DATABASE_REPLICA_URL'):
+    app.config['SQLALCHEMY_BINDS'] = {
+        'replica': os.environ['DATABASE_REPLICA_URL']
+    }
+app.config['REPLICA_STICKY_SECONDS'] = float(
+    os.environ.get('REPLICA_STICKY_SECONDS', 10))
+
+# Optional sharding of user data, see sharding.py. SHARD_URLS is a comma
+# separated list of database URLs, configured as the binds shard0, shard1...
+shard_urls = [url for url in os.environ.get('SHARD_URLS', '').split(',')
+              if url.strip()]
+app.config['SHARD_BINDS'] = [f'shard{number}'
+                             for number in range(len(shard_urls))]
+if shard_urls:
+    app.config.setdefault('SQLALCHEMY_BINDS', {}).update(
+        zip(app.config['SHARD_BINDS'], (url.strip() for url in shard_urls)))
+
+# Connection pool settings for the web app and the notifier, see pool.py.
+# Scripts running the notifier set DB_ROLE in the environment before importing
+# the app, as the engine is built on import.
+app.config['DB_ROLE'] = os.environ.get('DB_ROLE', 'web')
+app.config['DB_POOL'] = {
+    role: pool_config(role)
+    for role in ('web', 'notifier')
+}
+
+# Token required in the X-Health-Token header of /health/db, which is
+# disabled without one
+app.config['HEALTH_TOKEN'] = os.environ.get('HEALTH_TOKEN')
+
 # Initiate DB
-db = SQLAlchemy(app)
+db = RoutingSQLAlchemy(app)
 
-# Initiate session tracking type
+# Initiate session tracking type. Its engine is shared with db, so it must
+# be created with the same pool settings.
 app.config["SESSION_TYPE"] = "sqlalchemy"
+app.config["SESSION_SQLALCHEMY"] = PooledSQLAlchemy(app)
 sess = Session(app)
 sess.app.session_interface.db.create_all()
 
@@ -37,4 +75,122 @@ ts = URLSafeTimedSerializer(app.config["SECRET_KEY"])
 
 csrf = CSRFProtect(app)
 
+# Capture emails in helpers.outbox rather than sending them via SMTP
+app.config['MAIL_SUPPRESS_SEND'] = os.environ.get('MAIL_SUPPRESS_SEND') == '1'
+
+# Reminder emails are rendered across this many processes (defaulting to the
+# number of CPUs) when there are at least REMINDER_PARALLEL_MIN to render.
+app.config['REMINDER_RENDER_PROCESSES'] = int(
+    os.environ.get('REMINDER_RENDER_PROCESSES', 0))
+app.config['REMINDER_PARALLEL_MIN'] = int(
+    os.environ.get('REMINDER_PARALLEL_MIN', 50))
+
+# Send users with several vehicles due a single digest email
+app.config['REMINDER_DIGEST'] = os.environ.get('REMINDER_DIGEST') == '1'
+
+# Profiling configs. Requests are profiled when PROFILE_REQUESTS is set or when
+# they carry an X-Profile header matching PROFILE_TOKEN.
+app.config['PROFILE_REQUESTS'] = os.environ.get('PROFILE_REQUESTS') == '1'
+app.config['PROFILE_NOTIFIER'] = os.environ.get('PROFILE_NOTIFIER') == '1'
+app.config['PROFILE_TOKEN'] = os.environ.get('PROFILE_TOKEN')
+app.config['PROFILE_DIR'] = os.environ.get('PROFILE_DIR', 'profiles')
+
+# Queries slower than this many milliseconds are logged with their plan
+app.config['SLOW_QUERY_MS'] = float(os.environ.get('SLOW_QUERY_MS', 250))
+
+# Directory holding the columnar fleet snapshot used by batch jobs
+app.config['SNAPSHOT_DIR'] = os.environ.get('SNAPSHOT_DIR', 'snapshot')
+
+# Directory of the on disk cache of compiled templates, shared by every
+# process. Set it empty to compile templates in memory only.
+app.config['TEMPLATE_CACHE_DIR'] = os.environ.get(
+    'TEMPLATE_CACHE_DIR', 'template_cache')
+if app.config['TEMPLATE_CACHE_DIR']:
+    os.makedirs(app.config['TEMPLATE_CACHE_DIR'], exist_ok=True)
+    app.jinja_env.bytecode_cache = FileSystemBytecodeCache(
+        app.config['TEMPLATE_CACHE_DIR'])
+
+# Number of rendered forecast calendars kept in memory per process
+app.config['CALENDAR_CACHE_SIZE'] = int(
+    os.environ.get('CALENDAR_CACHE_SIZE', 256))
+
+# Reminder delivery: the SMTP provider's limit of emails per minute (0 for no
+# limit) and burst, seconds to spread each run's emails across, sending
+# threads, and retries of failed emails, backing off exponentially from
+# MAIL_RETRY_BACKOFF seconds
+app.config['MAIL_RATE_PER_MINUTE'] = float(
+    os.environ.get('MAIL_RATE_PER_MINUTE', 60))
+app.config['MAIL_BURST'] = int(os.environ.get('MAIL_BURST', 10))
+app.config['MAIL_SEND_WINDOW'] = float(os.environ.get('MAIL_SEND_WINDOW', 0))
+app.config['MAIL_WORKERS'] = int(os.environ.get('MAIL_WORKERS', 4))
+app.config['MAIL_RETRIES'] = int(os.environ.get('MAIL_RETRIES', 3))
+app.config['MAIL_RETRY_BACKOFF'] = float(
+    os.environ.get('MAIL_RETRY_BACKOFF', 2))
+
+# Login attempts allowed per minute, and in a burst, from each client IP and
+# against each account, before the user or password are checked. Buckets are
+# kept for this many IPs and accounts, and failed login counts are written to
+# the DB within LOGIN_FLUSH_SECONDS of a failure.
+app.config['LOGIN_IP_PER_MINUTE'] = float(
+    os.environ.get('LOGIN_IP_PER_MINUTE', 20))
+app.config['LOGIN_IP_BURST'] = int(os.environ.get('LOGIN_IP_BURST', 10))
+app.config['LOGIN_ACCOUNT_PER_MINUTE'] = float(
+    os.environ.get('LOGIN_ACCOUNT_PER_MINUTE', 5))
+app.config['LOGIN_ACCOUNT_BURST'] = int(
+    os.environ.get('LOGIN_ACCOUNT_BURST', 5))
+app.config['LOGIN_THROTTLE_KEYS'] = int(
+    os.environ.get('LOGIN_THROTTLE_KEYS', 100000))
+app.config['LOGIN_FLUSH_SECONDS'] = float(
+    os.environ.get('LOGIN_FLUSH_SECONDS', 30))
+
+# Number of proxies in front of the app, such as Heroku's router, whose
+# X-Forwarded-For headers give the client IP
+app.config['PROXY_COUNT'] = int(os.environ.get('PROXY_COUNT', 0))
+if app.config['PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app,
+                            num_proxies=app.config['PROXY_COUNT'])
+
+# Compression of text responses of at least COMPRESS_MIN_BYTES, and streaming
+# of rendered pages in chunks of up to STREAM_CHUNK_BYTES
+app.config['COMPRESS_RESPONSES'] = os.environ.get('COMPRESS_RESPONSES') == '1'
+app.config['COMPRESS_MIN_BYTES'] = int(
+    os.environ.get('COMPRESS_MIN_BYTES', 1024))
+app.config['COMPRESS_LEVEL'] = int(os.environ.get('COMPRESS_LEVEL', 6))
+app.config['STREAM_PAGES'] = os.environ.get('STREAM_PAGES') == '1'
+app.config['STREAM_CHUNK_BYTES'] = int(
+    os.environ.get('STREAM_CHUNK_BYTES', 16384))
+
+# Most vehicles whose status the home page fetches in one request
+app.config['HOME_STATUS_BATCH'] = int(os.environ.get('HOME_STATUS_BATCH', 25))
+
+# Most items accepted by a single bulk action request
+app.config['BULK_MAX_ITEMS'] = int(os.environ.get('BULK_MAX_ITEMS', 500))
+
+# JSON file of the maintenance schedule catalog
+app.config['SCHEDULE_CATALOG'] = os.environ.get(
+    'SCHEDULE_CATALOG', os.path.join(app.root_path, 'data', 'schedules.json'))
+
+# Search results per page, most words of a query searched for, and number of
+# users whose search index is kept in memory per process where the database
+# has no full text search
+app.config['SEARCH_PAGE_SIZE'] = int(os.environ.get('SEARCH_PAGE_SIZE', 20))
+app.config['SEARCH_MAX_TERMS'] = int(os.environ.get('SEARCH_MAX_TERMS', 8))
+app.config['SEARCH_INDEX_USERS'] = int(
+    os.environ.get('SEARCH_INDEX_USERS', 16))
+
+# Housekeeping deletes rows in batches of this size, pausing this many seconds
+# between batches, and purges accounts left unconfirmed for this many days
+app.config['HOUSEKEEPING_BATCH_SIZE'] = int(
+    os.environ.get('HOUSEKEEPING_BATCH_SIZE', 500))
+app.config['HOUSEKEEPING_PAUSE'] = float(
+    os.environ.get('HOUSEKEEPING_PAUSE', 0.1))
+app.config['UNCONFIRMED_ACCOUNT_DAYS'] = int(
+    os.environ.get('UNCONFIRMED_ACCOUNT_DAYS', 14))
+
 import auto_maint.views
+import auto_maint.profiling
+import auto_maint.commands
+import auto_maint.assets
+
+from auto_maint import responses
+responses.init_app(app)
@@ -0,0 +1,129 @@
+""" Fingerprinted static assets. `flask assets build` copies each static file
+to a name containing a hash of its content, with gzip (and brotli, if
+installed) compressed copies, and writes a manifest of the names.
+url_for('static') then links to the hashed names, which are served with
+their precompressed variants and cached by browsers indefinitely, as a change
+of content always changes the name. """
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import shutil
+
+from flask import request, send_from_directory
+
+from auto_maint import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Directory, under the static folder, of the built assets and their manifest.
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+
+# Files which don't gain from compression.
+PRECOMPRESSED_TYPES = ('image/png', 'image/jpeg', 'image/gif', 'font/woff2')
+
+# Precompressed variants and their suffixes, smallest first.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+# Built assets never change, so are cached for a year.
+IMMUTABLE = 'public, max-age=31536000, immutable'
+
+
+def build_assets(static_dir):
+    """ Build fingerprinted and compressed copies of the files in static_dir.
+    Returns the manifest of original to built names. """
+    build_dir = os.path.join(static_dir, BUILD_DIR)
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        # Don't rebuild the build
+        dirs[:] = [name for name in dirs
+                   if os.path.join(root, name) != build_dir]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            filename = os.path.relpath(source, static_dir).replace(
+                os.sep, '/')
+            with open(source, 'rb') as file:
+                content = file.read()
+
+            stem, extension = os.path.splitext(filename)
+            digest = hashlib.sha256(content).hexdigest()[:12]
+            built = f'{stem}.{digest}{extension}'
+            manifest[filename] = built
+
+            target = os.path.join(build_dir, built)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as file:
+                file.write(content)
+
+            if mimetypes.guess_type(filename)[0] in PRECOMPRESSED_TYPES:
+                continue
+            with open(target + '.gz', 'wb') as file:
+                file.write(gzip.compress(content, compresslevel=9))
+            if brotli is not None:
+                with open(target + '.br', 'wb') as file:
+                    file.write(brotli.compress(content))
+
+    with open(os.path.join(build_dir, MANIFEST), 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+
+    return manifest
+
+
+def load_manifest(static_dir):
+    """ Returns the manifest of the built assets, or an empty manifest if they
+    haven't been built. """
+    try:
+        with open(os.path.join(static_dir, BUILD_DIR, MANIFEST)) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+# Built names of the static files, loaded once per process
+manifest = load_manifest(app.static_folder)
+
+
+@app.url_defaults
+def fingerprint_static(endpoint, values):
+    """ Link static files to their fingerprinted names once built. """
+    if endpoint == 'static' and values.get('filename') in manifest:
+        values['filename'] = (
+            BUILD_DIR + '/' + manifest[values['filename']])
+
+
+def send_static(filename):
+    """ Serves static files. Built assets are served compressed when the
+    browser accepts it, and are cached indefinitely. """
+    if not filename.startswith(BUILD_DIR + '/'):
+        return app.send_static_file(filename)
+
+    mimetype = mimetypes.guess_type(filename)[0]
+
+    # Pick the variant the browser prefers, or the smallest of those it
+    # accepts equally. An encoding with quality 0 is refused.
+    variants = {name: suffix for name, suffix in ENCODINGS
+                if os.path.isfile(
+                    os.path.join(app.static_folder, filename + suffix))}
+    encoding = request.accept_encodings.best_match(list(variants))
+    if encoding:
+        filename += variants[encoding]
+
+    response = send_from_directory(
+        app.static_folder, filename,
+        mimetype=mimetype, cache_timeout=31536000)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['Cache-Control'] = IMMUTABLE
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+
+app.view_functions['static'] = send_static
@@ -0,0 +1,150 @@
+""" Online backfills of derived columns. A backfill walks a table's primary
+key in chunks, updating each chunk in its own transaction along with its
+checkpoint, so no lock is held for long and an interrupted backfill resumes
+where it stopped.
+
+Migrations add the new column and call enqueue() for its backfill, which
+`flask backfill run --pending` then runs after `flask db upgrade`. A small
+backfill can instead be run within the migration by passing op.get_bind() to
+Backfill.run, in which case its chunks share the migration's transaction. """
+import datetime
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.engine import Engine
+
+from auto_maint import clock
+from auto_maint.helpers import TokenBucket
+from auto_maint.models import BackfillCheckpoint, User
+
+# Registered backfills by name.
+BACKFILLS = {}
+
+checkpoints = BackfillCheckpoint.__table__
+
+
+@contextmanager
+def transaction(bind):
+    """ Yields a connection in a transaction. Connections already in a
+    transaction, as in a migration, are used as they are. """
+    if isinstance(bind, Engine):
+        with bind.begin() as connection:
+            yield connection
+    else:
+        with bind.begin():
+            yield bind
+
+
+def enqueue(bind, name):
+    """ Queue the backfill to be run by `flask backfill run --pending`,
+    restarting it if it has run before. """
+    with transaction(bind) as connection:
+        connection.execute(
+            checkpoints.delete().where(checkpoints.c.name == name))
+        connection.execute(
+            checkpoints.insert().values(name=name, rows_done=0))
+
+
+def pending(bind):
+    """ Returns the names of queued or interrupted backfills. """
+    with transaction(bind) as connection:
+        return [row[0] for row in connection.execute(
+            select([checkpoints.c.name]).where(
+                checkpoints.c.finished_at.is_(None)).order_by(
+                    checkpoints.c.name))]
+
+
+class Backfill():
+    """ Backfill calling process(connection, keys) for each chunk of the keys
+    of the rows matching where, in key order, and registered by name. """
+
+    def __init__(self, name, key, process, where=None):
+        self.name = name
+        self.key = key
+        self.process = process
+        self.where = where
+        BACKFILLS[name] = self
+
+    def condition(self, after):
+        """ Condition matching the rows with keys after the key after. """
+        conditions = [] if self.where is None else [self.where]
+        if after is not None:
+            conditions.append(self.key > after)
+        return and_(*conditions)
+
+    def run(self, bind, batch_size=1000, rate=0, restart=False, report=print,
+            report_every=10):
+        """ Run the backfill from its checkpoint, at up to rate rows per
+        second if given, reporting progress every report_every chunks.
+        Returns the number of rows processed by this run. """
+        bucket = TokenBucket(rate, batch_size)
+        now = datetime.datetime.today()
+
+        with transaction(bind) as connection:
+            checkpoint = connection.execute(checkpoints.select().where(
+                checkpoints.c.name == self.name)).first()
+            if checkpoint is None:
+                connection.execute(checkpoints.insert().values(
+                    name=self.name, rows_done=0, started_at=now))
+            elif restart or checkpoint.finished_at:
+                connection.execute(checkpoints.update().where(
+                    checkpoints.c.name == self.name).values(
+                        last_key=None, rows_done=0, started_at=now,
+                        finished_at=None))
+            elif checkpoint.started_at is None:
+                connection.execute(checkpoints.update().where(
+                    checkpoints.c.name == self.name).values(started_at=now))
+
+            last_key = None
+            if checkpoint is not None and not (restart
+                                               or checkpoint.finished_at):
+                last_key = checkpoint.last_key
+            remaining = connection.execute(
+                select([func.count()]).select_from(self.key.table).where(
+                    self.condition(last_key))).scalar()
+
+        report(f'{self.name}: {remaining} rows to backfill'
+               + (f' after key {last_key}' if last_key is not None else ''))
+
+        start = time.perf_counter()
+        done = 0
+        chunks = 0
+        while True:
+            with transaction(bind) as connection:
+                keys = [row[0] for row in connection.execute(
+                    select([self.key]).where(self.condition(
+                        last_key)).order_by(self.key).limit(batch_size))]
+                if keys:
+                    self.process(connection, keys)
+                    last_key = keys[-1]
+                connection.execute(checkpoints.update().where(
+                    checkpoints.c.name == self.name).values(
+                        last_key=last_key,
+                        rows_done=checkpoints.c.rows_done + len(keys),
+                        updated_at=datetime.datetime.today(),
+                        finished_at=(None if len(keys) == batch_size else
+                                     datetime.datetime.today())))
+
+            done += len(keys)
+            chunks += 1
+            elapsed = time.perf_counter() - start
+            if len(keys) < batch_size or chunks % report_every == 0:
+                report(f'{self.name}: {done}/{remaining} rows, '
+                       f'{done / elapsed if elapsed else 0:.0f} rows/s, '
+                       f'last key {last_key}')
+            if len(keys) < batch_size:
+                return done
+            bucket.take(len(keys))
+
+
+def fill_created_at(connection, keys):
+    """ Treat accounts without a registration time as registered now. """
+    users = User.__table__
+    connection.execute(users.update().where(and_(
+        users.c.user_id.in_(keys), users.c.created_at.is_(None))).values(
+            created_at=clock.now()))
+
+
+Backfill('user_created_at', User.__table__.c.user_id, fill_created_at,
+         where=User.__table__.c.created_at.is_(None))
@@ -0,0 +1,150 @@
+""" Bulk actions applying one change to many of a user's vehicles or tasks.
+Every target is loaded with its vehicle's odometer readings in a single query,
+each item is checked by the same form validators as the single item pages,
+and the valid items are written in one transaction. """
+from sqlalchemy.orm import joinedload, selectinload
+from werkzeug.datastructures import MultiDict
+
+from auto_maint import clock, db
+from auto_maint.forms import EditMaintenanceForm, NewLogForm, NewOdometerForm
+from auto_maint.models import Log, Maintenance, Odometer, Vehicle
+from auto_maint.timeline import forget_timeline
+
+
+def load_tasks(user_id, ids):
+    """ Returns the user's tasks with the ids, by id. """
+    tasks = Maintenance.query.join(Vehicle).filter(
+        Maintenance.maintenance_id.in_(ids),
+        Vehicle.user_id == user_id).options(
+            joinedload(Maintenance.vehicle).selectinload(
+                Vehicle.odo_readings))
+    return {task.maintenance_id: task for task in tasks}
+
+
+def load_vehicles(user_id, ids):
+    """ Returns the user's vehicles with the ids, by id. """
+    vehicles = Vehicle.query.filter(
+        Vehicle.vehicle_id.in_(ids), Vehicle.user_id == user_id).options(
+            selectinload(Vehicle.odo_readings))
+    return {vehicle.vehicle_id: vehicle for vehicle in vehicles}
+
+
+def add_reading(vehicle, reading, date):
+    """ Add an odometer reading to the vehicle, keeping its loaded readings
+    and timeline up to date for the items after it. Replaces any reading on
+    the same date, as Vehicle.add_odom_reading does, including one added
+    earlier in the batch. """
+    for same_date in [odometer for odometer in vehicle.odo_readings
+                      if odometer.reading_date == date]:
+        vehicle.odo_readings.remove(same_date)
+        if same_date in db.session.new:
+            db.session.expunge(same_date)
+        else:
+            db.session.delete(same_date)
+    vehicle.odo_readings.append(
+        Odometer(vehicle_id=vehicle.vehicle_id, reading=reading,
+                 reading_date=date))
+    forget_timeline(vehicle.vehicle_id)
+
+
+def add_log(task, form):
+    """ Add a log to the task, with its mileage as an odometer reading. """
+    db.session.add(
+        Log(maintenance_id=task.maintenance_id, date=form.log_date.data,
+            mileage=form.log_miles.data, notes=form.log_notes.data))
+    add_reading(task.vehicle, form.log_miles.data, form.log_date.data)
+
+
+def add_odometer(vehicle, form):
+    """ Add today's odometer reading to the vehicle. """
+    add_reading(vehicle, form.reading.data, clock.today())
+
+
+def edit_task(task, form):
+    """ Update the task from the form. """
+    task.name = form.name.data
+    task.description = form.description.data
+    task.freq_miles = form.freq_miles.data
+    task.freq_months = form.freq_months.data
+
+
+def delete_task(task, form):
+    """ Delete the task and its logs. """
+    db.session.delete(task)
+
+
+def task_values(task):
+    """ Current values of the task, which edits default to. """
+    return {
+        'name': task.name,
+        'description': task.description or '',
+        'freq_miles': task.freq_miles,
+        'freq_months': task.freq_months,
+    }
+
+
+# Each action's id field, target loader, form, function filling in the
+# form's unspecified fields, and function applying a valid item.
+ACTIONS = {
+    'add_log': ('maintenance_id', load_tasks, NewLogForm, None, add_log),
+    'add_odometer': ('vehicle_id', load_vehicles, NewOdometerForm, None,
+                     add_odometer),
+    'edit_task': ('maintenance_id', load_tasks, EditMaintenanceForm,
+                  task_values, edit_task),
+    'delete_task': ('maintenance_id', load_tasks, None, None, delete_task),
+}
+
+
+def item_id(item, key):
+    """ Returns the item's integer id, or None if it hasn't a valid one. """
+    try:
+        return int(item[key])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def bulk_action(user_id, action, items):
+    """ Apply the action to each item, a dict of the action's id field and
+    form fields. Returns a result per item with its status and any errors by
+    field. Valid items are applied even if others aren't. """
+    key, load, form_class, defaults, apply = ACTIONS[action]
+    ids = [item_id(item, key) for item in items]
+    targets = load(user_id, {target_id for target_id in ids if target_id})
+
+    results = []
+    changed_vehicles = set()
+    for item, target_id in zip(items, ids):
+        result = {key: item.get(key), 'status': 'error'}
+        results.append(result)
+
+        target = targets.get(target_id)
+        if target is None:
+            result['errors'] = {key: ['Not found.']}
+            continue
+
+        form = None
+        if form_class:
+            values = defaults(target) if defaults else {}
+            values.update(item)
+            form = form_class(
+                formdata=MultiDict({name: str(value)
+                                    for name, value in values.items()
+                                    if value is not None}),
+                meta={'csrf': False})
+            if hasattr(form, 'vehicle'):
+                form.vehicle.data = getattr(target, 'vehicle', target)
+            if not form.validate():
+                result['errors'] = form.errors
+                continue
+
+        apply(target, form)
+        changed_vehicles.add(target.vehicle_id)
+        result['status'] = 'ok'
+        if apply is delete_task:
+            del targets[target_id]
+
+    db.session.commit()
+    for vehicle_id in changed_vehicles:
+        forget_timeline(vehicle_id)
+
+    return results
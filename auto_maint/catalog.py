@@ -0,0 +1,171 @@
+""" Catalog of manufacturers' maintenance schedules by make, model and year,
+loaded once per process from the SCHEDULE_CATALOG JSON file. Each entry gives
+the tasks for a model over a range of years. Schedules are applied to any
+number of vehicles with one insert of their tasks, on PostgreSQL, and one of
+their estimated logs. """
+import json
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+from functools import lru_cache
+
+from sqlalchemy.orm import selectinload
+
+from auto_maint import app, clock, db
+from auto_maint.models import (ESTIMATED_LOG_NOTES, Log, Maintenance,
+                               Vehicle, estimated_log, mark_changed)
+
+# Schedule applied by the add vehicle form's standard schedule option.
+STANDARD_SCHEDULE = ('Honda Accord', 2001)
+
+# Vehicles loaded at a time when applying a schedule.
+APPLY_CHUNK = 500
+
+Task = namedtuple('Task', 'name description freq_miles freq_months')
+
+
+class Schedule(namedtuple('Schedule',
+                          'make model first_year last_year tasks')):
+    """ Maintenance schedule for a model built from first_year to last_year.
+    """
+
+    @property
+    def name(self):
+        """ The schedule's "make model" name. """
+        return f'{self.make} {self.model}'
+
+
+class ScheduleCatalog():
+    """ Schedules indexed by lower case "make model" name, each name's
+    schedules sorted by first year for lookup by year, and the names sorted
+    for prefix search by make and model or by model alone. """
+
+    def __init__(self, schedules):
+        self.years = {}
+        self.schedules = {}
+        for schedule in sorted(schedules, key=lambda s: s.first_year):
+            key = schedule.name.lower()
+            self.years.setdefault(key, []).append(schedule.first_year)
+            self.schedules.setdefault(key, []).append(schedule)
+
+        # Sorted (search term, name) pairs
+        self.terms = sorted(
+            {(term, schedules[0].name)
+             for key, schedules in self.schedules.items()
+             for term in (key, schedules[0].model.lower())})
+
+    def __len__(self):
+        return sum(len(schedules) for schedules in self.schedules.values())
+
+    @classmethod
+    def load(cls, path):
+        """ Load a catalog from a JSON list of schedules. """
+        with open(path) as file:
+            entries = json.load(file)
+        return cls(
+            Schedule(entry['make'], entry['model'], entry['first_year'],
+                     entry['last_year'],
+                     tuple(Task(**task) for task in entry['tasks']))
+            for entry in entries)
+
+    def lookup(self, name, year):
+        """ Returns the schedule for the "make model" name covering the year,
+        or None. """
+        key = ' '.join(name.lower().split())
+        index = bisect_right(self.years.get(key, []), year) - 1
+        if index < 0:
+            return None
+        schedule = self.schedules[key][index]
+        return schedule if year <= schedule.last_year else None
+
+    def search(self, prefix, limit=10):
+        """ Returns up to limit "make model" names where either the name or
+        the model starts with prefix. """
+        prefix = ' '.join(prefix.lower().split())
+        names = []
+        for term, name in self.terms[bisect_left(self.terms, (prefix, )):]:
+            if not term.startswith(prefix) or len(names) == limit:
+                break
+            if name not in names:
+                names.append(name)
+        return names
+
+
+@lru_cache(maxsize=None)
+def load_catalog(path):
+    """ Returns the catalog in the file, loading it once per process. """
+    return ScheduleCatalog.load(path)
+
+
+def catalog():
+    """ Returns the app's schedule catalog. """
+    return load_catalog(app.config['SCHEDULE_CATALOG'])
+
+
+def insert_tasks(rows):
+    """ Insert task rows, returning their ids by vehicle id and name. The
+    ids are returned by the insert itself, as other tasks of the same names
+    may be added concurrently. """
+    tasks = Maintenance.__table__
+    bind = db.session.get_bind(Maintenance.__mapper__)
+    if bind.dialect.name == 'postgresql':
+        inserted = db.session.execute(tasks.insert().values(rows).returning(
+            tasks.c.vehicle_id, tasks.c.name, tasks.c.maintenance_id))
+        return {(vehicle_id, name): maintenance_id
+                for vehicle_id, name, maintenance_id in inserted}
+
+    # Otherwise each row's id is read back as it's inserted
+    return {
+        (row['vehicle_id'], row['name']): db.session.execute(
+            tasks.insert(), row).inserted_primary_key[0]
+        for row in rows}
+
+
+def apply_schedule(schedule, vehicle_ids):
+    """ Add the schedule's tasks to each vehicle, with a log of each task
+    estimated to have been done as recommended. Tasks and logs are each
+    written by a single statement per chunk of vehicles, except tasks on
+    databases without RETURNING. """
+    logs = Log.__table__
+    today = clock.today()
+
+    for start in range(0, len(vehicle_ids), APPLY_CHUNK):
+        vehicles = Vehicle.query.options(
+            selectinload(Vehicle.odo_readings)).filter(
+                Vehicle.vehicle_id.in_(vehicle_ids[start:start + APPLY_CHUNK]))
+        vehicles = {vehicle.vehicle_id: vehicle for vehicle in vehicles}
+        if not vehicles:
+            continue
+
+        task_ids = insert_tasks([{
+            'vehicle_id': vehicle_id,
+            'name': task.name,
+            'description': task.description,
+            'freq_miles': task.freq_miles,
+            'freq_months': task.freq_months,
+        } for vehicle_id in vehicles for task in schedule.tasks])
+
+        log_rows = []
+        for vehicle_id, vehicle in vehicles.items():
+            mileage = vehicle.last_odometer().reading
+            age = vehicle.age()
+            for task in schedule.tasks:
+                log = estimated_log(task.freq_miles, task.freq_months,
+                                    mileage, age, today)
+                if log:
+                    log_rows.append({
+                        'maintenance_id': task_ids[vehicle_id, task.name],
+                        'date': log[0],
+                        'mileage': log[1],
+                        'notes': ESTIMATED_LOG_NOTES,
+                    })
+        if log_rows:
+            db.session.execute(logs.insert(), log_rows)
+
+        # Core inserts aren't seen by the after flush listener
+        mark_changed(db.session, list(vehicles))
+        db.session.commit()
+
+
+def standard_schedule(vehicle):
+    """ Add the standard maintenance schedule to the vehicle. """
+    apply_schedule(catalog().lookup(*STANDARD_SCHEDULE), [vehicle.vehicle_id])
@@ -0,0 +1,71 @@
+""" The app's clock. Date and time calculations call clock.today() and
+clock.now() rather than datetime directly, so that the notifier and models
+can be run in virtual time by the fleet simulator. clock.utcnow() gives the
+same moment in UTC, for comparing with times other libraries store in UTC. """
+import datetime
+from contextlib import contextmanager
+
+
+class SystemClock():
+    """ Clock giving the real date and time. """
+
+    def today(self):
+        return datetime.date.today()
+
+    def now(self):
+        return datetime.datetime.today()
+
+    def utcnow(self):
+        return datetime.datetime.utcnow()
+
+
+class VirtualClock():
+    """ Clock standing still at a given time until it is advanced. """
+
+    def __init__(self, start):
+        self.current = start
+
+    def today(self):
+        return self.current.date()
+
+    def now(self):
+        return self.current
+
+    def utcnow(self):
+        # A naive datetime is taken as local time when converted
+        return self.current.astimezone(datetime.timezone.utc).replace(
+            tzinfo=None)
+
+    def advance(self, delta):
+        """ Move the clock forward by the timedelta. """
+        self.current += delta
+
+
+# Clock used by the app, replaced for the whole process by use_clock.
+current = SystemClock()
+
+
+def today():
+    """ Returns the current date by the clock in use. """
+    return current.today()
+
+
+def now():
+    """ Returns the current date and time by the clock in use. """
+    return current.now()
+
+
+def utcnow():
+    """ Returns the current date and time in UTC by the clock in use. """
+    return current.utcnow()
+
+
+@contextmanager
+def use_clock(clock):
+    """ Use the clock within the block. """
+    global current
+    previous, current = current, clock
+    try:
+        yield clock
+    finally:
+        current = previous
@@ -0,0 +1,180 @@
+""" Command line tasks, run with `flask <command>`. Heavier modules are
+imported within each command so they are not loaded by the web app. """
+import json
+
+import click
+
+from auto_maint import app, clock, db
+from auto_maint.sharding import shard_binds, shards, use_shard
+
+
+def databases():
+    """ Returns the name and engine of the primary database and of each
+    shard. """
+    return [('primary', db.engine)] + [
+        (bind, db.get_engine(app, bind=bind)) for bind in shard_binds()]
+
+
+@app.cli.group()
+def snapshot():
+    """ Build and query the columnar fleet snapshot. """
+
+
+@snapshot.command('build')
+@click.option('--full', is_flag=True,
+              help='Rebuild from scratch rather than updating.')
+def snapshot_build(full):
+    """ Build or incrementally update the fleet snapshot. """
+    from auto_maint.snapshot import build_snapshot
+
+    if shard_binds():
+        raise click.UsageError(
+            'The fleet snapshot covers a single database, not shards')
+    fleet = build_snapshot(app.config['SNAPSHOT_DIR'], full=full)
+    click.echo(f'Snapshot of {len(fleet)} vehicles built at {fleet.built_at}')
+
+
+@snapshot.command('stats')
+def snapshot_stats():
+    """ Print fleet statistics from the snapshot. """
+    from auto_maint.snapshot import FleetSnapshot
+
+    fleet = FleetSnapshot(app.config['SNAPSHOT_DIR'])
+    click.echo(json.dumps(
+        fleet.statistics(clock.today()), indent=2))
+
+
+@app.cli.command('refresh-due-state')
+def refresh_due_state_command():
+    """ Precompute the fleet dashboard's due state of every changed vehicle. """
+    from auto_maint.dashboard import refresh_due_state
+    from auto_maint.models import Vehicle
+
+    count = 0
+    for shard in shards():
+        with use_shard(shard):
+            count += refresh_due_state(Vehicle.query)
+    click.echo(f'Refreshed the due state of {count} vehicles')
+
+
+@app.cli.command('housekeeping')
+@click.option('--batch-size', type=int, help='Rows deleted per batch.')
+@click.option('--pause', type=float, help='Seconds to pause between batches.')
+def housekeeping_command(batch_size, pause):
+    """ Delete expired sessions and stale unconfirmed accounts in batches. """
+    from auto_maint.housekeeping import housekeeping
+
+    report = housekeeping(batch_size, pause)
+    click.echo(f"Deleted {report['sessions']} expired sessions and "
+               f"{report['users']} unconfirmed accounts in "
+               f"{report['seconds']}s")
+
+
+@app.cli.group()
+def assets():
+    """ Build the fingerprinted static assets. """
+
+
+@assets.command('build')
+def assets_build():
+    """ Build fingerprinted, precompressed copies of the static files. """
+    from auto_maint.assets import build_assets
+
+    manifest = build_assets(app.static_folder)
+    click.echo(f'Built {len(manifest)} static assets')
+
+
+@app.cli.group()
+def backfill():
+    """ Run online backfills of derived columns. """
+
+
+@backfill.command('list')
+def backfill_list():
+    """ List the backfills and their progress in each database. """
+    from auto_maint.backfill import BACKFILLS, checkpoints
+
+    for database, engine in databases():
+        if shard_binds():
+            click.echo(f'{database}:')
+        with engine.connect() as connection:
+            progress = {checkpoint.name: checkpoint for checkpoint
+                        in connection.execute(checkpoints.select())}
+        for name in sorted(BACKFILLS):
+            checkpoint = progress.get(name)
+            if checkpoint is None:
+                state = 'never run'
+            elif checkpoint.finished_at:
+                state = f'finished {checkpoint.finished_at}'
+            elif checkpoint.started_at:
+                state = f'stopped after key {checkpoint.last_key}'
+            else:
+                state = 'pending'
+            rows = checkpoint.rows_done if checkpoint else 0
+            click.echo(f'{name:<24}{state} ({rows} rows)')
+
+
+@backfill.command('run')
+@click.argument('names', nargs=-1)
+@click.option('--pending', is_flag=True,
+              help='Run every queued or interrupted backfill.')
+@click.option('--batch-size', default=1000, help='Rows per transaction.')
+@click.option('--rate', default=0.0,
+              help='Most rows per second, or 0 for no limit.')
+@click.option('--restart', is_flag=True,
+              help='Start again rather than resuming.')
+def backfill_run(names, pending, batch_size, rate, restart):
+    """ Run backfills by name in each database, resuming from their
+    checkpoints. """
+    from auto_maint.backfill import BACKFILLS
+    from auto_maint.backfill import pending as pending_backfills
+
+    for name in names:
+        if name not in BACKFILLS:
+            raise click.BadParameter(f'Unknown backfill {name}')
+
+    for database, engine in databases():
+        if shard_binds():
+            click.echo(f'{database}:')
+        run = list(names)
+        if pending:
+            for name in pending_backfills(engine):
+                if name not in BACKFILLS:
+                    click.echo(f'Skipping unknown backfill {name}')
+                elif name not in run:
+                    run.append(name)
+
+        for name in run:
+            BACKFILLS[name].run(engine, batch_size, rate, restart,
+                                report=click.echo)
+
+
+@app.cli.group('shards')
+def shards_group():
+    """ Manage the shards of user data. """
+
+
+@shards_group.command('init')
+def shards_init():
+    """ Create the tables in new shards, such as local SQLite files, without
+    running the migrations. """
+    for bind in shard_binds():
+        db.Model.metadata.create_all(db.get_engine(app, bind=bind))
+        click.echo(f'Created the tables in {bind}')
+
+
+@shards_group.command('upgrade')
+def shards_upgrade():
+    """ Run the migrations on each shard, as `flask db upgrade` does on the
+    primary. """
+    from flask_migrate import upgrade
+
+    primary = app.config['SQLALCHEMY_DATABASE_URI']
+    try:
+        for bind in shard_binds():
+            click.echo(f'Upgrading {bind}')
+            app.config['SQLALCHEMY_DATABASE_URI'] = app.config[
+                'SQLALCHEMY_BINDS'][bind]
+            upgrade()
+    finally:
+        app.config['SQLALCHEMY_DATABASE_URI'] = primary
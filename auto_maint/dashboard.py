@@ -0,0 +1,178 @@
+""" Fleet dashboard queries. Each vehicle's due state is precomputed into
+columns whenever its data changes, so the dashboard is built from grouped
+aggregates and single pages of vehicles however large the fleet. """
+from sqlalchemy import and_, bindparam, case, func, or_
+from sqlalchemy.orm import selectinload
+
+from auto_maint import clock, db
+from auto_maint.models import NEVER, Maintenance, Vehicle
+from auto_maint.routing import primary_reads
+
+PAGE_SIZE = 50
+
+
+def status_column(model, today):
+    """ SQL expression for the status of a vehicle or task today from its
+    precomputed due dates. """
+    return case([(model.overdue_date <= today, 'Overdue'),
+                 (model.soon_date <= today, 'Soon')],
+                else_='Good')
+
+
+def est_mileage_column(today):
+    """ SQL expression for a vehicle's estimated mileage today. """
+    return func.coalesce(
+        Vehicle.mileage_offset + Vehicle.mileage_per_day * today.toordinal(),
+        0)
+
+
+# Sortable vehicle list columns, as (SQL expression, descending) for a day.
+SORTS = {
+    'due': lambda today: (func.coalesce(Vehicle.overdue_date, NEVER.date()),
+                          False),
+    'name': lambda today: (Vehicle.vehicle_name, False),
+    'mileage': lambda today: (est_mileage_column(today), True),
+    'age': lambda today: (Vehicle.vehicle_built, False),
+}
+
+
+def refresh_due_state(vehicles, chunk_size=500):
+    """ Recalculate the precomputed due state of those vehicles in the query
+    whose data has changed since it was last calculated. Returns the number of
+    vehicles refreshed. Reads are from the primary, as the replica may not yet
+    have the changes. """
+    vehicle_update = Vehicle.__table__.update().where(and_(
+        Vehicle.vehicle_id == bindparam('v_id'),
+        func.coalesce(Vehicle.updated_at, NEVER) == bindparam('v_updated')
+    )).values(
+        due_state_at=bindparam('v_state_at'),
+        soon_date=bindparam('v_soon'),
+        overdue_date=bindparam('v_overdue'),
+        last_reading=bindparam('v_reading'),
+        mileage_per_day=bindparam('v_rate'),
+        mileage_offset=bindparam('v_offset'))
+    task_update = Maintenance.__table__.update().where(
+        Maintenance.maintenance_id == bindparam('m_id')).values(
+            soon_date=bindparam('m_soon'), overdue_date=bindparam('m_overdue'))
+
+    with primary_reads():
+        vehicle_ids = [
+            row[0] for row in vehicles.filter(Vehicle.due_state_at.is_(
+                None)).with_entities(Vehicle.vehicle_id)
+        ]
+
+        for start in range(0, len(vehicle_ids), chunk_size):
+            chunk = Vehicle.query.filter(
+                Vehicle.vehicle_id.in_(vehicle_ids[start:start + chunk_size]))
+            chunk = chunk.options(
+                selectinload(Vehicle.odo_readings),
+                selectinload(Vehicle.maintenance).selectinload(
+                    Maintenance.logs))
+
+            vehicle_rows = []
+            task_rows = []
+            for vehicle in chunk:
+                soon_dates = []
+                overdue_dates = []
+                for maintenance in vehicle.maintenance:
+                    soon, overdue = maintenance.due_dates()
+                    soon_dates.append(soon)
+                    overdue_dates.append(overdue)
+                    task_rows.append({
+                        'm_id': maintenance.maintenance_id,
+                        'm_soon': soon,
+                        'm_overdue': overdue,
+                    })
+
+                last_odo = vehicle.last_odometer()
+                rate = vehicle.mileage_rate()
+                vehicle_rows.append({
+                    'v_id': vehicle.vehicle_id,
+                    # Skip the update if the vehicle changes meanwhile
+                    'v_updated': vehicle.updated_at or NEVER,
+                    'v_state_at': clock.now(),
+                    'v_soon': min(soon_dates, default=None),
+                    'v_overdue': min(overdue_dates, default=None),
+                    'v_reading': last_odo.reading,
+                    'v_rate': rate,
+                    'v_offset': (last_odo.reading -
+                                 rate * last_odo.reading_date.toordinal()),
+                })
+
+            # Core updates, which the after flush listener doesn't see
+            if task_rows:
+                db.session.execute(task_update, task_rows)
+            if vehicle_rows:
+                db.session.execute(vehicle_update, vehicle_rows)
+            db.session.commit()
+
+    return len(vehicle_ids)
+
+
+def status_counts(user_id, today):
+    """ Returns the number of the user's vehicles in each status. """
+    status = status_column(Vehicle, today)
+    counts = dict(
+        db.session.query(status, func.count(Vehicle.vehicle_id)).filter(
+            Vehicle.user_id == user_id).group_by(status))
+    return {name: counts.get(name, 0) for name in ('Overdue', 'Soon', 'Good')}
+
+
+def overdue_tasks(user_id, today, limit=10):
+    """ Returns the user's longest overdue tasks with their vehicles. """
+    return db.session.query(
+        Maintenance.maintenance_id, Maintenance.name,
+        Maintenance.overdue_date, Vehicle.vehicle_id,
+        Vehicle.vehicle_name).join(Vehicle).filter(
+            Vehicle.user_id == user_id,
+            Maintenance.overdue_date <= today).order_by(
+                Maintenance.overdue_date, Maintenance.maintenance_id).limit(
+                    limit).all()
+
+
+def vehicle_page(user_id, today, sort='due', after=None, size=PAGE_SIZE):
+    """ Returns a page of the user's vehicles ordered by sort, starting after
+    the vehicle with id after, as (vehicle, estimated mileage, status) rows.
+    Also returns the id to start the next page after, or None on the last
+    page. """
+    column, descending = SORTS[sort](today)
+    query = db.session.query(
+        Vehicle, est_mileage_column(today),
+        status_column(Vehicle, today)).filter(Vehicle.user_id == user_id)
+
+    # Seek past the previous page's last vehicle by its sort value and id
+    if after is not None:
+        value = db.session.query(column).filter(
+            Vehicle.vehicle_id == after, Vehicle.user_id == user_id).scalar()
+        if value is not None:
+            beyond = column < value if descending else column > value
+            query = query.filter(or_(
+                beyond, and_(column == value, Vehicle.vehicle_id > after)))
+
+    order = column.desc() if descending else column
+    rows = query.order_by(order, Vehicle.vehicle_id).limit(size + 1).all()
+    rows = [(vehicle, int(mileage), status)
+            for vehicle, mileage, status in rows]
+
+    if len(rows) > size:
+        return rows[:size], rows[size - 1][0].vehicle_id
+    return rows, None
+
+
+def vehicle_statuses(user_id, vehicle_ids, today):
+    """ Returns the last reading, estimated mileage and status of the user's
+    vehicles with the ids, bringing the due state of any which have changed
+    up to date first. """
+    vehicles = Vehicle.query.filter(Vehicle.user_id == user_id,
+                                    Vehicle.vehicle_id.in_(vehicle_ids))
+    refresh_due_state(vehicles)
+
+    rows = vehicles.with_entities(
+        Vehicle.vehicle_id, Vehicle.last_reading, est_mileage_column(today),
+        status_column(Vehicle, today))
+    return [{
+        'vehicle_id': vehicle_id,
+        'last_reading': last_reading,
+        'est_mileage': int(mileage),
+        'status': status,
+    } for vehicle_id, last_reading, mileage, status in rows]
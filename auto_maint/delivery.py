@@ -0,0 +1,111 @@
+""" Rate limited delivery of reminder emails. Emails are sent from a pool of
+threads, spread evenly across MAIL_SEND_WINDOW seconds and kept within the SMTP
+provider's rate limit by a token bucket. Failed emails are retried with
+exponential backoff, then recorded as dead letters with their vehicles left
+for the next notifier run, so that one bad address doesn't stop the others
+being sent. Database updates are made on the calling thread. """
+import smtplib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from auto_maint import app, db
+from auto_maint.helpers import TokenBucket, send_email
+from auto_maint.models import DeadLetter, Vehicle
+from auto_maint.sharding import use_shard
+
+
+def permanent(error):
+    """ Returns True if retrying the email can't fix the error. """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 500 <= error.smtp_code < 600
+    return isinstance(error, (ValueError, UnicodeError))
+
+
+class Delivery():
+    """ Sends a known number of emails, recording the notification against
+    their vehicles when sent and a dead letter when they fail. Used as a
+    context manager, which waits for every email on exit. """
+
+    def __init__(self, total):
+        config = app.config
+        self.bucket = TokenBucket(config['MAIL_RATE_PER_MINUTE'] / 60,
+                                  config['MAIL_BURST'])
+        self.spacing = config['MAIL_SEND_WINDOW'] / total if total > 1 else 0
+        self.retries = config['MAIL_RETRIES']
+        self.backoff = config['MAIL_RETRY_BACKOFF']
+        self.executor = ThreadPoolExecutor(config['MAIL_WORKERS'])
+        self.start = time.monotonic()
+        self.submitted = 0
+        self.pending = []
+        self.report = {'sent': 0, 'failed': 0, 'retries': 0}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.executor.shutdown(wait=True)
+        self.record(wait=True)
+
+    def submit(self, message, vehicle_ids, shard=None):
+        """ Queue an email covering the vehicles, in the shard if user data is
+        sharded, to be sent in its turn. """
+        future = self.executor.submit(self.send, self.submitted, message)
+        self.submitted += 1
+        self.pending.append((future, message, vehicle_ids, shard))
+        self.record()
+
+    def send(self, index, message):
+        """ Send an email once its turn in the window comes, retrying
+        temporary failures. Returns the number of attempts and the last error,
+        or None if it was sent. Runs in a worker thread. """
+        delay = self.start + index * self.spacing - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        attempts = 0
+        while True:
+            attempts += 1
+            self.bucket.take()
+            try:
+                with app.app_context():
+                    send_email(message)
+                return attempts, None
+            except Exception as error:
+                if attempts > self.retries or permanent(error):
+                    return attempts, error
+            time.sleep(self.backoff * 2**(attempts - 1))
+
+    def record(self, wait=False):
+        """ Record the results of finished emails, or of every email if wait
+        is set. """
+        still_pending = []
+        for future, message, vehicle_ids, shard in self.pending:
+            if not wait and not future.done():
+                still_pending.append((future, message, vehicle_ids, shard))
+                continue
+
+            attempts, error = future.result()
+            self.report['retries'] += attempts - 1
+            if error is None:
+                self.report['sent'] += 1
+                with use_shard(shard):
+                    Vehicle.notifications_sent(vehicle_ids)
+                continue
+
+            self.report['failed'] += 1
+            app.logger.warning('Reminder to %s failed after %d attempts: %r',
+                               message['To'], attempts, error)
+            with use_shard(shard):
+                Vehicle.notifications_failed(vehicle_ids)
+            db.session.add(DeadLetter(
+                recipient=message['To'],
+                subject=message['Subject'],
+                message=message.as_string(),
+                vehicle_ids=','.join(str(id) for id in vehicle_ids),
+                error=repr(error),
+                attempts=attempts))
+            db.session.commit()
+
+        self.pending = still_pending
@@ -0,0 +1,185 @@
+""" Maintenance forecasting. Projects every occurrence of every task over a
+horizon in closed form: with a vehicle's mileage rate taken as constant, each
+task recurs at a fixed interval, the shorter of its month and mile
+frequencies, after its first due date. """
+import datetime
+from collections import OrderedDict
+
+import numpy as np
+from dateutil.relativedelta import relativedelta
+from flask import url_for
+from sqlalchemy import func
+
+from auto_maint import app, clock, db
+from auto_maint.models import Maintenance, Vehicle
+from auto_maint.snapshot import FleetArrays, query_arrays
+
+# Rendered calendars keyed by user, horizon, day and the state of the user's
+# vehicles, least recently used first.
+calendar_cache = OrderedDict()
+
+
+def project(fleet, today, end):
+    """ Returns arrays of (task index, date, estimated mileage, overdue) for
+    every occurrence of the fleet's tasks due up to end. Tasks already due are
+    placed on today and flagged overdue. """
+    owner = fleet.task_owner()
+    # Dates are handled as days after today
+    origin = np.datetime64(today, 'D')
+    end_days = (np.datetime64(end, 'D') - origin).astype(np.float64)
+
+    # Estimated mileage today, as Vehicle.est_mileage. Projections assume
+    # the vehicle keeps being driven at its average rate, if positive.
+    # A vehicle with no readings is taken as at 0 miles and not driven.
+    rate = fleet.mileage_rates()[owner]
+    rate = np.where(np.isfinite(rate), rate, 0)
+    read = fleet.odometer_counts()[owner] > 0
+    last = (fleet.odo_offsets[1:] - 1)[owner][read]
+    odo_days = (fleet.odo_date[last] - origin).astype(np.float64)
+    mileage_today = np.zeros(len(owner))
+    mileage_today[read] = fleet.odo_reading[last] - rate[read] * odo_days
+    rate = np.maximum(rate, 0)
+
+    # Tasks never logged count from the vehicle's build date at 0 miles
+    logged = ~np.isnat(fleet.task_last_date)
+    log_days = np.where(logged, fleet.task_last_date,
+                        fleet.vehicle_built[owner]) - origin
+    log_days = log_days.astype(np.float64)
+    log_mileage = np.where(logged, fleet.task_last_mileage, 0)
+
+    # First due date is whichever of the month or mile frequency comes first
+    freq_days = (fleet.task_freq_months / 12) * 365.2524
+    first_by_months = log_days + freq_days
+    miles_left = log_mileage + fleet.task_freq_miles - mileage_today
+    with np.errstate(divide='ignore', invalid='ignore'):
+        freq_mile_days = np.where(rate > 0, fleet.task_freq_miles / rate,
+                                  np.inf)
+        first_by_miles = np.where(
+            miles_left <= 0, 0, np.where(rate > 0, miles_left / rate, np.inf))
+    first = np.maximum(np.minimum(first_by_months, first_by_miles), 0)
+
+    # Overdue as in Maintenance.status, which counts whole days until due
+    overdue = (first_by_months < 1) | (miles_left <= 0)
+
+    # Later occurrences follow at the shorter interval, at least a day apart
+    interval = np.maximum(np.minimum(freq_days, freq_mile_days), 1)
+    counts = np.where(first <= end_days,
+                      np.floor((end_days - first) / interval) + 1,
+                      0).astype(np.int64)
+
+    task = np.repeat(np.arange(len(counts)), counts)
+    nth = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                              counts)
+    days = first[task] + nth * interval[task]
+    mileage = mileage_today[task] + rate[task] * days
+
+    order = np.argsort(days, kind='stable')
+    dates = origin + np.floor(days).astype('timedelta64[D]')
+    return (task[order], dates[order], mileage[order].astype(np.int64),
+            (overdue[task] & (nth == 0))[order])
+
+
+def user_forecast(user_id, months, today=None):
+    """ Returns a list of the maintenance occurrences due across a user's
+    vehicles within the given number of months, in date order. """
+    today = today or clock.today()
+    fleet = FleetArrays(query_arrays(Vehicle.user_id == user_id))
+    task, dates, mileage, overdue = project(
+        fleet, today, today + relativedelta(months=months))
+
+    names = dict(
+        (row[0], row[1:]) for row in db.session.query(
+            Maintenance.maintenance_id, Maintenance.name,
+            Vehicle.vehicle_id, Vehicle.vehicle_name).join(Vehicle).filter(
+                Vehicle.user_id == user_id))
+
+    forecast = []
+    for index, date, miles, late in zip(task, dates.tolist(), mileage,
+                                        overdue):
+        maintenance_id = int(fleet.task_id[index])
+        name, vehicle_id, vehicle_name = names[maintenance_id]
+        forecast.append({
+            'maintenance_id': maintenance_id,
+            'name': name,
+            'vehicle_id': vehicle_id,
+            'vehicle_name': vehicle_name,
+            'date': date.isoformat(),
+            'est_mileage': int(miles),
+            'overdue': bool(late),
+        })
+    return forecast
+
+
+def ical_escape(text):
+    """ Escape text for an iCalendar property value. """
+    return (text.replace('\\', '\\\\').replace(';', '\\;')
+            .replace(',', '\\,').replace('\n', '\\n'))
+
+
+def ical_fold(line):
+    """ Fold a content line longer than 75 octets, as RFC 5545 requires. """
+    folded = []
+    encoded = line.encode('utf-8')
+    while len(encoded) > 75:
+        cut = 75 if not folded else 74
+        # Don't split a multi-byte character
+        while encoded[cut] & 0xC0 == 0x80:
+            cut -= 1
+        folded.append(encoded[:cut].decode('utf-8'))
+        encoded = encoded[cut:]
+    folded.append(encoded.decode('utf-8'))
+    return '\r\n '.join(folded)
+
+
+def render_calendar(forecast):
+    """ Render a forecast as an iCalendar feed of all day events. """
+    stamp = datetime.datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')
+    lines = [
+        'BEGIN:VCALENDAR',
+        'VERSION:2.0',
+        'PRODID:-//Auto Maintenance//Forecast//EN',
+        'X-WR-CALNAME:Auto Maintenance',
+    ]
+    for event in forecast:
+        date = datetime.datetime.strptime(event['date'], '%Y-%m-%d').date()
+        status = 'Overdue' if event['overdue'] else 'Due'
+        lines += [
+            'BEGIN:VEVENT',
+            f"UID:{event['maintenance_id']}-{date:%Y%m%d}@"
+            f"{app.config['SERVER_NAME']}",
+            f'DTSTAMP:{stamp}',
+            f'DTSTART;VALUE=DATE:{date:%Y%m%d}',
+            f'DTEND;VALUE=DATE:{date + datetime.timedelta(days=1):%Y%m%d}',
+            'SUMMARY:' + ical_escape(
+                f"{event['name']} {status.lower()}: {event['vehicle_name']}"),
+            'DESCRIPTION:' + ical_escape(
+                f"{status} at an estimated {event['est_mileage']:,} miles."),
+            'URL:' + url_for(
+                'maintenance',
+                maintenance_id=event['maintenance_id'],
+                _external=True),
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return ''.join(ical_fold(line) + '\r\n' for line in lines)
+
+
+def user_calendar(user_id, months):
+    """ Returns the user's iCalendar feed and its cache key. Feeds are cached
+    until the day changes or any of the user's vehicles are added, changed or
+    deleted. """
+    count, updated_at = db.session.query(
+        func.count(Vehicle.vehicle_id), func.max(Vehicle.updated_at)).filter(
+            Vehicle.user_id == user_id).one()
+    today = clock.today()
+    key = f'{user_id}-{months}-{today}-{count}-{updated_at}'
+
+    if key in calendar_cache:
+        calendar_cache.move_to_end(key)
+    else:
+        calendar_cache[key] = render_calendar(
+            user_forecast(user_id, months, today))
+        while len(calendar_cache) > app.config['CALENDAR_CACHE_SIZE']:
+            calendar_cache.popitem(last=False)
+
+    return calendar_cache[key], key
@@ -1,7 +1,8 @@
 """ Forms used throughout the web app, using WTForms. """
+import math
 from datetime import date
 
-from flask import flash
+from flask import flash, request
 from flask_wtf import FlaskForm
 from werkzeug.security import check_password_hash
 from wtforms import (BooleanField, HiddenField, PasswordField, StringField,
@@ -10,22 +11,36 @@ from wtforms.fields.html5 import DateField, IntegerField
 from wtforms.validators import (DataRequired, Email, EqualTo, Length,
                                 NumberRange, Optional)
 
-from auto_maint.models import Odometer, User
+from auto_maint import clock
+from auto_maint.catalog import catalog
+from auto_maint.models import User, email_registered, route_email
+from auto_maint.throttle import failed_logins, login_throttle
 
 
 def available(form, field):
     """ Check if the user's email address has not already been registered on the
     web app. """
     # Ensure no other registered users have that email
-    if User.query.filter(User.email == field.data).count():
+    if email_registered(field.data):
         raise ValidationError('Email already registered.')
 
 
+def form_user(form):
+    """ Returns the user with the form's email address, querying the DB only
+    once per form. """
+    if not hasattr(form, 'user'):
+        form.user = None
+        if route_email(form.email.data):
+            form.user = User.query.filter(
+                User.email == form.email.data).first()
+    return form.user
+
+
 def user_authenticate(form, field):
     """ Ensure user exists, is not blocked and that the provided password was
     correct. """
     # Query the DB for a matching email address and save it as user object
-    user = User.query.filter(User.email == field.data).first()
+    user = form_user(form)
 
     # Check if user exists
     if not user:
@@ -34,12 +49,11 @@ def user_authenticate(form, field):
 
 def pw_authenticate(form, field):
     """ Authenticate the user's password by checking the stored hash. """
-    user = User.query.filter(User.email == form.email.data).first()
+    user = form_user(form)
     # Check if User known
     if user:
-        # Check if blocked
+        # Check if blocked, which needn't be recorded again
         if user.blocked:
-            user.failed_login()
             raise ValidationError()
 
         elif not user.email_confirmed:
@@ -53,18 +67,28 @@ def pw_authenticate(form, field):
 
         # Check if correct password
         elif not check_password_hash(user.password_hash, field.data):
-            # Record a failed login
-            user.failed_login()
+            # Record a failed login, written to the DB in a later batch
+            failed_logins.record(user)
             raise ValidationError('Incorrect password provided.')
 
         # Record a succesful login
         else:
+            failed_logins.reset(user.user_id)
             user.successful_login()
 
 
+def known_schedule(form, field):
+    """ Ensure the catalog has a schedule for the make and model in the year
+    the vehicle was manufactured. """
+    if form.manufactured.data and not catalog().lookup(
+            field.data, form.manufactured.data.year):
+        raise ValidationError(
+            'No maintenance schedule known for that make, model and year.')
+
+
 def logical_date(form, field):
     """ Ensure provided date isn't in the future or prior to 1900. """
-    if field.data > date.today():
+    if field.data > clock.today():
         raise ValidationError('Date cannot be in the future.')
     if field.data < date(1900, 1, 1):
         raise ValidationError('Date cannot be earlier than year 1900.')
@@ -81,15 +105,13 @@ def greater_odometer(form, field):
 def logical_log_mileage(form, field):
     """ Ensure that log mileage is logical when compared with existing odometer
     readings. """
-    # Check the odometer values before and after from the database.
-    odo_before = Odometer.query.filter(
-        form.vehicle.data.vehicle_id == Odometer.vehicle_id).filter(
-            Odometer.reading_date < form.log_date.data).order_by(
-                Odometer.reading_date.desc()).first()
-    odo_after = Odometer.query.filter(
-        form.vehicle.data.vehicle_id == Odometer.vehicle_id).filter(
-            Odometer.reading_date > form.log_date.data).order_by(
-                Odometer.reading_date).first()
+    # Without a valid date there is nothing to compare against
+    if form.log_date.data is None:
+        return
+
+    # Find the odometer values before and after from the vehicle's timeline.
+    odo_before, odo_after = form.vehicle.data.timeline().bracket(
+        form.log_date.data)
 
     logical = True
 
@@ -154,7 +176,26 @@ class RegistrationForm(FlaskForm):
     submit_registration = SubmitField('Register')
 
 
-class LoginForm(FlaskForm):
+class ThrottledForm(FlaskForm):
+    """ Form checking a password, rejecting attempts over the login rate limits
+    before any other validation. """
+
+    def validate(self):
+        wait = login_throttle.attempt(request.remote_addr, self.email.data)
+        if wait:
+            self.password_field().errors = [
+                'Too many login attempts. Please try again in {} seconds.'
+                .format(math.ceil(wait))
+            ]
+            return False
+        return super().validate()
+
+    def password_field(self):
+        """ Returns the field for the password being checked. """
+        return self.password
+
+
+class LoginForm(ThrottledForm):
     """ Form to login app users. """
     email = StringField(
         'Email', [DataRequired(), Email(), user_authenticate],
@@ -174,6 +215,9 @@ class AddVehicleForm(FlaskForm):
     current_mileage = IntegerField(
         'Current Mileage',
         [DataRequired(), NumberRange(1, 2000000)])
+    schedule = StringField(
+        'Maintenance Schedule', [Optional(), known_schedule],
+        description='Make and model, e.g. Honda Accord')
     standard_schedule = BooleanField('Add Standard Maintenance Schedule')
 
 
@@ -278,7 +322,7 @@ class UpdateEmail(FlaskForm):
     submit_email = SubmitField('Update Email')
 
 
-class UpdatePassword(FlaskForm):
+class UpdatePassword(ThrottledForm):
     email = HiddenField()
     current_password = PasswordField(
         'Current Password', [DataRequired(), pw_authenticate],
@@ -295,6 +339,13 @@ class UpdatePassword(FlaskForm):
         validators=[DataRequired()], description='Confirm New Password')
     submit_password = SubmitField('Update Password')
 
+    def password_field(self):
+        return self.current_password
+
+
+class ResetCalendar(FlaskForm):
+    submit_calendar = SubmitField('Reset Address')
+
 
 class ForgotPassword(FlaskForm):
     email = StringField(
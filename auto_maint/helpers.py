@@ -1,9 +1,14 @@
 """ Helpful functions used in the auto_maint app. """
 import os
 import smtplib
+import threading
+import time
 from functools import wraps
 
-from flask import redirect, session
+from flask import current_app, redirect, session
+
+# Messages captured instead of sent when MAIL_SUPPRESS_SEND is enabled.
+outbox = []
 
 
 def login_required(f):
@@ -23,7 +28,12 @@ def login_required(f):
 
 
 def send_email(message):
-    """ Sends the provided email message using SMTP. """
+    """ Sends the provided email message using SMTP. If MAIL_SUPPRESS_SEND is
+    enabled the message is stored in the outbox instead. """
+    if current_app.config['MAIL_SUPPRESS_SEND']:
+        outbox.append(message)
+        return
+
     # Send message to the email server.
     server = smtplib.SMTP(os.environ['SMTP_SERVER'])
     server.starttls()
@@ -32,33 +42,35 @@ def send_email(message):
     server.quit()
 
 
-def standard_schedule(vehicle):
-    # Based on a 2001 Honda Accord
-    vehicle.add_maintenance(
-        'Replace Engine Oil',
-        "Check your vehicle's manual to determine the correct oil type.", 7500,
-        12)
-    vehicle.add_maintenance('Replace Oil Filter', '', 15000, 12)
-    vehicle.add_maintenance('Replace Air Cleaner Element', '', 30000, 24)
-    vehicle.add_maintenance('Inspect Valve Clearance', 'Adjust if noisy.',
-                            105000, 84)
-    vehicle.add_maintenance('Replace Spark Plugs', '', 105000, 84)
-    vehicle.add_maintenance('Replace Timing Belt', '', 105000, 84)
-    vehicle.add_maintenance('Replace Balancer Belt', '', 105000, 84)
-    vehicle.add_maintenance('Inspect Water Pump', '', 105000, 84)
-    vehicle.add_maintenance('Inspect and Adjust Drive Belts', '', 30000, 24)
-    vehicle.add_maintenance('Inspect Idle Speed', '', 105000, 84)
-    vehicle.add_maintenance('Replace Engine Coolant', '', 120000, 120)
-    vehicle.add_maintenance('Replace Transmission Fluid', '', 120000, 72)
-    vehicle.add_maintenance('Inspect Front and Rear Brakes', '', 15000, 12)
-    vehicle.add_maintenance('Replace Brake Fluid', '', 45000, 36)
-    vehicle.add_maintenance('Check Parking Brake Adjustment', '', 15000, 12)
-    vehicle.add_maintenance('Replace Air Conditioning Filter', '', 30000, 24)
-    vehicle.add_maintenance(
-        'Rotate Tires',
-        'Check tire inflation and condition at least once per month.', 15000,
-        12)
+class TokenBucket():
+    """ Rate limiter allowing bursts of up to capacity, refilled at rate tokens
+    per second. A rate of 0 is unlimited. Safe to share between threads. """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def try_take(self, tokens=1):
+        """ Take tokens if available. Returns 0 if they were taken, otherwise
+        the number of seconds until they will be. """
+        if not self.rate:
+            return 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens +
+                              (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
 
-    # Add estimated logs for the new maintenance events.
-    for maintenance in vehicle.maintenance:
-        maintenance.est_log()
+    def take(self, tokens=1):
+        """ Take tokens, waiting until they're available. """
+        wait = self.try_take(tokens)
+        while wait:
+            time.sleep(wait)
+            wait = self.try_take(tokens)
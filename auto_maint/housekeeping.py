@@ -0,0 +1,100 @@
+""" Housekeeping job deleting expired sessions and accounts never confirmed.
+Rows are deleted in small batches walked in primary key order, committing and
+pausing between batches so that locks are short and other queries aren't
+starved. When user data is sharded each shard's accounts are purged in turn,
+along with their directory entries. """
+import datetime
+import time
+
+from sqlalchemy import exists
+
+from auto_maint import app, clock, db
+from auto_maint.models import User, UserDirectory, Vehicle
+from auto_maint.sharding import shard_binds, shards, use_shard
+
+
+def purge(session, id_column, condition, batch_size, pause, on_delete=None):
+    """ Delete the rows of id_column's table matching condition in batches of
+    batch_size, sleeping pause seconds between them, and call on_delete with
+    the ids of each batch if given. Returns the number of rows deleted. """
+    table = id_column.table
+    deleted = 0
+    last_id = None
+
+    while True:
+        # Find the next batch of ids, continuing from the last batch
+        query = session.query(id_column).filter(condition)
+        if last_id is not None:
+            query = query.filter(id_column > last_id)
+        ids = [row[0] for row in query.order_by(id_column).limit(batch_size)]
+        if not ids:
+            break
+
+        # Recheck the condition in case a row changed since it was found
+        result = session.execute(table.delete().where(
+            id_column.in_(ids)).where(condition))
+        session.commit()
+        if on_delete:
+            on_delete(ids)
+        deleted += result.rowcount
+        last_id = ids[-1]
+
+        if len(ids) < batch_size:
+            break
+        time.sleep(pause)
+
+    return deleted
+
+
+def expired_sessions(now):
+    """ Condition matching sessions expired before now, in UTC as
+    Flask-Session writes their expiry. """
+    model = app.session_interface.sql_session_model
+    return model.__table__.c.id, model.expiry < now
+
+
+def stale_accounts(now):
+    """ Condition matching accounts left unconfirmed for longer than
+    UNCONFIRMED_ACCOUNT_DAYS, unless they have added vehicles. """
+    cutoff = now - datetime.timedelta(
+        days=app.config['UNCONFIRMED_ACCOUNT_DAYS'])
+    return User.__table__.c.user_id, (
+        (User.email_confirmed == False) & (User.created_at < cutoff)
+        & ~exists().where(Vehicle.user_id == User.user_id))
+
+
+def forget_users(ids):
+    """ Remove the directory entries of the users with the ids which have
+    been deleted from the selected shard. """
+    if not shard_binds():
+        return
+    remaining = {row[0] for row in db.session.query(User.user_id).filter(
+        User.user_id.in_(ids))}
+    UserDirectory.query.filter(UserDirectory.user_id.in_(
+        set(ids) - remaining)).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def housekeeping(batch_size=None, pause=None):
+    """ Delete expired sessions and stale accounts. Returns the number of rows
+    deleted from each table and the time taken. """
+    batch_size = batch_size or app.config['HOUSEKEEPING_BATCH_SIZE']
+    pause = app.config['HOUSEKEEPING_PAUSE'] if pause is None else pause
+    now = clock.now()
+    start = time.perf_counter()
+
+    with app.app_context():
+        session_db = app.session_interface.db
+        report = {
+            'sessions': purge(session_db.session,
+                              *expired_sessions(clock.utcnow()), batch_size,
+                              pause),
+            'users': 0,
+        }
+        for shard in shards():
+            with use_shard(shard):
+                report['users'] += purge(db.session, *stale_accounts(now),
+                                         batch_size, pause, forget_users)
+
+    report['seconds'] = round(time.perf_counter() - start, 3)
+    return report
@@ -1,11 +1,59 @@
 """ auto_maint app models defined """
 import datetime
+import math
+import secrets
 from email.message import EmailMessage
 
-from flask import render_template, session, url_for
+from flask import g, render_template, session, url_for
 
-from auto_maint import db, ts
+from sqlalchemy import event, inspect, select
+
+from auto_maint import clock, db, ts
 from auto_maint.helpers import send_email
+from auto_maint.sharding import current_shard, place_user, shard_binds
+from auto_maint.timeline import (OdometerTimeline, Reading, cached_timelines,
+                                 forget_timeline)
+
+# next_check for vehicles whose status will not change until their data does.
+NEVER = datetime.datetime(9999, 12, 31)
+
+# Vehicles due maintenance are reminded again this long after a reminder.
+RENOTIFY_AFTER = datetime.timedelta(days=3)
+
+# Users are blocked after this many failed logins.
+MAX_FAILED_LOGINS = 5
+
+
+# Notes of logs estimated from a task's schedule.
+ESTIMATED_LOG_NOTES = ('Autogenerated assuming recommended maintenance '
+                       'schedule previously kept.')
+
+
+def estimated_log(freq_miles, freq_months, mileage, age, today):
+    """ Returns the (date, mileage) when a task was last done, assuming it was
+    done as scheduled on a vehicle age days old with the mileage, or None if
+    it won't have been done yet. """
+    freq_days = (freq_months / 12) * 365.2524
+    if freq_miles < mileage or freq_days < age:
+        return (today - datetime.timedelta(days=age % freq_days),
+                mileage - (mileage % freq_miles))
+    return None
+
+
+def due_status(days_due, miles_due):
+    """ Returns the status of a maintenance task given the days and miles until
+    it is due, as described in Maintenance.status. """
+    # Check if Overdue
+    if days_due == 0 or miles_due == 0:
+        current_status = 'Overdue'
+    # Check if Soon
+    elif days_due < 14 or miles_due < 500:
+        current_status = 'Soon'
+    # Otherwise treat as Good
+    else:
+        current_status = 'Good'
+    # Return finding
+    return current_status
 
 
 class User(db.Model):
@@ -18,6 +66,13 @@ class User(db.Model):
     failed_logins = db.Column(db.SmallInteger, default=0, nullable=False)
     blocked = db.Column(db.Boolean, default=False, nullable=False)
     email_confirmed = db.Column(db.Boolean, default=False, nullable=False)
+    # When the user registered, so abandoned registrations can be purged.
+    created_at = db.Column(
+        db.DateTime, default=clock.now, nullable=True,
+        index=True)
+    # Secret in the address of the user's calendar feed, replaced to revoke
+    # it. Created when the address is first shown.
+    calendar_key = db.Column(db.String(32), nullable=True)
     vehicles = db.relationship('Vehicle', cascade='all,delete', backref='user')
 
     def __init__(self, email, password_hash, name):
@@ -25,25 +80,33 @@ class User(db.Model):
         self.email = email
         self.password_hash = password_hash
         self.name = name
+        if shard_binds():
+            # Take an id from the directory and place the user in a shard
+            entry = UserDirectory(email=email, shard=place_user(email))
+            db.session.add(entry)
+            db.session.flush()
+            self.user_id = entry.user_id
+            g.shard = entry.shard
         db.session.add(self)
         db.session.commit()
 
     def successful_login(self):
         """ Method to record and handle a successful login and creation of
         session. """
-        # Save user id as session user id
+        # Save user id as session user id, with the shard holding their data
         session["user_id"] = self.user_id
-        # Reset failed login attempts
-        self.failed_logins = 0
-        # Commit to DB
-        db.session.commit()
+        session['shard'] = current_shard()
+        # Reset failed login attempts, only writing if there were any
+        if self.failed_logins:
+            self.failed_logins = 0
+            db.session.commit()
 
-    def failed_login(self):
-        """ Method to record a failed login. """
-        # Record the failed login
-        self.failed_logins += 1
+    def failed_login(self, count=1):
+        """ Method to record failed logins. """
+        # Record the failed logins
+        self.failed_logins += count
         # Check if over block limit
-        if self.failed_logins >= 5:
+        if self.failed_logins >= MAX_FAILED_LOGINS:
             self.blocked = True
         # Commit to db
         db.session.commit()
@@ -87,20 +150,113 @@ class User(db.Model):
         # Send email
         send_email(msg)
 
+    def calendar_token(self):
+        """ Returns the signed token identifying the user's calendar feed. """
+        if not self.calendar_key:
+            self.reset_calendar_key()
+        return ts.dumps([self.user_id, self.calendar_key], salt='calendar-key')
+
+    def reset_calendar_key(self):
+        """ Give the user a new calendar key, so that the old address of their
+        calendar feed stops working. """
+        self.calendar_key = secrets.token_hex(16)
+        db.session.commit()
+
+    def change_email(self, email):
+        """ Change the user's email address, and their directory entry if
+        user data is sharded. """
+        self.email = email
+        if shard_binds():
+            UserDirectory.query.filter(
+                UserDirectory.user_id == self.user_id).update(
+                    {'email': email}, synchronize_session=False)
+        db.session.commit()
+
     def delete(self):
         """ Method to delete the current vehicle object from the DB. """
         db.session.delete(self)
+        if shard_binds():
+            UserDirectory.query.filter(
+                UserDirectory.user_id == self.user_id).delete(
+                    synchronize_session=False)
         db.session.commit()
 
+    def nav_vehicles(self, limit=10):
+        """ Returns up to limit of the user's vehicles by name for the nav
+        menu, and whether they have more. """
+        vehicles = Vehicle.query.filter(
+            Vehicle.user_id == self.user_id).order_by(
+                Vehicle.vehicle_name, Vehicle.vehicle_id).limit(limit + 1).all()
+        return vehicles[:limit], len(vehicles) > limit
+
+
+class UserDirectory(db.Model):
+    """ The shard holding each user's data, by email address for logins.
+    Kept in the primary database when user data is sharded, where it also
+    gives users ids unique across the shards. """
+    __tablename__ = "user_directory"
+    user_id = db.Column(db.Integer, primary_key=True)
+    email = db.Column(db.String(256), unique=True, nullable=False)
+    shard = db.Column(db.SmallInteger, nullable=False)
+
+
+def route_email(email):
+    """ Route queries of user data to the shard of the user with the email.
+    Returns False if user data is sharded and no user has the email. """
+    if not shard_binds():
+        return True
+    entry = UserDirectory.query.filter(UserDirectory.email == email).first()
+    if entry:
+        g.shard = entry.shard
+    return entry is not None
+
+
+def route_user(user_id):
+    """ Route queries of user data to the shard of the user with the id.
+    Returns False if user data is sharded and no user has the id. """
+    if not shard_binds():
+        return True
+    entry = UserDirectory.query.get(user_id)
+    if entry:
+        g.shard = entry.shard
+    return entry is not None
+
+
+def email_registered(email):
+    """ Returns True if a user has registered the email address, looking it
+    up in the directory if user data is sharded. """
+    if shard_binds():
+        return UserDirectory.query.filter(
+            UserDirectory.email == email).count() > 0
+    return User.query.filter(User.email == email).count() > 0
+
 
 class Vehicle(db.Model):
     """ Vehicle of a user and related methods. """
     __tablename__ = "vehicles"
     vehicle_id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.ForeignKey("users.user_id"), nullable=False)
+    user_id = db.Column(
+        db.ForeignKey("users.user_id"), nullable=False, index=True)
     vehicle_name = db.Column(db.String(64), nullable=False)
     vehicle_built = db.Column(db.Date, nullable=False)
     last_notification = db.Column(db.DateTime, nullable=True)
+    # When the notifier should next look at the vehicle. NULL when its data
+    # has changed and the time needs recalculating.
+    next_check = db.Column(db.DateTime, nullable=True, index=True)
+    # When the vehicle or its readings, tasks or logs last changed.
+    updated_at = db.Column(
+        db.DateTime, default=clock.now, nullable=True,
+        index=True)
+    # Precomputed due state for the fleet dashboard: when the vehicle's first
+    # task becomes Soon and Overdue, its last reading, and its estimated
+    # mileage as mileage_offset + mileage_per_day * date.toordinal(). Stale
+    # when due_state_at is NULL.
+    due_state_at = db.Column(db.DateTime, nullable=True)
+    soon_date = db.Column(db.Date, nullable=True)
+    overdue_date = db.Column(db.Date, nullable=True)
+    last_reading = db.Column(db.Integer, nullable=True)
+    mileage_per_day = db.Column(db.Float, nullable=True)
+    mileage_offset = db.Column(db.Float, nullable=True)
     odo_readings = db.relationship(
         'Odometer', cascade='all,delete', backref='vehicle')
     maintenance = db.relationship(
@@ -114,17 +270,15 @@ class Vehicle(db.Model):
         db.session.add(self)
         db.session.commit()
 
-    def est_mileage(self):
-        """
-        Returns the current estimated mileage by looking at the last odometer
-        reading and comparing it to the age of the vehicle.
-        """
+    def mileage_rate(self):
+        """ Returns the average miles per day driven between odometer
+        readings, starting from zero miles when the vehicle was built. """
 
-        # Pull a list of sorted odometer readings from the db
-        sorted_odos = sorted(self.odo_readings, key=lambda x: x.reading_date)
+        # Pull a list of sorted odometer readings from the timeline
+        sorted_odos = self.timeline().readings
 
         # Set the reading before to an initial reading of 0
-        reading_before = Odometer(reading=0, reading_date=self.vehicle_built)
+        reading_before = Reading(reading_date=self.vehicle_built, reading=0)
 
         # Initialize empty list for miles per day calculations
         mpd = []
@@ -139,27 +293,46 @@ class Vehicle(db.Model):
             # Set the reading before again for the next iteration
             reading_before = odo
 
+        return sum(mpd) / len(mpd)
+
+    def est_mileage(self):
+        """
+        Returns the current estimated mileage by looking at the last odometer
+        reading and comparing it to the age of the vehicle.
+        """
+        last_odo = self.last_odometer()
+
         # Calculate the estimated current mileage based on average mpd figure
-        days_since = (
-            datetime.date.today() - sorted_odos[-1].reading_date).days
-        avg_mpd = sum(mpd) / len(mpd)
-        estimate = (avg_mpd * days_since) + sorted_odos[-1].reading
+        days_since = (clock.today() - last_odo.reading_date).days
+        estimate = (self.mileage_rate() * days_since) + last_odo.reading
 
         return int(estimate)
 
+    def timeline(self):
+        """ Returns the vehicle's odometer timeline. This is built once per
+        request, from the loaded readings if available or otherwise from a
+        single query. """
+        timelines = cached_timelines()
+        if self.vehicle_id not in timelines:
+            if 'odo_readings' in self.__dict__:
+                readings = [(odo.reading_date, odo.reading)
+                            for odo in self.odo_readings]
+            else:
+                readings = db.session.query(
+                    Odometer.reading_date, Odometer.reading).filter(
+                        Odometer.vehicle_id == self.vehicle_id)
+            timelines[self.vehicle_id] = OdometerTimeline(readings)
+        return timelines[self.vehicle_id]
+
     def last_odometer(self):
         """ Method to provide last odometer reading for the vehicle. """
-        # Search for all odometer readings for the vehicle.
-        # Show descending / only first
-        odo = Odometer.query.filter(
-            self.vehicle_id == Odometer.vehicle_id).order_by(
-                Odometer.reading_date.desc()).first()
-        return odo
-
-    def add_odom_reading(self, mileage, date=datetime.date.today()):
-        """ Method to add an odometer reading """
+        return self.timeline().last()
+
+    def add_odom_reading(self, mileage, date=None):
+        """ Method to add an odometer reading, dated today unless given. """
         new_reading = Odometer(
-            vehicle_id=self.vehicle_id, reading=mileage, reading_date=date)
+            vehicle_id=self.vehicle_id, reading=mileage,
+            reading_date=date or clock.today())
 
         # Find any odometer reading on the same date and delete it.
         same_date = Odometer.query.filter(
@@ -171,6 +344,7 @@ class Vehicle(db.Model):
         # Write to DB
         db.session.add(new_reading)
         db.session.commit()
+        forget_timeline(self.vehicle_id)
 
     def add_maintenance(self, name, description, freq_miles, freq_months):
         """ Method to add a maintenance event for the vehicle. """
@@ -196,7 +370,7 @@ class Vehicle(db.Model):
     def age(self):
         """ Returns the age of the vehicle in days."""
 
-        today = datetime.date.today()
+        today = clock.today()
         age = (today - self.vehicle_built).days
 
         return age
@@ -218,7 +392,42 @@ class Vehicle(db.Model):
 
     def notification_sent(self):
         """ Records when notifcation has been sent. """
-        self.last_notification = datetime.datetime.today()
+        self.last_notification = clock.now()
+        db.session.commit()
+
+    def schedule_next_check(self, renotify_at=None):
+        """ Set next_check to the earliest time one of the vehicle's tasks
+        changes status, or renotify_at if that is sooner. Vehicles with no
+        upcoming changes are set to NEVER. """
+        today = clock.today()
+        candidates = [NEVER]
+        for maintenance in self.maintenance:
+            # A change estimated for today or earlier which hasn't happened
+            # yet is moved to tomorrow by due_dates rather than skipped.
+            candidates.extend(
+                datetime.datetime.combine(date, datetime.time())
+                for date in maintenance.due_dates() if date > today)
+        if renotify_at:
+            candidates.append(renotify_at)
+        self.next_check = min(candidates)
+
+    @staticmethod
+    def notifications_sent(vehicle_ids):
+        """ Records a notification sent covering several vehicles, in a single
+        statement, and schedules their next check for when they can be
+        reminded again. Until then a check could only reschedule them. """
+        now = clock.now()
+        Vehicle.query.filter(Vehicle.vehicle_id.in_(vehicle_ids)).update(
+            {'last_notification': now, 'next_check': now + RENOTIFY_AFTER},
+            synchronize_session=False)
+        db.session.commit()
+
+    @staticmethod
+    def notifications_failed(vehicle_ids):
+        """ Clears the next check of vehicles whose notification couldn't be
+        sent, so that the next notifier run tries again. """
+        Vehicle.query.filter(Vehicle.vehicle_id.in_(vehicle_ids)).update(
+            {'next_check': None}, synchronize_session=False)
         db.session.commit()
 
 
@@ -235,6 +444,7 @@ class Odometer(db.Model):
         """ Method to delete the odomter reading. """
         db.session.delete(self)
         db.session.commit()
+        forget_timeline(self.vehicle_id)
 
 
 class Maintenance(db.Model):
@@ -247,6 +457,9 @@ class Maintenance(db.Model):
     description = db.Column(db.String(256), nullable=True)
     freq_miles = db.Column(db.Integer, nullable=False)
     freq_months = db.Column(db.Integer, nullable=False)
+    # Precomputed by the fleet dashboard along with the vehicle's due state.
+    soon_date = db.Column(db.Date, nullable=True)
+    overdue_date = db.Column(db.Date, nullable=True, index=True)
     logs = db.relationship('Log', cascade='all,delete', backref='maintenance')
 
     def __init__(self, vehicle_id, name, description, freq_miles, freq_months):
@@ -281,18 +494,16 @@ class Maintenance(db.Model):
         activity was undertaken in the past in accordance with the maintenance
         schedule. """
 
-        last_odo = self.vehicle.last_odometer().reading
-        freq_days = (self.freq_months / 12) * 365.2524
+        log = estimated_log(self.freq_miles, self.freq_months,
+                            self.vehicle.last_odometer().reading,
+                            self.vehicle.age(), clock.today())
 
-        if self.freq_miles < last_odo or freq_days < self.vehicle.age():
+        if log:
             new_log = Log(
                 maintenance_id=self.maintenance_id,
-                date=datetime.date.today() -
-                datetime.timedelta(days=self.vehicle.age() % freq_days),
-                mileage=last_odo - (last_odo % self.freq_miles),
-                notes=
-                'Autogenerated assuming recommended maintenance schedule '\
-                'previously kept.')
+                date=log[0],
+                mileage=log[1],
+                notes=ESTIMATED_LOG_NOTES)
 
             # Write to DB
             db.session.add(new_log)
@@ -326,9 +537,9 @@ class Maintenance(db.Model):
         sorted_logs = sorted(self.logs, key=lambda x: x.date)
 
         if sorted_logs:
-            days_since = datetime.date.today() - sorted_logs[-1].date
+            days_since = clock.today() - sorted_logs[-1].date
         else:
-            days_since = datetime.date.today() - self.vehicle.vehicle_built
+            days_since = clock.today() - self.vehicle.vehicle_built
 
         # Convert frequency to days and compare
         days_due = ((self.freq_months / 12) * 365.2524) - days_since.days
@@ -340,6 +551,59 @@ class Maintenance(db.Model):
         # Return value as an integer.
         return int(days_due)
 
+    def status_changes(self):
+        """ Returns the dates on which the task becomes Soon and then Overdue,
+        by the calendar or by estimated mileage, whichever comes first. """
+        # Count from the last log entry, or the vehicle's manufacture
+        sorted_logs = sorted(self.logs, key=lambda x: x.date)
+        if sorted_logs:
+            last_date = sorted_logs[-1].date
+            last_miles = sorted_logs[-1].mileage
+        else:
+            last_date = self.vehicle.vehicle_built
+            last_miles = 0
+
+        # Days since the last log at which days_until_due drops below 14 and
+        # then to 0.
+        freq_days = (self.freq_months / 12) * 365.2524
+        soon = [last_date + datetime.timedelta(
+            days=math.floor(freq_days - 14) + 1)]
+        overdue = [last_date + datetime.timedelta(
+            days=math.floor(freq_days - 1) + 1)]
+
+        # Days at the current mileage rate until miles_until_due drops below
+        # 500 and then to 0. As est_mileage truncates, the change to Soon may
+        # come a day after the date given, see due_dates.
+        rate = self.vehicle.mileage_rate()
+        if rate > 0:
+            last_odo = self.vehicle.last_odometer()
+            for dates, miles_due in ((soon, 500), (overdue, 0)):
+                target = last_miles + self.freq_miles - miles_due
+                days = math.ceil((target - last_odo.reading) / rate)
+                dates.append(
+                    last_odo.reading_date + datetime.timedelta(days=days))
+
+        return min(soon), min(overdue)
+
+    def due_dates(self):
+        """ Returns the dates on which the task is Soon and Overdue, as
+        status_changes but corrected to agree with the task's status today. """
+        soon, overdue = self.status_changes()
+        today = clock.today()
+        tomorrow = today + datetime.timedelta(days=1)
+        status = self.status()
+
+        if status == 'Overdue':
+            overdue = min(overdue, today)
+        else:
+            overdue = max(overdue, tomorrow)
+        if status == 'Good':
+            soon = max(soon, tomorrow)
+        else:
+            soon = min(soon, today)
+
+        return min(soon, overdue), overdue
+
     def status(self):
         """
         Check the status of the maintenance task.
@@ -349,20 +613,7 @@ class Maintenance(db.Model):
         Returns 'Overdue' if due within 0 miles or 0 days.
         """
         # Check the number of days and miles until due.
-        days_due = self.days_until_due()
-        miles_due = self.miles_until_due()
-
-        # Check if Overdue
-        if days_due == 0 or miles_due == 0:
-            current_status = 'Overdue'
-        # Check if Soon
-        elif days_due < 14 or miles_due < 500:
-            current_status = 'Soon'
-        # Otherwise treat as Good
-        else:
-            current_status = 'Good'
-        # Return finding
-        return current_status
+        return due_status(self.days_until_due(), self.miles_until_due())
 
     def delete(self):
         """ Method to delete the maintenance task. """
@@ -384,3 +635,85 @@ class Log(db.Model):
         """ Method to delete the log. """
         db.session.delete(self)
         db.session.commit()
+
+
+class DeadLetter(db.Model):
+    """ Reminder email which couldn't be delivered after retrying, kept so it
+    can be investigated or resent. """
+    __tablename__ = "dead_letters"
+    dead_letter_id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(256), nullable=False)
+    subject = db.Column(db.String(256), nullable=False)
+    message = db.Column(db.Text, nullable=False)
+    # Comma separated ids of the vehicles the reminder covered
+    vehicle_ids = db.Column(db.String(256), nullable=False)
+    error = db.Column(db.Text, nullable=False)
+    attempts = db.Column(db.SmallInteger, nullable=False)
+    failed_at = db.Column(
+        db.DateTime, default=clock.now, nullable=False)
+
+
+class BackfillCheckpoint(db.Model):
+    """ Progress of a backfill, which resumes after the last key it
+    processed. """
+    __tablename__ = "backfill_checkpoints"
+    name = db.Column(db.String(64), primary_key=True)
+    last_key = db.Column(db.Integer, nullable=True)
+    rows_done = db.Column(db.Integer, default=0, nullable=False)
+    started_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+
+@event.listens_for(db.session, 'after_flush')
+def mark_vehicles_changed(session, flush_context):
+    """ Clear next_check and due_state_at on vehicles whose readings, tasks,
+    logs or build date have changed, so the notifier and fleet dashboard
+    recalculate them, and stamp updated_at so the fleet snapshot and forecast
+    calendars pick up the change. A change of name only stamps updated_at. """
+    vehicle_ids = set()
+    maintenance_ids = set()
+    renamed_ids = set()
+
+    for obj in list(session.new) + list(session.dirty) + list(
+            session.deleted):
+        if isinstance(obj, (Odometer, Maintenance)):
+            vehicle_ids.add(obj.vehicle_id)
+        elif isinstance(obj, Log):
+            maintenance_ids.add(obj.maintenance_id)
+        elif (isinstance(obj, Vehicle) and obj not in session.new and
+              inspect(obj).attrs.vehicle_built.history.has_changes()):
+            vehicle_ids.add(obj.vehicle_id)
+        elif (isinstance(obj, Vehicle) and obj not in session.new and
+              inspect(obj).attrs.vehicle_name.history.has_changes()):
+            renamed_ids.add(obj.vehicle_id)
+
+    table = Vehicle.__table__
+    values = {
+        'next_check': None,
+        'due_state_at': None,
+        'updated_at': clock.now()
+    }
+    if renamed_ids - vehicle_ids:
+        session.execute(table.update().where(
+            table.c.vehicle_id.in_(renamed_ids - vehicle_ids)).values(
+                updated_at=values['updated_at']))
+    if vehicle_ids:
+        session.execute(table.update().where(
+            table.c.vehicle_id.in_(vehicle_ids)).values(values))
+    if maintenance_ids:
+        session.execute(table.update().where(
+            table.c.vehicle_id.in_(
+                select([Maintenance.vehicle_id]).where(
+                    Maintenance.maintenance_id.in_(maintenance_ids)))).values(
+                        values))
+
+
+def mark_changed(session, vehicle_ids):
+    """ Mark the vehicles changed, as the after flush listener does, for
+    writes it doesn't see such as core inserts. """
+    table = Vehicle.__table__
+    session.execute(table.update().where(
+        table.c.vehicle_id.in_(vehicle_ids)).values(
+            next_check=None, due_state_at=None,
+            updated_at=clock.now()))
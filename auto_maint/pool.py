@@ -0,0 +1,191 @@
+""" Database connection pooling. Pool sizes, recycling, pre-ping and statement
+timeouts are configured separately for the web app and the notifier, and the
+pool records how long checkouts wait so exhaustion can be monitored. """
+import logging
+import os
+import threading
+import time
+
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import text
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+
+# The app's logger, which can't be imported here as the app imports this.
+logger = logging.getLogger('flask.app')
+
+# Defaults for each role, overridden by DB_* environment variables for the web
+# app and NOTIFIER_DB_* variables for the notifier.
+ROLE_DEFAULTS = {
+    'web': {
+        'pool_size': 5,
+        'max_overflow': 5,
+        'pool_timeout': 10,
+        'pool_recycle': 300,
+        'pool_pre_ping': True,
+        'statement_timeout_ms': 30000,
+    },
+    'notifier': {
+        'pool_size': 2,
+        'max_overflow': 0,
+        'pool_timeout': 30,
+        'pool_recycle': 300,
+        'pool_pre_ping': True,
+        'statement_timeout_ms': 300000,
+    },
+}
+
+# Checkouts waiting longer than this many seconds are counted as waits.
+WAIT_THRESHOLD = 0.005
+
+
+def pool_config(role):
+    """ Returns the pool settings for a role from the environment. """
+    prefix = 'NOTIFIER_DB_' if role == 'notifier' else 'DB_'
+    config = {}
+    for name, default in ROLE_DEFAULTS[role].items():
+        value = os.environ.get(prefix + name.upper())
+        if value is None:
+            config[name] = default
+        elif isinstance(default, bool):
+            config[name] = value == '1'
+        else:
+            config[name] = int(value)
+    return config
+
+
+def apply_pool_config(config, info, options):
+    """ Add the pool settings to the engine options for the database URL. """
+    # In memory SQLite databases need their single connection kept
+    if info.drivername.startswith('sqlite') and info.database in (
+            None, '', ':memory:'):
+        return
+
+    options['poolclass'] = MonitoredQueuePool
+    for name in ('pool_size', 'max_overflow', 'pool_timeout', 'pool_recycle',
+                 'pool_pre_ping'):
+        options[name] = config[name]
+
+    connect_args = options.setdefault('connect_args', {})
+    if info.drivername.startswith('sqlite'):
+        # Pooled connections are shared between threads
+        connect_args['check_same_thread'] = False
+    elif info.drivername.startswith('postgres') and config[
+            'statement_timeout_ms']:
+        connect_args['options'] = (
+            f"-c statement_timeout={config['statement_timeout_ms']}")
+
+    # Send executemany statements, such as bulk inserts, in pages of rows
+    if info.drivername in ('postgres', 'postgresql',
+                           'postgresql+psycopg2'):
+        options['use_batch_mode'] = True
+
+
+class PooledSQLAlchemy(SQLAlchemy):
+    """ Flask-SQLAlchemy creating engines with the pool settings for the
+    process's DB_ROLE. """
+
+    def apply_driver_hacks(self, app, info, options):
+        apply_pool_config(app.config['DB_POOL'][app.config['DB_ROLE']], info,
+                          options)
+        super().apply_driver_hacks(app, info, options)
+
+
+class PoolStats():
+    """ Counts of a pool's checkouts, how long they waited and how often the
+    pool was exhausted. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.timeouts = 0
+        self.last_timeout = None
+
+    def record(self, wait, timed_out=False):
+        """ Record a checkout which waited wait seconds. """
+        with self.lock:
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+            if wait > WAIT_THRESHOLD:
+                self.waits += 1
+            if timed_out:
+                self.timeouts += 1
+                self.last_timeout = time.time()
+
+    def as_dict(self):
+        """ Returns the stats with times in milliseconds. """
+        with self.lock:
+            return {
+                'checkouts': self.checkouts,
+                'waits': self.waits,
+                'wait_mean_ms': (self.wait_total / self.checkouts * 1000
+                                 if self.checkouts else 0.0),
+                'wait_max_ms': self.wait_max * 1000,
+                'timeouts': self.timeouts,
+                'last_timeout': self.last_timeout,
+            }
+
+
+class MonitoredQueuePool(QueuePool):
+    """ QueuePool timing each checkout and logging when it times out because
+    every connection is in use. """
+
+    def __init__(self, creator, **kw):
+        super().__init__(creator, **kw)
+        self.stats = PoolStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeout:
+            self.stats.record(time.perf_counter() - start, timed_out=True)
+            logger.warning('Connection pool exhausted: %s', self.status())
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def engine_health(engine):
+    """ Returns the state of an engine's pool and whether the database can be
+    reached. """
+    pool = engine.pool
+    health = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        health.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': pool.overflow(),
+        })
+    if isinstance(pool, MonitoredQueuePool):
+        health.update(pool.stats.as_dict())
+
+    start = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            connection.execute(text('SELECT 1'))
+        health['reachable'] = True
+    except Exception:
+        logger.exception('Health check of %r failed', engine.url)
+        health['reachable'] = False
+        health['error'] = 'Database unreachable'
+    health['ping_ms'] = (time.perf_counter() - start) * 1000
+
+    return health
+
+
+def dispose_engines(app):
+    """ Discard the pooled connections of the app's engines, so that a forked
+    process opens its own rather than sharing its parent's. """
+    for connector in app.extensions['sqlalchemy'].connectors.values():
+        connector.get_engine().dispose()
@@ -0,0 +1,231 @@
+""" Opt-in profiling of a single request or notifier run, including capture of
+every SQL statement issued and logging of slow queries. """
+import cProfile
+import datetime
+import hmac
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from auto_maint import app
+
+# Directory of the auto_maint package, used to find application call sites.
+THIS_FILE = os.path.abspath(__file__)
+PACKAGE_DIR = os.path.dirname(THIS_FILE)
+
+# A single SQL statement recorded during a profiling session.
+SQLQuery = namedtuple('SQLQuery', 'statement parameters duration site')
+
+# Other recorders of SQL statements, such as query budgets, active per thread.
+_local = threading.local()
+
+
+def active_recorders():
+    """ Returns the list of query recorders active on this thread. """
+    if not hasattr(_local, 'recorders'):
+        _local.recorders = []
+    return _local.recorders
+
+
+def call_site():
+    """ Returns the template line and application line that issued the current
+    SQL statement, as strings or None if not found. """
+    frame = sys._getframe(1)
+    template_line = app_line = None
+
+    while frame and not (template_line and app_line):
+        # Compiled Jinja templates carry a reference to their template object
+        template = frame.f_globals.get('__jinja_template__')
+        filename = frame.f_code.co_filename
+        if template is not None:
+            if template_line is None:
+                template_line = '{}:{}'.format(
+                    template.name,
+                    template.get_corresponding_lineno(frame.f_lineno))
+        elif (app_line is None and filename.startswith(PACKAGE_DIR)
+              and filename != THIS_FILE):
+            app_line = '{}:{} in {}'.format(
+                os.path.relpath(filename, os.path.dirname(PACKAGE_DIR)),
+                frame.f_lineno, frame.f_code.co_name)
+        frame = frame.f_back
+
+    return template_line, app_line
+
+
+class Profile():
+    """ A cProfile session covering one request or notifier run, with the SQL
+    statements issued while it was active. """
+
+    def __init__(self, name):
+        self.name = name
+        self.profiler = cProfile.Profile()
+        self.queries = []
+        self.started = None
+        self.elapsed = None
+
+    def start(self):
+        """ Begin profiling. """
+        self.started = time.perf_counter()
+        self.profiler.enable()
+
+    def stop(self):
+        """ Stop profiling and write the results to disk. Returns the path of
+        the .prof file. """
+        self.profiler.disable()
+        self.elapsed = time.perf_counter() - self.started
+        return self.save()
+
+    def save(self):
+        """ Write the .prof file and a plain text summary to PROFILE_DIR. """
+        os.makedirs(app.config['PROFILE_DIR'], exist_ok=True)
+        stamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        slug = re.sub(r'[^A-Za-z0-9]+', '_', self.name).strip('_')
+        base = os.path.join(app.config['PROFILE_DIR'], f'{stamp}-{slug}')
+
+        self.profiler.dump_stats(base + '.prof')
+        with open(base + '.txt', 'w') as summary:
+            summary.write(self.summary())
+
+        return base + '.prof'
+
+    def summary(self):
+        """ Returns a human readable summary of the session. """
+        sql_time = sum(query.duration for query in self.queries)
+        lines = [
+            f'Profile: {self.name}',
+            f'Total time: {self.elapsed * 1000:.1f} ms',
+            f'SQL statements: {len(self.queries)} ({sql_time:.1f} ms)',
+            '',
+            'Statements by duration:',
+        ]
+        for query in sorted(
+                self.queries, key=lambda x: x.duration, reverse=True):
+            template_line, app_line = query.site
+            lines.append(f'  {query.duration:8.2f} ms  {app_line or "?"}'
+                         f'  {template_line or ""}')
+            lines.append(f'      {" ".join(query.statement.split())}')
+
+        # Append the top of the cProfile output by cumulative time
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        stats.sort_stats('cumulative').print_stats(30)
+        lines.extend(['', stream.getvalue()])
+
+        return '\n'.join(lines)
+
+
+def current_profile():
+    """ Returns the profiling session active in the current app context. """
+    if has_app_context():
+        return g.get('profile')
+    return None
+
+
+@contextmanager
+def profiled(name, enabled=True):
+    """ Profile the enclosed block, such as a notifier run, when enabled. Must
+    be used within an app context. """
+    if not enabled or current_profile():
+        yield None
+        return
+
+    g.profile = Profile(name)
+    g.profile.start()
+    try:
+        yield g.profile
+    finally:
+        path = g.profile.stop()
+        g.profile = None
+        app.logger.warning('Profile of %s written to %s', name, path)
+
+
+def explain(conn, statement, parameters):
+    """ Returns the query plan for a statement as a list of lines. """
+    if conn.dialect.name == 'sqlite':
+        prefix = 'EXPLAIN QUERY PLAN '
+    else:
+        prefix = 'EXPLAIN '
+
+    # Use a raw cursor so the EXPLAIN isn't itself recorded
+    cursor = conn.connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [' '.join(str(col) for col in row) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context,
+                          executemany):
+    """ Record the start time of each SQL statement. """
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context,
+                         executemany):
+    """ Record SQL statements against the active profile and recorders and log
+    any that are slower than SLOW_QUERY_MS. """
+    duration = (time.perf_counter() - conn.info['query_start'].pop()) * 1000
+
+    profile = current_profile()
+    recorders = active_recorders()
+    threshold = app.config['SLOW_QUERY_MS']
+    is_slow = threshold is not None and duration >= threshold
+    if not profile and not recorders and not is_slow:
+        return
+
+    query = SQLQuery(statement, parameters, duration, call_site())
+    site = query.site
+    if profile:
+        profile.queries.append(query)
+    for recorder in recorders:
+        recorder.queries.append(query)
+
+    if is_slow:
+        plan = []
+        if not executemany and statement.lstrip()[:6].upper() == 'SELECT':
+            try:
+                plan = explain(conn, statement, parameters)
+            except Exception as error:
+                plan = [f'EXPLAIN failed: {error}']
+        app.logger.warning(
+            'Slow query (%.1f ms) from %s %s\n%s\n%s\nPlan:\n  %s', duration,
+            site[1] or '?', site[0] or '', statement, parameters,
+            '\n  '.join(plan))
+
+
+@app.before_request
+def start_request_profile():
+    """ Profile the request if enabled for all requests or if the request
+    carries the X-Profile header with the configured token. """
+    token = app.config['PROFILE_TOKEN']
+    header = request.headers.get('X-Profile')
+    requested = bool(token and header
+                     and hmac.compare_digest(header, token))
+
+    if app.config['PROFILE_REQUESTS'] or requested:
+        g.profile = Profile(f'{request.method} {request.path}')
+        g.profile.start()
+
+
+@app.after_request
+def stop_request_profile(response):
+    """ Write out the request profile, if any, and report its location. """
+    profile = current_profile()
+    if profile:
+        path = profile.stop()
+        g.profile = None
+        response.headers['X-Profile-File'] = os.path.basename(path)
+    return response
@@ -0,0 +1,81 @@
+""" Counting of SQL statements, used to guard views and the notifier against
+N+1 query regressions.
+
+Wrap a view request or notifier batch in a query budget, either as a context
+manager or as a decorator on a test:
+
+    with query_budget(20):
+        client.get('/vehicle/1')
+
+    @query_budget(20)
+    def test_vehicle_page():
+        ...
+
+If more statements than the budget are issued QueryBudgetExceeded is raised,
+listing each statement issued more than once with the application and
+template lines that issued it.
+"""
+from collections import OrderedDict
+from contextlib import ContextDecorator
+
+from auto_maint.profiling import active_recorders
+
+
+class QueryBudgetExceeded(AssertionError):
+    """ Raised when a block issues more SQL statements than its budget. """
+
+
+class query_budget(ContextDecorator):
+    """ Records the SQL statements issued within the block and fails if there
+    are more than budget. A budget of None only counts. """
+
+    def __init__(self, budget=None, name=None):
+        self.budget = budget
+        self.name = name
+        self.queries = []
+
+    def __enter__(self):
+        self.queries = []
+        active_recorders().append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        active_recorders().remove(self)
+        if exc_type is None and self.exceeded():
+            raise QueryBudgetExceeded(self.report())
+        return False
+
+    def exceeded(self):
+        """ Whether more statements were issued than the budget. """
+        return self.budget is not None and len(self.queries) > self.budget
+
+    def duplicates(self):
+        """ Returns an ordered dict of each statement issued more than once,
+        mapped to the list of queries issuing it. """
+        grouped = OrderedDict()
+        for query in self.queries:
+            statement = ' '.join(query.statement.split())
+            grouped.setdefault(statement, []).append(query)
+        return OrderedDict((statement, queries)
+                           for statement, queries in grouped.items()
+                           if len(queries) > 1)
+
+    def report(self):
+        """ Returns a description of the statements issued, listing the
+        duplicated statements and where they were issued from. """
+        label = f' in {self.name}' if self.name else ''
+        lines = [f'{len(self.queries)} SQL statements issued{label}, '
+                 f'budget {self.budget}.']
+
+        for statement, queries in self.duplicates().items():
+            lines.append(f'\n{len(queries)}x {statement}')
+            sites = OrderedDict()
+            for query in queries:
+                sites[query.site] = sites.get(query.site, 0) + 1
+            for (template_line, app_line), count in sites.items():
+                line = f'    {count}x from {app_line or "?"}'
+                if template_line:
+                    line += f' via {template_line}'
+                lines.append(line)
+
+        return '\n'.join(lines)
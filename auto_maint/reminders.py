@@ -0,0 +1,125 @@
+""" Reminder email rendering. Vehicles are first summarised as plain data so
+that the reminder template can be rendered away from the database, in
+parallel across a process pool. The pool's processes are forked, so it is
+created before any threads are started, such as those sending the emails. """
+import multiprocessing
+import os
+from contextlib import nullcontext
+from functools import partial
+
+from flask import render_template, url_for
+
+from auto_maint import app
+from auto_maint.models import due_status
+from auto_maint.sharding import current_shard
+
+REMINDER_TEMPLATE = 'email/reminder.html'
+DIGEST_TEMPLATE = 'email/digest.html'
+
+
+def vehicle_summary(vehicle):
+    """ Returns a plain data summary of the vehicle, its owner and the due state
+    of each of its maintenance tasks. """
+    tasks = []
+    for maintenance in vehicle.maintenance:
+        days_due = maintenance.days_until_due()
+        miles_due = maintenance.miles_until_due()
+        tasks.append({
+            'name': maintenance.name,
+            'url': url_for(
+                'maintenance',
+                maintenance_id=maintenance.maintenance_id,
+                vehicle_id=vehicle.vehicle_id,
+                _external=True),
+            'miles_due': miles_due,
+            'days_due': days_due,
+            'status': due_status(days_due, miles_due),
+        })
+
+    # The vehicle takes the most urgent status of its tasks
+    statuses = {task['status'] for task in tasks}
+    if 'Overdue' in statuses:
+        status = 'Overdue'
+    elif 'Soon' in statuses:
+        status = 'Soon'
+    else:
+        status = 'Good'
+
+    return {
+        'shard': current_shard(),
+        'vehicle_id': vehicle.vehicle_id,
+        'vehicle_name': vehicle.vehicle_name,
+        'user_id': vehicle.user_id,
+        'user_name': vehicle.user.name,
+        'email': vehicle.user.email,
+        'status': status,
+        'tasks': tasks,
+    }
+
+
+def user_digests(summaries):
+    """ Group vehicle summaries by user. Returns a list of digest summaries,
+    each covering all of a user's vehicles in the given summaries. """
+    digests = {}
+    for summary in summaries:
+        digest = digests.setdefault(summary['user_id'], {
+            'shard': summary['shard'],
+            'user_id': summary['user_id'],
+            'user_name': summary['user_name'],
+            'email': summary['email'],
+            'vehicles': [],
+        })
+        digest['vehicles'].append(summary)
+    return list(digests.values())
+
+
+def render_reminder(summary, template=REMINDER_TEMPLATE, name='vehicle'):
+    """ Render the reminder email template for a summary, passed to the
+    template under the given name. Returns the summary with its HTML. """
+    return summary, render_template(template, **{name: summary})
+
+
+def init_worker():
+    """ Set up a render process with an app context and the templates
+    compiled. """
+    app.app_context().push()
+    for template in (REMINDER_TEMPLATE, DIGEST_TEMPLATE):
+        app.jinja_env.get_template(template)
+
+
+def render_processes():
+    """ Returns the number of processes to render reminders across. """
+    return app.config['REMINDER_RENDER_PROCESSES'] or os.cpu_count()
+
+
+def render_pool(count):
+    """ Returns a context manager giving a pool of REMINDER_RENDER_PROCESSES
+    processes to render count reminders with, or None if there are fewer than
+    REMINDER_PARALLEL_MIN and they are rendered in this process. """
+    processes = render_processes()
+    if processes <= 1 or count < app.config['REMINDER_PARALLEL_MIN']:
+        return nullcontext()
+
+    # Compile the templates before forking so workers inherit them
+    for template in (REMINDER_TEMPLATE, DIGEST_TEMPLATE):
+        app.jinja_env.get_template(template)
+    return multiprocessing.Pool(processes, initializer=init_worker)
+
+
+def render_reminders(summaries, template=REMINDER_TEMPLATE, name='vehicle',
+                     pool=None):
+    """ Render reminder emails for the summaries, yielding (summary, html)
+    pairs as they complete so they can be sent while others render.
+
+    Rendering happens across the pool from render_pool if given, or in this
+    process if not or there are fewer than REMINDER_PARALLEL_MIN. """
+    render = partial(render_reminder, template=template, name=name)
+
+    if pool is None or len(summaries) < app.config['REMINDER_PARALLEL_MIN']:
+        for summary in summaries:
+            yield render(summary)
+        return
+
+    chunksize = max(1, len(summaries) // (render_processes() * 4))
+    for result in pool.imap_unordered(render, summaries, chunksize):
+        yield result
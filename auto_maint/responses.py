@@ -0,0 +1,118 @@
+""" Response compression and streamed page rendering.
+
+With COMPRESS_RESPONSES enabled, text responses of at least
+COMPRESS_MIN_BYTES are gzip compressed, or brotli compressed if the package is
+installed and the browser accepts it. With STREAM_PAGES enabled, pages
+rendered by render_page are sent as they render, in chunks of up to
+STREAM_CHUNK_BYTES. A chunk is also sent wherever the template contains
+FLUSH_MARKER, so the page's head and the content before an expensive table
+reach the browser while the table is built. """
+import gzip
+import zlib
+
+from flask import (Response, get_flashed_messages, render_template, request,
+                   stream_with_context)
+
+from auto_maint import app
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Templates contain this where the rendered page so far should be sent.
+FLUSH_MARKER = '<!-- flush -->'
+
+# Types of response worth compressing.
+COMPRESS_TYPES = ('text/html', 'text/css', 'text/plain', 'text/calendar',
+                  'application/javascript', 'application/json')
+
+
+def render_page(template_name, **context):
+    """ Render a page template, streaming it if STREAM_PAGES is enabled.
+    Only GET requests are streamed, as form posts are read whole by the
+    page's scripts. """
+    if not app.config['STREAM_PAGES'] or request.method != 'GET':
+        return render_template(template_name, **context)
+
+    # The session is saved before a streamed body renders, so take flashed
+    # messages out of it now. The template's call gets the same messages.
+    get_flashed_messages(with_categories=True)
+
+    app.update_template_context(context)
+    template = app.jinja_env.get_template(template_name)
+    return Response(
+        stream_with_context(chunked(template.generate(context))),
+        mimetype='text/html')
+
+
+def chunked(pieces):
+    """ Join rendered template pieces into chunks, ending a chunk at each
+    FLUSH_MARKER or once it reaches STREAM_CHUNK_BYTES. """
+    chunk_bytes = app.config['STREAM_CHUNK_BYTES']
+    chunk = []
+    size = 0
+    for piece in pieces:
+        chunk.append(piece)
+        size += len(piece)
+        if size >= chunk_bytes or FLUSH_MARKER in piece:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+    if chunk:
+        yield ''.join(chunk)
+
+
+def compress_stream(chunks, encoding):
+    """ Compress a streamed body chunk by chunk, flushing the compressor after
+    each so the browser can render every chunk as it arrives. """
+    level = app.config['COMPRESS_LEVEL']
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=level)
+        for chunk in chunks:
+            yield compressor.process(chunk) + compressor.flush()
+        yield compressor.finish()
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        for chunk in chunks:
+            yield compressor.compress(chunk) + compressor.flush(
+                zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+def init_app(app):
+    """ Compress the app's responses. """
+    app.after_request(compress_response)
+
+
+def compress_response(response):
+    """ Compress text responses if enabled and the browser accepts it. """
+    if (not app.config['COMPRESS_RESPONSES'] or response.status_code != 200
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESS_TYPES):
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encodings = ['br', 'gzip'] if brotli is not None else ['gzip']
+    encoding = request.accept_encodings.best_match(encodings)
+    if not encoding:
+        return response
+
+    if response.is_streamed:
+        # Size unknown, but streamed pages are large
+        response.response = compress_stream(
+            response.iter_encoded(), encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < app.config['COMPRESS_MIN_BYTES']:
+            return response
+        if encoding == 'br':
+            data = brotli.compress(data, quality=app.config['COMPRESS_LEVEL'])
+        else:
+            data = gzip.compress(data, app.config['COMPRESS_LEVEL'])
+        response.set_data(data)
+
+    response.headers['Content-Encoding'] = encoding
+    return response
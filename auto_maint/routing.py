@@ -0,0 +1,108 @@
+""" Read/write routing between the primary database and an optional read
+replica, configured as the 'replica' bind in SQLALCHEMY_BINDS.
+
+Reads go to the replica while g.read_replica is set: for GET requests, unless
+the user has written within REPLICA_STICKY_SECONDS so that they always see
+their own changes, and within replica_reads() blocks for batch jobs. Writes,
+and any reads in a request after it has written, go to the primary. """
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import orm
+from sqlalchemy.sql.expression import CompoundSelect, Select, UpdateBase
+
+from auto_maint.pool import PooledSQLAlchemy
+from auto_maint.sharding import route_shard, shard_engine
+
+REPLICA = 'replica'
+
+
+class RoutingSession(SignallingSession):
+    """ Session sending queries of user data to the selected shard when it
+    is sharded, SELECTs to the replica when reads are routed there, and
+    everything else to the primary. """
+
+    def __init__(self, db, **options):
+        self.db = db
+        super().__init__(db, **options)
+
+    def get_bind(self, mapper=None, clause=None):
+        shard = shard_engine(self.db, self.app, mapper, clause)
+        if self._flushing or isinstance(clause, UpdateBase):
+            # Later reads in a request must see this write
+            if has_app_context() and g.get('route_request'):
+                g.read_replica = False
+                g.wrote = True
+        elif (shard is None and isinstance(clause, (Select, CompoundSelect))
+              and has_app_context() and g.get('read_replica')):
+            return self.db.get_engine(self.app, bind=REPLICA)
+        if shard is not None:
+            return shard
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(PooledSQLAlchemy):
+    """ Flask-SQLAlchemy using a RoutingSession, with the reads of GET
+    requests routed to the replica and their queries of user data to the
+    logged in user's shard. """
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.before_request(route_request)
+        app.before_request(route_shard)
+        app.after_request(record_write)
+
+
+def replica_enabled():
+    """ Returns True if a replica is configured for the current app. """
+    return REPLICA in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+
+
+def route_request():
+    """ Route the reads of GET requests to the replica unless the user wrote
+    recently. """
+    g.route_request = True
+    last_write = session.get('last_write', 0)
+    g.read_replica = (
+        replica_enabled() and request.method in ('GET', 'HEAD') and
+        time.time() - last_write > current_app.config['REPLICA_STICKY_SECONDS'])
+
+
+def record_write(response):
+    """ Note the time of any write in the user's session, so their reads stay
+    on the primary until the replica has caught up. """
+    if replica_enabled() and (g.get('wrote') or request.method not in (
+            'GET', 'HEAD', 'OPTIONS')):
+        session['last_write'] = time.time()
+    return response
+
+
+@contextmanager
+def replica_reads():
+    """ Route reads within the block to the replica, if configured, whether or
+    not the block writes. Used by batch jobs reading rows they don't write,
+    or whose writes aren't read back before the replica catches up. """
+    routed = g.get('read_replica', False)
+    g.read_replica = replica_enabled()
+    try:
+        yield
+    finally:
+        g.read_replica = routed
+
+
+@contextmanager
+def primary_reads():
+    """ Route reads within the block to the primary, for reads of rows about
+    to be updated from them. """
+    routed = g.get('read_replica', False)
+    g.read_replica = False
+    try:
+        yield
+    finally:
+        # Stay on the primary if the block wrote
+        g.read_replica = routed and not g.get('wrote')
@@ -1,42 +1,115 @@
-import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from email.message import EmailMessage
 
-from flask import render_template
+from auto_maint import app, clock, db
+from auto_maint.delivery import Delivery
+from auto_maint.models import RENOTIFY_AFTER
+from auto_maint.profiling import profiled
+from auto_maint.reminders import (DIGEST_TEMPLATE, render_pool,
+                                  render_reminders, user_digests,
+                                  vehicle_summary)
+from auto_maint.routing import replica_reads
+from auto_maint.sharding import shards, use_shard
+from auto_maint.wake import WakeQueue
 
-from auto_maint import app
-from auto_maint.helpers import send_email
-from auto_maint.models import User
 
+# Queues of vehicle wake times by shard, kept between runs of the scheduler.
+wake_queues = defaultdict(WakeQueue)
 
-def notify_users():
+
+def due_reminders(queue):
+    """ Scan phase of the notifier. Looks only at vehicles woken by the queue,
+    rescheduling each, and returns plain data summaries of those that are due
+    maintenance and haven't been notified in the last RENOTIFY_AFTER.
+
+    Vehicles to be notified stay due until their email is sent, when
+    Vehicle.notifications_sent reschedules them, so they are tried again if
+    it isn't. """
+    now = clock.now()
+    summaries = []
+
+    for vehicles in queue.vehicles(queue.due(now), now):
+        for user_vehicle in vehicles:
+            summary = vehicle_summary(user_vehicle)
+            renotify_at = None
+
+            if summary['status'] in ('Soon', 'Overdue'):
+                last_notification = user_vehicle.last_notification
+                if (last_notification
+                        and now - last_notification < RENOTIFY_AFTER):
+                    renotify_at = last_notification + RENOTIFY_AFTER
+                else:
+                    summaries.append(summary)
+                    renotify_at = now
+
+            user_vehicle.schedule_next_check(renotify_at)
+            queue.push(user_vehicle)
+
+        db.session.commit()
+
+    return summaries
+
+
+def scan_shard(queue, shard):
+    """ Scan phase for a single shard, in its own app context and so its own
+    DB session, so that the shards can be scanned in parallel threads. """
+    with app.app_context(), use_shard(shard), replica_reads():
+        return due_reminders(queue)
+
+
+def reminder_message(summary, html):
+    """ Returns the email for a rendered reminder or digest, with the ids of
+    the vehicles it covers and their shard. """
+    # Generate Email message to send
+    msg = EmailMessage()
+    if 'vehicles' in summary:
+        msg['Subject'] = 'Your vehicles are due maintenance'
+        vehicle_ids = [vehicle['vehicle_id'] for vehicle in summary['vehicles']]
+    else:
+        msg['Subject'] = 'Your vehicle is due maintenance'
+        vehicle_ids = [summary['vehicle_id']]
+    msg['From'] = 'auto_maint@liam-bates.com'
+    msg['To'] = summary['email']
+    msg.set_content(html, subtype='html')
+
+    return msg, vehicle_ids, summary['shard']
+
+
+def notify_users(queues=wake_queues):
     """  Routine script to send email notifications when a vehicle is overdue
-    maintenance. """
+    maintenance. With REMINDER_DIGEST enabled users with several vehicles due
+    get a single digest email covering all of them. When user data is sharded
+    the shards are scanned in parallel, each with its queue in queues. """
     # Context to access DB from function
-    with app.app_context():
+    with app.app_context(), profiled('notify_users',
+                                     app.config['PROFILE_NOTIFIER']):
         print("NOTIFY USERS RUNNING")
-        for user in User.query.all():
-            for user_vehicle in user.vehicles:
-                status = user_vehicle.status()
-                if 'Soon' in status or 'Overdue' in status:
-                    if user_vehicle.last_notification:
-                        days_since = datetime.datetime.today(
-                        ) - user_vehicle.last_notification
-                        if days_since < datetime.timedelta(days=3):
-                            continue
-
-                    # Generate Email message to send
-                    msg = EmailMessage()
-                    msg['Subject'] = 'Your vehicle is due maintenance'
-                    msg['From'] = 'auto_maint@liam-bates.com'
-                    msg['To'] = user.email
-
-                    # Generate HTML for email
-                    html = render_template(
-                        'email/reminder.html', vehicle=user_vehicle)
-                    msg.set_content(html, subtype='html')
-
-                    # Send email
-                    send_email(msg)
-
-                    # Update DB to with timestamp
-                    user_vehicle.notification_sent()
+        scans = [(queues[shard], shard) for shard in shards()]
+        if len(scans) == 1:
+            summaries = scan_shard(*scans[0])
+        else:
+            with ThreadPoolExecutor(len(scans)) as executor:
+                results = executor.map(lambda scan: scan_shard(*scan), scans)
+                summaries = [summary for result in results
+                             for summary in result]
+
+        digests = []
+        if app.config['REMINDER_DIGEST']:
+            digests = user_digests(summaries)
+            # Users with a single vehicle due get the usual reminder
+            summaries = [digest['vehicles'][0] for digest in digests
+                         if len(digest['vehicles']) == 1]
+            digests = [digest for digest in digests
+                       if len(digest['vehicles']) > 1]
+
+        # Emails are sent in the background as the rest render. The render
+        # processes are forked before Delivery starts its threads.
+        total = len(digests) + len(summaries)
+        with render_pool(total) as pool, Delivery(total) as delivery:
+            for digest, html in render_reminders(digests, DIGEST_TEMPLATE,
+                                                 'digest', pool):
+                delivery.submit(*reminder_message(digest, html))
+            for summary, html in render_reminders(summaries, pool=pool):
+                delivery.submit(*reminder_message(summary, html))
+        print(delivery.report)
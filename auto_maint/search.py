@@ -0,0 +1,310 @@
+""" Search of a user's vehicle names, maintenance task names and descriptions
+and log notes, returning ranked, paginated results. Every word of the query
+must match, as the start of a word in the text.
+
+On Postgres the text is matched by full text search, using the GIN indexes of
+each table's tsvector created by migration. Other databases, such as SQLite in
+development and the benchmarks, search an in-process inverted index of the
+user's text. Indexes are kept for the most recently searched users and
+brought up to date before each search by re-indexing only the vehicles whose
+updated_at stamp has changed, which covers any write to their tasks and
+logs. """
+import heapq
+import math
+import re
+import threading
+from bisect import bisect_left
+from collections import OrderedDict, defaultdict, namedtuple
+
+from flask import url_for
+from sqlalchemy import and_, literal_column, null, select, union_all
+
+from auto_maint import app, db
+from auto_maint.models import Log, Maintenance, Vehicle
+
+# Text search configuration of the Postgres indexes. The search's tsvectors
+# must be written exactly as the indexes' expressions for them to be used.
+TS_CONFIG = literal_column("'english'")
+
+# Weight of a match of each kind of result, ranking vehicles above their
+# tasks above log notes.
+WEIGHTS = {'vehicle': 1.0, 'task': 0.6, 'log': 0.3}
+
+# Vehicles loaded at a time when indexing a user's text.
+INDEX_CHUNK = 500
+
+WORD = re.compile(r'\w+')
+
+Hit = namedtuple('Hit', 'kind id vehicle_id maintenance_id vehicle_name '
+                        'title text date rank')
+
+# Inverted indexes keyed by user, least recently searched first. The lock
+# only guards the dict, each index having its own lock for its refresh and
+# search, so one user's queries don't hold up another's.
+indexes = OrderedDict()
+index_lock = threading.Lock()
+
+
+def words(text):
+    """ Returns the lower case words of the text. """
+    return WORD.findall(text.lower()) if text else []
+
+
+def user_search(user_id, query, page=1, size=None):
+    """ Returns a page of the user's results for the query, as a list of
+    dicts in rank order, and whether there are more pages. """
+    size = size or app.config['SEARCH_PAGE_SIZE']
+    terms = words(query)[:app.config['SEARCH_MAX_TERMS']]
+    if not terms:
+        return [], False
+
+    offset = (max(page, 1) - 1) * size
+    if db.session.get_bind(Vehicle.__mapper__).dialect.name == 'postgresql':
+        hits = full_text_search(user_id, terms, offset, size + 1)
+    else:
+        hits = index_search(user_id, terms, offset, size + 1)
+    return [describe(hit) for hit in hits[:size]], len(hits) > size
+
+
+def describe(hit):
+    """ Returns the JSON representation of a hit. """
+    result = {
+        'kind': hit.kind,
+        'vehicle_id': hit.vehicle_id,
+        'vehicle_name': hit.vehicle_name,
+        'title': hit.title,
+        'text': hit.text,
+        'rank': round(float(hit.rank), 4),
+    }
+    if hit.kind == 'vehicle':
+        result['url'] = url_for('vehicle', vehicle_id=hit.vehicle_id)
+    else:
+        result['maintenance_id'] = hit.maintenance_id
+        result['url'] = url_for('maintenance',
+                                maintenance_id=hit.maintenance_id)
+    if hit.kind == 'log':
+        result['log_id'] = hit.id
+        result['date'] = hit.date.isoformat()
+    return result
+
+
+def full_text_search(user_id, terms, offset, limit):
+    """ Returns the hits for the terms, as prefixes, ranked by Postgres. """
+    query = db.func.to_tsquery(
+        TS_CONFIG, ' & '.join(f'{term}:*' for term in terms))
+    vehicle_text = db.func.to_tsvector(TS_CONFIG, Vehicle.vehicle_name)
+    task_text = db.func.to_tsvector(
+        TS_CONFIG, Maintenance.name + literal_column("' '") +
+        db.func.coalesce(Maintenance.description, literal_column("''")))
+    log_text = db.func.to_tsvector(
+        TS_CONFIG, db.func.coalesce(Log.notes, literal_column("''")))
+
+    def rank(text, kind):
+        return (db.func.ts_rank(text, query) * WEIGHTS[kind]).label('rank')
+
+    vehicles = select([
+        literal_column("'vehicle'").label('kind'),
+        Vehicle.vehicle_id.label('id'), Vehicle.vehicle_id,
+        null().label('maintenance_id'), Vehicle.vehicle_name,
+        Vehicle.vehicle_name.label('title'), null().label('text'),
+        null().label('date'), rank(vehicle_text, 'vehicle')
+    ]).where(and_(Vehicle.user_id == user_id, vehicle_text.op('@@')(query)))
+    tasks = select([
+        literal_column("'task'").label('kind'),
+        Maintenance.maintenance_id.label('id'), Vehicle.vehicle_id,
+        Maintenance.maintenance_id, Vehicle.vehicle_name,
+        Maintenance.name.label('title'),
+        Maintenance.description.label('text'), null().label('date'),
+        rank(task_text, 'task')
+    ]).select_from(Maintenance.__table__.join(Vehicle.__table__)).where(
+        and_(Vehicle.user_id == user_id, task_text.op('@@')(query)))
+    logs = select([
+        literal_column("'log'").label('kind'), Log.log_id.label('id'),
+        Vehicle.vehicle_id, Maintenance.maintenance_id, Vehicle.vehicle_name,
+        Maintenance.name.label('title'), Log.notes.label('text'), Log.date,
+        rank(log_text, 'log')
+    ]).select_from(Log.__table__.join(Maintenance.__table__).join(
+        Vehicle.__table__)).where(
+            and_(Vehicle.user_id == user_id, log_text.op('@@')(query)))
+
+    hits = union_all(vehicles, tasks, logs).alias('hits')
+    rows = db.session.execute(
+        select([hits]).order_by(hits.c.rank.desc(), hits.c.kind,
+                                hits.c.id).offset(offset).limit(limit))
+    return [Hit(*row) for row in rows]
+
+
+def index_search(user_id, terms, offset, limit):
+    """ Returns the hits for the terms from the user's inverted index. """
+    with index_lock:
+        index = indexes.pop(user_id, None) or SearchIndex()
+        indexes[user_id] = index
+        while len(indexes) > app.config['SEARCH_INDEX_USERS']:
+            indexes.popitem(last=False)
+    with index.lock:
+        index.refresh(user_id)
+        ranked = index.search(terms, offset + limit)[offset:]
+        documents = [index.documents[number] for number, _ in ranked]
+    return load_hits(documents, [score for _, score in ranked])
+
+
+class SearchIndex():
+    """ Inverted index of a user's text. Each document is a vehicle's name, a
+    task's name and description or a log's notes, numbered and held as its
+    (kind, id, vehicle id, maintenance id) and words. Postings give the count
+    of each word in the documents containing it, and the words are kept
+    sorted for prefix matching. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Vehicles' updated_at when they were indexed
+        self.stamps = {}
+        self.documents = {}
+        self.words = {}
+        self.vehicle_documents = defaultdict(list)
+        self.postings = defaultdict(dict)
+        self.sorted_words = []
+        self.next_number = 0
+
+    def refresh(self, user_id):
+        """ Re-index the user's vehicles which have changed since they were
+        indexed, and drop those which have been deleted. """
+        stamps = dict(db.session.query(
+            Vehicle.vehicle_id, Vehicle.updated_at).filter(
+                Vehicle.user_id == user_id))
+        changed = [vehicle_id for vehicle_id, stamp in stamps.items()
+                   if vehicle_id not in self.stamps
+                   or self.stamps[vehicle_id] != stamp]
+        removed = set(self.stamps) - set(stamps)
+        if not changed and not removed:
+            return
+
+        for vehicle_id in removed.union(changed):
+            self.remove(vehicle_id)
+        for start in range(0, len(changed), INDEX_CHUNK):
+            for document, text in vehicle_documents(
+                    changed[start:start + INDEX_CHUNK]):
+                self.add(document, text)
+        self.sorted_words = sorted(self.postings)
+        self.stamps = stamps
+
+    def add(self, document, text):
+        """ Index a document's text. """
+        number = self.next_number
+        self.next_number += 1
+        counts = defaultdict(int)
+        for word in words(text):
+            counts[word] += 1
+        self.documents[number] = document
+        self.words[number] = tuple(counts)
+        self.vehicle_documents[document[2]].append(number)
+        for word, count in counts.items():
+            self.postings[word][number] = count
+
+    def remove(self, vehicle_id):
+        """ Drop the documents of a vehicle. """
+        for number in self.vehicle_documents.pop(vehicle_id, []):
+            del self.documents[number]
+            for word in self.words.pop(number):
+                postings = self.postings[word]
+                del postings[number]
+                if not postings:
+                    del self.postings[word]
+
+    def matches(self, term):
+        """ Returns the indexed words starting with the term. """
+        start = bisect_left(self.sorted_words, term)
+        end = start
+        while (end < len(self.sorted_words)
+               and self.sorted_words[end].startswith(term)):
+            end += 1
+        return self.sorted_words[start:end]
+
+    def search(self, terms, limit):
+        """ Returns up to limit (document number, score) pairs of the
+        documents matching every term, best first. Each term scores its best
+        matching word's count weighted by the word's rarity, and the total is
+        weighted by the kind of document and scaled down for long texts. """
+        total = len(self.documents)
+        scores = None
+        for term in terms:
+            term_scores = {}
+            for word in self.matches(term):
+                postings = self.postings[word]
+                rarity = math.log(1 + total / len(postings))
+                for number, count in postings.items():
+                    if scores is None or number in scores:
+                        score = count * rarity
+                        if score > term_scores.get(number, 0):
+                            term_scores[number] = score
+            if scores is None:
+                scores = term_scores
+            else:
+                scores = {number: score + term_scores[number]
+                          for number, score in scores.items()
+                          if number in term_scores}
+            if not scores:
+                return []
+
+        ranked = ((number, score * WEIGHTS[self.documents[number][0]] /
+                   math.sqrt(len(self.words[number])))
+                  for number, score in scores.items())
+        return heapq.nlargest(limit, ranked,
+                              key=lambda item: (item[1], -item[0]))
+
+
+def vehicle_documents(vehicle_ids):
+    """ Yields the (document, text) of each of the vehicles, their tasks and
+    their logs with notes. """
+    for vehicle_id, name in db.session.query(
+            Vehicle.vehicle_id, Vehicle.vehicle_name).filter(
+                Vehicle.vehicle_id.in_(vehicle_ids)):
+        yield ('vehicle', vehicle_id, vehicle_id, None), name
+
+    for maintenance_id, vehicle_id, name, description in db.session.query(
+            Maintenance.maintenance_id, Maintenance.vehicle_id,
+            Maintenance.name, Maintenance.description).filter(
+                Maintenance.vehicle_id.in_(vehicle_ids)):
+        yield (('task', maintenance_id, vehicle_id, maintenance_id),
+               f"{name} {description or ''}")
+
+    for log_id, vehicle_id, maintenance_id, notes in db.session.query(
+            Log.log_id, Maintenance.vehicle_id, Log.maintenance_id,
+            Log.notes).join(Maintenance).filter(
+                Maintenance.vehicle_id.in_(vehicle_ids), Log.notes != ''):
+        yield ('log', log_id, vehicle_id, maintenance_id), notes
+
+
+def load_hits(documents, scores):
+    """ Returns the hits of the indexed documents with their scores, loading
+    their text. Documents deleted since they were indexed are skipped. """
+    vehicle_names = dict(db.session.query(
+        Vehicle.vehicle_id, Vehicle.vehicle_name).filter(
+            Vehicle.vehicle_id.in_(
+                {document[2] for document in documents})))
+    tasks = {row[0]: row[1:] for row in db.session.query(
+        Maintenance.maintenance_id, Maintenance.name,
+        Maintenance.description).filter(Maintenance.maintenance_id.in_(
+            {document[3] for document in documents if document[3]}))}
+    logs = {row[0]: row[1:] for row in db.session.query(
+        Log.log_id, Log.notes, Log.date).filter(Log.log_id.in_(
+            {document[1] for document in documents
+             if document[0] == 'log'}))}
+
+    hits = []
+    for (kind, id, vehicle_id, maintenance_id), score in zip(documents,
+                                                             scores):
+        if (vehicle_id not in vehicle_names
+                or maintenance_id and maintenance_id not in tasks
+                or kind == 'log' and id not in logs):
+            continue
+        vehicle_name = vehicle_names[vehicle_id]
+        if kind == 'vehicle':
+            title, text, date = vehicle_name, None, None
+        elif kind == 'task':
+            title, text, date = tasks[id] + (None,)
+        else:
+            title, (text, date) = tasks[maintenance_id][0], logs[id]
+        hits.append(Hit(kind, id, vehicle_id, maintenance_id, vehicle_name,
+                        title, text, date, score))
+    return hits
@@ -0,0 +1,82 @@
+""" Horizontal sharding of user data. With SHARD_BINDS set, the users,
+vehicles, odometers, maintenance and logs tables are split across the binds it
+names, each user's rows kept in one shard, while the primary database keeps
+the sessions, the user directory and the other tables.
+
+Queries of the sharded tables go to the shard selected in g.shard. Requests
+select the logged in user's shard, remembered in their session, or the shard
+the user directory gives for an email address or user id. Batch jobs select
+each shard in turn with use_shard(). """
+import zlib
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, session
+from sqlalchemy.sql.util import find_tables
+
+# Tables holding user data, whose rows are split across the shards.
+SHARDED_TABLES = frozenset(
+    ('users', 'vehicles', 'odometers', 'maintenance', 'logs'))
+
+
+def shard_binds():
+    """ Returns the bind names of the shards, which is empty if user data
+    isn't sharded. """
+    return current_app.config['SHARD_BINDS']
+
+
+def shards():
+    """ Returns the shard numbers, or [None] if user data isn't sharded so
+    that jobs run once per shard run once against the primary. """
+    return list(range(len(shard_binds()))) or [None]
+
+
+def place_user(email):
+    """ Returns the shard a new user with the email is placed in, spreading
+    users evenly across the shards. """
+    return zlib.crc32(email.lower().encode()) % len(shard_binds())
+
+
+def current_shard():
+    """ Returns the selected shard, or None if there isn't one. """
+    return g.get('shard') if has_app_context() else None
+
+
+@contextmanager
+def use_shard(shard):
+    """ Route queries of user data within the block to the shard. """
+    selected = g.get('shard')
+    g.shard = shard
+    try:
+        yield
+    finally:
+        g.shard = selected
+
+
+def route_shard():
+    """ Route the request's queries of user data to the shard of the logged
+    in user, if any. """
+    g.shard = session.get('shard')
+
+
+def uses_shards(mapper, clause):
+    """ Returns True if the mapper or clause uses a sharded table. """
+    if mapper is not None:
+        return mapper.mapped_table.name in SHARDED_TABLES
+    if clause is not None:
+        return any(table.name in SHARDED_TABLES
+                   for table in find_tables(clause, include_crud=True))
+    return False
+
+
+def shard_engine(db, app, mapper, clause):
+    """ Returns the selected shard's engine for queries using sharded tables,
+    or None for queries of the primary's tables or if user data isn't
+    sharded. """
+    binds = app.config['SHARD_BINDS']
+    if not binds or not uses_shards(mapper, clause):
+        return None
+
+    shard = current_shard()
+    if shard is None:
+        raise RuntimeError('No shard selected for a query of user data')
+    return db.get_engine(app, bind=binds[shard])
@@ -0,0 +1,307 @@
+""" Columnar on-disk snapshot of the fleet's odometer series, task frequencies
+and last log entries, for batch jobs that need fleet-wide status or
+statistics without reading every row through the ORM.
+
+The snapshot is a directory of NumPy .npy files which are memory-mapped when
+loaded. Per vehicle series are stored flat, with an offsets array giving each
+vehicle's slice: vehicle i's odometer readings are
+odo_reading[odo_offsets[i]:odo_offsets[i + 1]].
+"""
+import datetime
+import json
+import os
+import shutil
+
+import numpy as np
+from sqlalchemy import and_, func, or_
+
+from auto_maint import clock, db
+from auto_maint.models import Log, Maintenance, Odometer, Vehicle
+
+# Arrays making up a snapshot, by the table they describe.
+VEHICLE_ARRAYS = ('vehicle_id', 'vehicle_built')
+ODOMETER_ARRAYS = ('odo_date', 'odo_reading')
+TASK_ARRAYS = ('task_id', 'task_freq_miles', 'task_freq_months',
+               'task_last_date', 'task_last_mileage')
+ARRAYS = VEHICLE_ARRAYS + ODOMETER_ARRAYS + TASK_ARRAYS + ('odo_offsets',
+                                                           'task_offsets')
+
+# Changes made this long before a build may not have been visible to it, so
+# are read again by the next incremental build.
+OVERLAP = datetime.timedelta(minutes=5)
+
+STATUSES = ('Good', 'Soon', 'Overdue')
+
+
+class FleetArrays():
+    """ Columnar arrays describing a set of vehicles, with vectorised versions
+    of the per vehicle and per task calculations in models. """
+
+    def __init__(self, arrays):
+        for name in ARRAYS:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.vehicle_id)
+
+    def odometer_counts(self):
+        """ Number of odometer readings per vehicle. """
+        return np.diff(self.odo_offsets)
+
+    def task_counts(self):
+        """ Number of maintenance tasks per vehicle. """
+        return np.diff(self.task_offsets)
+
+    def task_owner(self):
+        """ Index of the vehicle owning each task. """
+        return np.repeat(np.arange(len(self)), self.task_counts())
+
+    def mileage_rates(self):
+        """ Average miles per day between readings for each vehicle, as
+        calculated by Vehicle.mileage_rate. """
+        counts = self.odometer_counts()
+        owner = np.repeat(np.arange(len(self)), counts)
+
+        # Each reading is compared with the one before, or with zero miles
+        # at the build date for a vehicle's first reading.
+        starts = self.odo_offsets[:-1][counts > 0]
+        prev_date = np.roll(self.odo_date, 1)
+        prev_reading = np.roll(self.odo_reading, 1)
+        prev_date[starts] = self.vehicle_built[counts > 0]
+        prev_reading[starts] = 0
+
+        days = (self.odo_date - prev_date).astype(np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mpd = (self.odo_reading - prev_reading) / days
+            return np.bincount(owner, mpd, len(self)) / counts
+
+    def est_mileage(self, today):
+        """ Estimated current mileage of each vehicle, as calculated by
+        Vehicle.est_mileage, or 0 for a vehicle with no readings. """
+        read = self.odometer_counts() > 0
+        last = self.odo_offsets[1:][read] - 1
+        days_since = (np.datetime64(today, 'D') -
+                      self.odo_date[last]).astype(np.float64)
+        mileage = np.zeros(len(self), np.int64)
+        with np.errstate(invalid='ignore'):
+            mileage[read] = (self.mileage_rates()[read] * days_since +
+                             self.odo_reading[last]).astype(np.int64)
+        return mileage
+
+    def task_due(self, today):
+        """ Days and miles until each task is due, as calculated by
+        Maintenance.days_until_due and miles_until_due. """
+        owner = self.task_owner()
+
+        # Tasks never logged count from the vehicle's build date at 0 miles
+        logged = ~np.isnat(self.task_last_date)
+        last_date = np.where(logged, self.task_last_date,
+                             self.vehicle_built[owner])
+        last_mileage = np.where(logged, self.task_last_mileage, 0)
+
+        days_since = (np.datetime64(today, 'D') - last_date).astype(np.int64)
+        freq_days = (self.task_freq_months / 12) * 365.2524
+        days_due = np.maximum(freq_days - days_since, 0).astype(np.int64)
+
+        miles_since = self.est_mileage(today)[owner] - last_mileage
+        miles_due = np.maximum(self.task_freq_miles - miles_since, 0)
+
+        return days_due, miles_due
+
+    def task_status(self, today):
+        """ Status code of each task: 0 Good, 1 Soon and 2 Overdue. """
+        days_due, miles_due = self.task_due(today)
+        status = np.zeros(len(self.task_id), dtype=np.int8)
+        status[(days_due < 14) | (miles_due < 500)] = 1
+        status[(days_due == 0) | (miles_due == 0)] = 2
+        return status
+
+    def vehicle_status(self, today):
+        """ Status code of each vehicle, the most urgent of its tasks. """
+        owner = self.task_owner()
+        status = np.zeros(len(self), dtype=np.int8)
+        np.maximum.at(status, owner, self.task_status(today))
+        return status
+
+    def statistics(self, today):
+        """ Fleet-wide summary statistics. """
+        status = self.vehicle_status(today)
+        mileage = self.est_mileage(today)
+        return {
+            'vehicles': len(self),
+            'odometer_readings': len(self.odo_reading),
+            'tasks': len(self.task_id),
+            'status': {
+                name: int((status == code).sum())
+                for code, name in enumerate(STATUSES)
+            },
+            'mean_miles_per_day': float(np.nanmean(self.mileage_rates())),
+            'mean_est_mileage': float(mileage.mean()) if len(self) else 0.0,
+        }
+
+
+class FleetSnapshot(FleetArrays):
+    """ A memory-mapped fleet snapshot. """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as meta_file:
+            self.meta = json.load(meta_file)
+        self.built_at = datetime.datetime.strptime(
+            self.meta['built_at'], '%Y-%m-%dT%H:%M:%S.%f')
+
+        super().__init__({
+            name: np.load(os.path.join(path, name + '.npy'), mmap_mode='r')
+            for name in ARRAYS
+        })
+
+
+def query_arrays(changed):
+    """ Read the vehicles matching the changed filter from the database as
+    snapshot arrays, ordered by vehicle. """
+    vehicles = db.session.query(
+        Vehicle.vehicle_id, Vehicle.vehicle_built).filter(changed).order_by(
+            Vehicle.vehicle_id).all()
+    odometers = db.session.query(
+        Odometer.vehicle_id, Odometer.reading_date, Odometer.reading).join(
+            Vehicle).filter(changed).order_by(
+                Odometer.vehicle_id, Odometer.reading_date).all()
+
+    # Latest log of each task, taking the highest mileage on that date
+    last_date = db.session.query(
+        Log.maintenance_id, func.max(Log.date).label('date')).group_by(
+            Log.maintenance_id).subquery()
+    last_log = db.session.query(
+        Log.maintenance_id, Log.date,
+        func.max(Log.mileage).label('mileage')).join(
+            last_date,
+            and_(Log.maintenance_id == last_date.c.maintenance_id,
+                 Log.date == last_date.c.date)).group_by(
+                     Log.maintenance_id, Log.date).subquery()
+    tasks = db.session.query(
+        Maintenance.vehicle_id, Maintenance.maintenance_id,
+        Maintenance.freq_miles, Maintenance.freq_months, last_log.c.date,
+        last_log.c.mileage).join(Vehicle).outerjoin(
+            last_log, Maintenance.maintenance_id ==
+            last_log.c.maintenance_id).filter(changed).order_by(
+                Maintenance.vehicle_id, Maintenance.maintenance_id).all()
+
+    vehicle_id = np.array([row[0] for row in vehicles], np.int64)
+    arrays = {
+        'vehicle_id': vehicle_id,
+        'vehicle_built': np.array([row[1] for row in vehicles],
+                                  'datetime64[D]'),
+        'odo_date': np.array([row[1] for row in odometers], 'datetime64[D]'),
+        'odo_reading': np.array([row[2] for row in odometers], np.int64),
+        'task_id': np.array([row[1] for row in tasks], np.int64),
+        'task_freq_miles': np.array([row[2] for row in tasks], np.int64),
+        'task_freq_months': np.array([row[3] for row in tasks], np.int64),
+        'task_last_date': np.array([row[4] for row in tasks],
+                                   'datetime64[D]'),
+        'task_last_mileage': np.array([row[5] or 0 for row in tasks],
+                                      np.int64),
+    }
+    arrays['odo_offsets'] = offsets(
+        vehicle_id, np.array([row[0] for row in odometers], np.int64))
+    arrays['task_offsets'] = offsets(
+        vehicle_id, np.array([row[0] for row in tasks], np.int64))
+    return arrays
+
+
+def offsets(vehicle_id, owner_id):
+    """ Offsets of each vehicle's slice, given the sorted vehicle ids and the
+    sorted owning vehicle id of each row. """
+    ends = np.searchsorted(owner_id, vehicle_id, side='right')
+    return np.concatenate(([0], ends)).astype(np.int64)
+
+
+def select_vehicles(arrays, keep):
+    """ Returns the snapshot arrays restricted to the vehicles in the boolean
+    mask keep. """
+    selected = {name: np.asarray(arrays[name])[keep]
+                for name in VEHICLE_ARRAYS}
+    for names, offset_name in ((ODOMETER_ARRAYS, 'odo_offsets'),
+                               (TASK_ARRAYS, 'task_offsets')):
+        rows = np.repeat(keep, np.diff(arrays[offset_name]))
+        for name in names:
+            selected[name] = np.asarray(arrays[name])[rows]
+        counts = np.diff(arrays[offset_name])[keep]
+        selected[offset_name] = np.concatenate(
+            ([0], np.cumsum(counts))).astype(np.int64)
+    return selected
+
+
+def merge(old, new):
+    """ Merge two sets of snapshot arrays covering different vehicles into one
+    ordered by vehicle id. """
+    vehicle_id = np.concatenate((old['vehicle_id'], new['vehicle_id']))
+    order = np.argsort(vehicle_id, kind='stable')
+    merged = {
+        name: np.concatenate((old[name], new[name]))[order]
+        for name in VEHICLE_ARRAYS
+    }
+
+    for names, offset_name in ((ODOMETER_ARRAYS, 'odo_offsets'),
+                               (TASK_ARRAYS, 'task_offsets')):
+        counts = np.concatenate(
+            (np.diff(old[offset_name]), np.diff(new[offset_name])))
+        # Sort rows by the position of their owner, keeping their order
+        owner_rank = np.empty(len(order), np.int64)
+        owner_rank[order] = np.arange(len(order))
+        rows = np.argsort(np.repeat(owner_rank, counts), kind='stable')
+        for name in names:
+            merged[name] = np.concatenate((old[name], new[name]))[rows]
+        merged[offset_name] = np.concatenate(
+            ([0], np.cumsum(counts[order]))).astype(np.int64)
+
+    return merged
+
+
+def build_snapshot(path, full=False):
+    """ Build or update the snapshot at path. Unless full, an existing snapshot
+    is updated with only the vehicles changed since it was built, dropping
+    deleted vehicles. Returns the loaded snapshot. """
+    built_at = clock.now()
+    previous = None
+    if not full and os.path.exists(os.path.join(path, 'meta.json')):
+        previous = FleetSnapshot(path)
+
+    if previous is None:
+        arrays = query_arrays(Vehicle.vehicle_id.isnot(None))
+    else:
+        since = previous.built_at - OVERLAP
+        changed = or_(Vehicle.updated_at.is_(None), Vehicle.updated_at > since)
+        changed_ids = [row[0] for row in db.session.query(
+            Vehicle.vehicle_id).filter(changed)]
+        current_ids = [row[0] for row in db.session.query(Vehicle.vehicle_id)]
+
+        keep = (np.isin(previous.vehicle_id, current_ids) &
+                ~np.isin(previous.vehicle_id, changed_ids))
+        arrays = merge(
+            select_vehicles(vars(previous), keep), query_arrays(changed))
+
+    write_snapshot(path, arrays, built_at)
+    return FleetSnapshot(path)
+
+
+def write_snapshot(path, arrays, built_at):
+    """ Write the arrays to a new directory then swap it into place, so
+    readers of the old snapshot are unaffected. """
+    staging = path + '.new'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+
+    for name, array in arrays.items():
+        np.save(os.path.join(staging, name + '.npy'), array)
+    with open(os.path.join(staging, 'meta.json'), 'w') as meta_file:
+        json.dump({
+            'built_at': built_at.strftime('%Y-%m-%dT%H:%M:%S.%f'),
+            'vehicles': len(arrays['vehicle_id']),
+        }, meta_file)
+
+    retired = path + '.old'
+    shutil.rmtree(retired, ignore_errors=True)
+    if os.path.exists(path):
+        os.rename(path, retired)
+    os.rename(staging, path)
+    shutil.rmtree(retired, ignore_errors=True)
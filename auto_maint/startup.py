@@ -0,0 +1,56 @@
+""" Startup of the web workers. With the app preloaded in gunicorn's master,
+see gunicorn.conf.py, warm() does the work each worker would otherwise repeat
+on its first requests before the workers are forked, so they start ready and
+share the results copy-on-write. The garbage collector is kept from touching
+the master's objects in the workers, which would copy their pages. """
+import gc
+
+from flask_wtf import FlaskForm
+
+from auto_maint import app
+from auto_maint.catalog import catalog
+from auto_maint.pool import dispose_engines
+
+
+def form_classes(base=FlaskForm):
+    """ Returns the app's subclasses of the form class. """
+    classes = []
+    for subclass in base.__subclasses__():
+        if subclass.__module__.startswith('auto_maint.'):
+            classes.append(subclass)
+        classes += form_classes(subclass)
+    return classes
+
+
+def warm():
+    """ Compile every template, writing them to the bytecode cache if there
+    is one, bind the fields of every form class and load the schedule
+    catalog, then close the database connections opened doing so, which the
+    workers mustn't inherit. Returns the number of templates and forms
+    warmed. """
+    templates = app.jinja_env.list_templates()
+    for name in templates:
+        app.jinja_env.get_template(name)
+
+    # A form class binds its fields the first time it is instantiated
+    forms = form_classes()
+    with app.test_request_context():
+        for form_class in forms:
+            form_class(meta={'csrf': False})
+
+    catalog()
+    dispose_engines(app)
+    return len(templates), len(forms)
+
+
+def before_fork():
+    """ Move every object the master holds into the collector's permanent
+    generation, which the workers' collections don't scan. Needs Python
+    3.7. """
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+
+def after_fork():
+    """ Set up a forked worker to collect garbage again. """
+    gc.enable()
@@ -0,0 +1,127 @@
+""" Login throttling. Attempts are rate limited per client IP and per account
+by in-process token buckets, checked before the user is queried or their
+password hash checked, so a credential stuffing burst costs neither. Each
+worker process keeps its own buckets.
+
+Failed login counts are kept in memory and written to the DB in a batch by a
+timer LOGIN_FLUSH_SECONDS after the first unwritten failure, and when the
+process exits, except when a user reaches MAX_FAILED_LOGINS and is blocked,
+which is written straight away. """
+import atexit
+import threading
+from collections import OrderedDict
+
+from sqlalchemy import bindparam
+
+from auto_maint import app, db
+from auto_maint.helpers import TokenBucket
+from auto_maint.models import MAX_FAILED_LOGINS, User
+from auto_maint.sharding import current_shard, use_shard
+
+
+class LoginThrottle():
+    """ Token buckets limiting login attempts from each IP and against each
+    account, keeping the LOGIN_THROTTLE_KEYS most recently used. """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+
+    def bucket(self, key, rate, burst):
+        """ Returns the bucket for a key, creating it if needed. """
+        with self.lock:
+            if key in self.buckets:
+                self.buckets.move_to_end(key)
+            else:
+                self.buckets[key] = TokenBucket(rate / 60, burst)
+                while len(self.buckets) > app.config['LOGIN_THROTTLE_KEYS']:
+                    self.buckets.popitem(last=False)
+            return self.buckets[key]
+
+    def attempt(self, ip, email):
+        """ Take an attempt from the IP's and the account's buckets. Returns 0
+        if the attempt is allowed, otherwise the seconds until it would be. """
+        config = app.config
+        wait = self.bucket(('ip', ip), config['LOGIN_IP_PER_MINUTE'],
+                           config['LOGIN_IP_BURST']).try_take()
+        if wait:
+            return wait
+        return self.bucket(('account', (email or '').strip().lower()),
+                           config['LOGIN_ACCOUNT_PER_MINUTE'],
+                           config['LOGIN_ACCOUNT_BURST']).try_take()
+
+
+class FailedLogins():
+    """ Failed login counts not yet written to the DB, by shard and user id.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.timer = None
+
+    def record(self, user):
+        """ Count a failed login by the user, blocking them if it takes them to
+        MAX_FAILED_LOGINS. """
+        key = (current_shard(), user.user_id)
+        with self.lock:
+            count = self.counts.get(key, 0) + 1
+            if user.failed_logins + count >= MAX_FAILED_LOGINS:
+                self.counts.pop(key, None)
+            else:
+                self.counts[key] = count
+                count = 0
+                self.schedule()
+
+        if count:
+            user.failed_login(count)
+
+    def schedule(self):
+        """ Start the timer writing the counts, unless it is running. Called
+        with the lock held. """
+        if self.timer is None:
+            self.timer = threading.Timer(app.config['LOGIN_FLUSH_SECONDS'],
+                                         self.flush_in_context)
+            self.timer.daemon = True
+            self.timer.start()
+
+    def reset(self, user_id):
+        """ Forget the user's unwritten failed logins. """
+        with self.lock:
+            self.counts.pop((current_shard(), user_id), None)
+
+    def flush(self):
+        """ Add the unwritten failed login counts to the DB in one batch per
+        shard. """
+        with self.lock:
+            counts, self.counts = self.counts, {}
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+        by_shard = {}
+        for (shard, user_id), count in counts.items():
+            by_shard.setdefault(shard, []).append(
+                {'u_id': user_id, 'u_count': count})
+
+        users = User.__table__
+        for shard, rows in by_shard.items():
+            with use_shard(shard):
+                db.session.execute(
+                    users.update().where(
+                        users.c.user_id == bindparam('u_id')).values(
+                            failed_logins=users.c.failed_logins
+                            + bindparam('u_count')), rows)
+                db.session.commit()
+
+    def flush_in_context(self):
+        """ Flush from the timer or at exit, outside any request. """
+        with app.app_context():
+            self.flush()
+
+
+login_throttle = LoginThrottle()
+failed_logins = FailedLogins()
+
+# Counts not yet written when the worker exits would otherwise be lost
+atexit.register(failed_logins.flush_in_context)
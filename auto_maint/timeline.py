@@ -0,0 +1,60 @@
+""" Sorted odometer timeline of a vehicle, allowing readings before, after or
+around a date to be found by bisection rather than by separate queries. """
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from flask import g, has_app_context
+
+# A single odometer reading within a timeline.
+Reading = namedtuple('Reading', 'reading_date reading')
+
+
+class OdometerTimeline():
+    """ A vehicle's odometer readings sorted by date. """
+
+    def __init__(self, readings):
+        """ Takes an iterable of (reading_date, reading) pairs. """
+        self.readings = sorted(
+            (Reading(*reading) for reading in readings),
+            key=lambda x: x.reading_date)
+        self.dates = [reading.reading_date for reading in self.readings]
+
+    def __len__(self):
+        return len(self.readings)
+
+    def last(self):
+        """ Returns the most recent reading, or None if there are none. """
+        if self.readings:
+            return self.readings[-1]
+        return None
+
+    def before(self, date):
+        """ Returns the latest reading strictly before the date, or None. """
+        index = bisect_left(self.dates, date)
+        if index:
+            return self.readings[index - 1]
+        return None
+
+    def after(self, date):
+        """ Returns the earliest reading strictly after the date, or None. """
+        index = bisect_right(self.dates, date)
+        if index < len(self.readings):
+            return self.readings[index]
+        return None
+
+    def bracket(self, date):
+        """ Returns the readings either side of the date as a tuple. """
+        return self.before(date), self.after(date)
+
+
+def cached_timelines():
+    """ Returns the per request cache of timelines keyed by vehicle id. Outside
+    of an app context an empty, unshared dict is returned. """
+    if has_app_context():
+        return g.setdefault('odometer_timelines', {})
+    return {}
+
+
+def forget_timeline(vehicle_id):
+    """ Drop a vehicle's cached timeline after its readings change. """
+    cached_timelines().pop(vehicle_id, None)
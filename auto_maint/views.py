@@ -1,16 +1,33 @@
 """ Auto Maintenance views. Also features GET routes for the deletion of
 objects. """
+import hmac
 
-from flask import flash, jsonify, redirect, render_template, request, session
+from flask import (
+    abort, flash, jsonify, redirect, render_template, request, session,
+    url_for)
+from itsdangerous import BadSignature
 from werkzeug.security import generate_password_hash
 
-from auto_maint import app, db, ts
+from auto_maint import app, clock, db, ts
+from auto_maint.bulk import ACTIONS, bulk_action
+from auto_maint.catalog import apply_schedule, catalog, standard_schedule
+from auto_maint.dashboard import (
+    SORTS, overdue_tasks, refresh_due_state, status_counts, vehicle_page,
+    vehicle_statuses)
+from auto_maint.forecast import user_calendar, user_forecast
 from auto_maint.forms import (
     AddVehicleForm, EditMaintenanceForm, EditVehicleForm, ForgotPassword,
     LoginForm, NewLogForm, NewMaintenanceForm, NewOdometerForm,
-    RegistrationForm, ResetPassword, UpdateEmail, UpdateName, UpdatePassword)
-from auto_maint.helpers import login_required, standard_schedule
-from auto_maint.models import Log, Maintenance, Odometer, User, Vehicle
+    RegistrationForm, ResetCalendar, ResetPassword, UpdateEmail, UpdateName,
+    UpdatePassword)
+from auto_maint.helpers import login_required
+from auto_maint.models import (Log, Maintenance, Odometer, User, Vehicle,
+                               route_email, route_user)
+from auto_maint.pool import engine_health
+from auto_maint.responses import render_page
+from auto_maint.routing import REPLICA, replica_enabled
+from auto_maint.search import user_search
+from auto_maint.sharding import current_shard, shard_binds
 
 
 @app.template_filter('mileage')
@@ -100,6 +117,7 @@ def confirm_email(token):
         return redirect('/')
 
     # Find user in DB by email
+    route_email(user_email)
     user = User.query.filter(User.email == user_email).first()
 
     # Set user's email confirmed value to true
@@ -109,6 +127,7 @@ def confirm_email(token):
 
     # Log the user in
     session["user_id"] = user.user_id
+    session['shard'] = current_shard()
 
     # Save to DB
     db.session.commit()
@@ -131,6 +150,7 @@ def password_reset(token):
 
     if reset_form.validate_on_submit():
         # Search DB for user.
+        route_email(user_email)
         user = User.query.filter(User.email == user_email).first()
 
         # Update and store the user's new password hash
@@ -138,6 +158,7 @@ def password_reset(token):
 
         # Log user in
         session["user_id"] = user.user_id
+        session['shard'] = current_shard()
 
         db.session.commit()
 
@@ -160,20 +181,145 @@ def home():
         # Use method to add new odometer reading for the vehicle
         new_vehicle.add_odom_reading(vehicle_form.current_mileage.data)
 
-        if vehicle_form.standard_schedule.data:
+        # Add the schedule from the catalog for the vehicle, if chosen
+        if vehicle_form.schedule.data:
+            apply_schedule(
+                catalog().lookup(vehicle_form.schedule.data,
+                                 new_vehicle.vehicle_built.year),
+                [new_vehicle.vehicle_id])
+        elif vehicle_form.standard_schedule.data:
             standard_schedule(new_vehicle)
 
         flash(f'{new_vehicle.vehicle_name} added to your vehicle list.',
               'success')
         # Confirm to browser that all okay
         return jsonify(status='ok')
-    # Query DB for users info and vehicles
-    vehicles = Vehicle.query.filter(
-        Vehicle.user_id == session["user_id"]).all()
-    user = User.query.filter(User.user_id == session["user_id"]).first()
+
+    # Page through the vehicles in the requested order, by their due state
+    # as last calculated. The page is a shell whose vehicles' current status
+    # and the status summary are fetched by home_status and home_summary.
+    user_id = session["user_id"]
+    sort = request.args.get('sort', 'due')
+    if sort not in SORTS:
+        sort = 'due'
+    after = request.args.get('after', type=int)
+    vehicles, next_after = vehicle_page(user_id, clock.today(), sort, after)
+
+    user = User.query.filter(User.user_id == user_id).first()
 
     return render_template(
-        "home.html", vehicles=vehicles, user=user, vehicle_form=vehicle_form)
+        "home.html",
+        vehicles=vehicles,
+        sort=sort,
+        after=after,
+        next_after=next_after,
+        user=user,
+        vehicle_form=vehicle_form)
+
+
+@app.route('/home/status', methods=['GET'])
+@login_required
+def home_status():
+    """ JSON status of a batch of the user's vehicles, for the rows of the
+    home page's vehicle table as they are scrolled into view. """
+    vehicle_ids = request.args.getlist('vehicle_id', type=int)
+    batch = app.config['HOME_STATUS_BATCH']
+    if len(vehicle_ids) > batch:
+        return jsonify(status='error',
+                       message=f'At most {batch} vehicles.'), 400
+
+    return jsonify(
+        status='ok',
+        vehicles=vehicle_statuses(session['user_id'], vehicle_ids,
+                                  clock.today()))
+
+
+@app.route('/home/summary', methods=['GET'])
+@login_required
+def home_summary():
+    """ JSON number of the user's vehicles in each status and their most
+    overdue tasks, for the home page. """
+    # Bring the due state of any changed vehicles up to date
+    user_id = session["user_id"]
+    refresh_due_state(Vehicle.query.filter(Vehicle.user_id == user_id))
+    today = clock.today()
+
+    return jsonify(
+        status='ok',
+        counts=status_counts(user_id, today),
+        overdue_tasks=[{
+            'name': task.name,
+            'url': url_for('maintenance', maintenance_id=task.maintenance_id),
+            'vehicle_name': task.vehicle_name,
+            'vehicle_url': url_for('vehicle', vehicle_id=task.vehicle_id),
+            'overdue_date': task.overdue_date.isoformat(),
+        } for task in overdue_tasks(user_id, today)])
+
+
+@app.route('/vehicles/search', methods=['GET'])
+@login_required
+def search_vehicles():
+    """ JSON list of the user's vehicles whose names contain the query, for
+    the nav menu's vehicle picker. """
+    query = request.args.get('q', '')
+    pattern = '%' + query.replace('\\', '\\\\').replace(
+        '%', '\\%').replace('_', '\\_') + '%'
+    vehicles = Vehicle.query.filter(
+        Vehicle.user_id == session['user_id'],
+        Vehicle.vehicle_name.ilike(pattern, escape='\\')).order_by(
+            Vehicle.vehicle_name, Vehicle.vehicle_id).limit(10)
+
+    return jsonify(
+        status='ok',
+        vehicles=[{
+            'vehicle_id': vehicle.vehicle_id,
+            'vehicle_name': vehicle.vehicle_name,
+            'url': url_for('vehicle', vehicle_id=vehicle.vehicle_id),
+        } for vehicle in vehicles])
+
+
+@app.route('/search', methods=['GET'])
+@login_required
+def search():
+    """ JSON page of the user's vehicles, tasks and logs matching the query,
+    best first, for the nav menu's search. """
+    query = request.args.get('q', '')
+    page = request.args.get('page', 1, type=int)
+    results, more = user_search(session['user_id'], query, page)
+
+    return jsonify(
+        status='ok', query=query, page=page, results=results, more=more)
+
+
+@app.route('/bulk', methods=['POST'])
+@login_required
+def bulk():
+    """ Applies an action to many of the user's vehicles or tasks, given as
+    JSON with the action's name and a list of items, and returns the result
+    of each item. """
+    payload = request.get_json(silent=True) or {}
+    action = payload.get('action')
+    items = payload.get('items')
+
+    if (action not in ACTIONS or not isinstance(items, list)
+            or not all(isinstance(item, dict) for item in items)):
+        return jsonify(status='error', message='Unknown action or items.'), 400
+    if len(items) > app.config['BULK_MAX_ITEMS']:
+        return jsonify(
+            status='error',
+            message=f"At most {app.config['BULK_MAX_ITEMS']} items."), 400
+
+    return jsonify(
+        status='ok', results=bulk_action(session['user_id'], action, items))
+
+
+@app.route('/schedules/search', methods=['GET'])
+@login_required
+def search_schedules():
+    """ JSON list of the makes and models in the schedule catalog starting
+    with the query, for the add vehicle form. """
+    return jsonify(
+        status='ok', schedules=catalog().search(request.args.get('q', '')))
 
 
 @app.route("/vehicle/<vehicle_id>", methods=['GET', 'POST'])
@@ -247,7 +393,7 @@ def vehicle(vehicle_id):
         edit_form.manufactured.data = lookup_vehicle.vehicle_built
 
     # Render vehicle template
-    return render_template(
+    return render_page(
         'vehicle.html',
         vehicle=lookup_vehicle,
         user=lookup_vehicle.user,
@@ -348,7 +494,7 @@ def maintenance(maintenance_id):
     edit_form.freq_miles.data = lookup_maintenance.freq_miles
     edit_form.freq_months.data = lookup_maintenance.freq_months
 
-    return render_template(
+    return render_page(
         "maintenance.html",
         maintenance=lookup_maintenance,
         user=lookup_maintenance.vehicle.user,
@@ -407,6 +553,7 @@ def settings():
     update_name = UpdateName(request.form)
     update_email = UpdateEmail(request.form)
     update_password = UpdatePassword(request.form)
+    reset_calendar = ResetCalendar(request.form)
 
     # Provide email address for update password form validation
     update_password.email.data = user.email
@@ -423,8 +570,7 @@ def settings():
     elif update_email.submit_email.data and update_email.validate_on_submit():
 
         # Update email on DB and confirm success
-        user.email = update_email.email.data
-        db.session.commit()
+        user.change_email(update_email.email.data)
         flash('Email address updated.', 'success')
 
     # Check if update password form submitted / validated
@@ -437,6 +583,14 @@ def settings():
         db.session.commit()
         flash('Password succesfully updated.', 'success')
 
+    # Check if reset calendar form submitted / validated
+    elif (reset_calendar.submit_calendar.data
+          and reset_calendar.validate_on_submit()):
+
+        # Replace the key so the old calendar address stops working
+        user.reset_calendar_key()
+        flash('Calendar address reset.', 'success')
+
     elif user.blocked:
         return logout()
 
@@ -447,9 +601,75 @@ def settings():
     return render_template(
         'settings.html',
         user=user,
+        calendar_token=user.calendar_token(),
         update_name=update_name,
         update_email=update_email,
-        update_password=update_password)
+        update_password=update_password,
+        reset_calendar=reset_calendar)
+
+
+@app.route('/forecast', methods=['GET'])
+@login_required
+def forecast():
+    """ JSON forecast of the maintenance due across the user's vehicles over
+    the next `months` months. """
+    months = request.args.get('months', 12, type=int)
+    if not 1 <= months <= 24:
+        return jsonify(
+            status='error', message='Months must be between 1 and 24.'), 400
+
+    return jsonify(
+        status='ok',
+        months=months,
+        forecast=user_forecast(session['user_id'], months))
+
+
+@app.route('/calendar/<token>.ics', methods=['GET'])
+def calendar(token):
+    """ iCalendar feed of the user's maintenance forecast for the next year.
+    Calendar apps can't log in, so the user is identified by a signed token
+    shown on the settings page, holding their current calendar key. """
+    try:
+        user_id, key = ts.loads(token, salt='calendar-key')
+    except (BadSignature, TypeError, ValueError):
+        # Tokens from before calendar keys hold only the user id
+        abort(404)
+
+    if not route_user(user_id):
+        abort(404)
+    user = User.query.filter(User.user_id == user_id).first()
+    if not (user and user.calendar_key
+            and hmac.compare_digest(user.calendar_key, str(key))):
+        abort(404)
+
+    feed, key = user_calendar(user.user_id, 12)
+    response = app.response_class(feed, mimetype='text/calendar')
+    response.set_etag(key)
+    return response.make_conditional(request)
+
+
+@app.route('/health/db', methods=['GET'])
+def health_db():
+    """ Connection pool statistics and database reachability for monitoring.
+    Returns 503 if any database can't be reached, and 404 unless the
+    request carries the health token. """
+    token = app.config['HEALTH_TOKEN']
+    if not token or not hmac.compare_digest(
+            request.headers.get('X-Health-Token', ''), token):
+        abort(404)
+
+    engines = {'primary': db.engine}
+    if replica_enabled():
+        engines['replica'] = db.get_engine(app, bind=REPLICA)
+    for bind in shard_binds():
+        engines[bind] = db.get_engine(app, bind=bind)
+    health = {name: engine_health(engine) for name, engine in engines.items()}
+    reachable = all(engine['reachable'] for engine in health.values())
+
+    return jsonify(
+        status='ok' if reachable else 'error',
+        role=app.config['DB_ROLE'],
+        engines=health), 200 if reachable else 503
 
 
 @app.route('/delete', methods=['GET'])
@@ -0,0 +1,65 @@
+""" Priority queue of when each vehicle next needs the notifier's attention,
+so a notifier run only looks at vehicles whose data changed or whose next
+status change has arrived rather than the whole fleet. """
+import datetime
+import heapq
+
+from auto_maint import db
+from auto_maint.models import Vehicle
+
+
+class WakeQueue():
+    """ Min-heap of (next_check, vehicle_id) backed by the indexed
+    vehicles.next_check column.
+
+    The heap holds the vehicles due within the next window, loaded from the
+    index when the previous window has passed. Vehicles edited since they were
+    scheduled have a NULL next_check and are found from the index on every
+    run. Entries made stale by rescheduling are dropped when popped. """
+
+    def __init__(self, window=datetime.timedelta(days=1)):
+        self.window = window
+        self.heap = []
+        self.horizon = None
+
+    def load(self, now):
+        """ Fill the heap with every vehicle due before the end of the next
+        window. """
+        self.horizon = now + self.window
+        self.heap = db.session.query(
+            Vehicle.next_check, Vehicle.vehicle_id).filter(
+                Vehicle.next_check <= self.horizon).all()
+        heapq.heapify(self.heap)
+
+    def push(self, vehicle):
+        """ Queue a rescheduled vehicle if it falls within the window. """
+        if (self.horizon and vehicle.next_check
+                and vehicle.next_check <= self.horizon):
+            heapq.heappush(self.heap,
+                           (vehicle.next_check, vehicle.vehicle_id))
+
+    def due(self, now):
+        """ Returns the sorted ids of vehicles needing attention at now. """
+        if self.horizon is None or now >= self.horizon:
+            self.load(now)
+
+        vehicle_ids = {
+            row[0] for row in db.session.query(Vehicle.vehicle_id).filter(
+                Vehicle.next_check.is_(None))
+        }
+        while self.heap and self.heap[0][0] <= now:
+            vehicle_ids.add(heapq.heappop(self.heap)[1])
+
+        return sorted(vehicle_ids)
+
+    @staticmethod
+    def vehicles(vehicle_ids, now, chunk_size=500):
+        """ Yields lists of the vehicles for the ids in chunks, skipping any
+        deleted or rescheduled to after now since they were queued. """
+        for start in range(0, len(vehicle_ids), chunk_size):
+            chunk = vehicle_ids[start:start + chunk_size]
+            yield [
+                vehicle for vehicle in Vehicle.query.filter(
+                    Vehicle.vehicle_id.in_(chunk))
+                if vehicle.next_check is None or vehicle.next_check <= now
+            ]
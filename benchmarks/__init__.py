@@ -0,0 +1,5 @@
+""" Benchmark suite for the auto_maint app, run against SQLite with emails
+captured in memory rather than sent.
+
+Usage: python -m benchmarks.run --rows 100000
+"""
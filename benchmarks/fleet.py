@@ -0,0 +1,137 @@
+""" Generator for a synthetic fleet of users, vehicles, odometer histories,
+standard schedule maintenance tasks and logs. """
+import datetime
+import random
+
+from werkzeug.security import generate_password_hash
+
+from auto_maint import clock, db
+from auto_maint.catalog import STANDARD_SCHEDULE, catalog
+from auto_maint.models import Log, Maintenance, Odometer, User, Vehicle
+
+# Pending rows are written once this many have accumulated.
+BATCH_SIZE = 10000
+
+# Tables in foreign key order, so pending rows can be inserted safely.
+MODELS = (User, Vehicle, Odometer, Maintenance, Log)
+
+
+class FleetWriter():
+    """ Buffers generated rows per table, assigning primary keys and writing
+    them out in batches. """
+
+    def __init__(self):
+        self.counts = {model: 0 for model in MODELS}
+        self.pending = {model: [] for model in MODELS}
+
+    def add(self, model, row):
+        """ Queue a row, assigning the next primary key, and return the key. """
+        self.counts[model] += 1
+        key = model.__table__.primary_key.columns.keys()[0]
+        row[key] = self.counts[model]
+        self.pending[model].append(row)
+        return self.counts[model]
+
+    def next_id(self, model):
+        """ The primary key the next row added for the model will receive. """
+        return self.counts[model] + 1
+
+    def total(self):
+        """ Total rows generated so far. """
+        return sum(self.counts.values())
+
+    def flush(self, force=False):
+        """ Insert pending rows if the batch is full or forced. """
+        if not force and sum(map(len, self.pending.values())) < BATCH_SIZE:
+            return
+        for model in MODELS:
+            if self.pending[model]:
+                db.session.execute(model.__table__.insert(),
+                                   self.pending[model])
+                self.pending[model] = []
+
+
+def generate_fleet(rows, seed=0, today=None):
+    """ Populate the database with roughly the given number of rows. Returns
+    a dict of row counts per table.
+
+    Users own between 1 and 5 vehicles, with one in fifty being a fleet
+    account owning many more. Each vehicle has an odometer history, the
+    standard maintenance schedule and a log history for each task. """
+    rand = random.Random(seed)
+    today = today or clock.today()
+    password_hash = generate_password_hash('benchmark')
+    writer = FleetWriter()
+
+    while writer.total() < rows:
+        user_id = writer.next_id(User)
+        writer.add(User, {
+            'email': f'user{user_id}@example.com',
+            'password_hash': password_hash,
+            'name': f'User {user_id}',
+            'failed_logins': 0,
+            'blocked': False,
+            'email_confirmed': True,
+        })
+
+        if rand.random() < 0.02:
+            owned = rand.randint(20, 200)
+        else:
+            owned = rand.randint(1, 5)
+
+        for _ in range(owned):
+            if writer.total() >= rows:
+                break
+            add_vehicle(writer, rand, user_id, today)
+            writer.flush()
+
+    writer.flush(force=True)
+    db.session.commit()
+
+    return {model.__tablename__: writer.counts[model] for model in MODELS}
+
+
+def add_vehicle(writer, rand, user_id, today):
+    """ Generate a single vehicle with its readings, tasks and logs. """
+    built = today - datetime.timedelta(days=rand.randint(180, 7300))
+    age = (today - built).days
+    miles_per_day = rand.uniform(10, 80)
+
+    vehicle_id = writer.next_id(Vehicle)
+    writer.add(Vehicle, {
+        'user_id': user_id,
+        'vehicle_name': f'Vehicle {vehicle_id}',
+        'vehicle_built': built,
+        'last_notification': None,
+    })
+
+    # Odometer readings spread between the build date and today
+    reading_days = sorted(rand.sample(range(1, age + 1), rand.randint(3, 17)))
+    for day in reading_days:
+        writer.add(Odometer, {
+            'vehicle_id': vehicle_id,
+            'reading': int(day * miles_per_day * rand.uniform(0.95, 1.05)),
+            'reading_date': built + datetime.timedelta(days=day),
+        })
+
+    schedule = catalog().lookup(*STANDARD_SCHEDULE)
+    for name, description, freq_miles, freq_months in schedule.tasks:
+        maintenance_id = writer.add(Maintenance, {
+            'vehicle_id': vehicle_id,
+            'name': name,
+            'description': description,
+            'freq_miles': freq_miles,
+            'freq_months': freq_months,
+        })
+
+        # Logs at roughly the scheduled interval, with some slippage
+        freq_days = min(freq_months * 30.44, freq_miles / miles_per_day)
+        day = freq_days * rand.uniform(0.8, 1.2)
+        while day < age:
+            writer.add(Log, {
+                'maintenance_id': maintenance_id,
+                'date': built + datetime.timedelta(days=int(day)),
+                'mileage': int(day * miles_per_day),
+                'notes': 'Synthetic log entry.',
+            })
+            day += freq_days * rand.uniform(0.8, 1.2)
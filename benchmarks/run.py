@@ -0,0 +1,371 @@
+""" Run the benchmark suite and store the results as JSON.
+
+    python -m benchmarks.run --rows 100000
+    python -m benchmarks.run --rows 100000 --compare benchmarks/results/old.json
+
+The database is a SQLite file per row count and seed, generated on first use
+and reused afterwards. Emails are captured in memory rather than sent.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), 'results')
+
+
+def git_commit():
+    """ Returns the current git commit hash, or 'unknown'. """
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def configure(args):
+    """ Point the app at the benchmark database and stub mail transport. Must
+    run before auto_maint is imported. """
+    path = args.db or os.path.join(
+        tempfile.gettempdir(),
+        f'auto_maint_bench_{args.rows}_{args.seed}.db')
+    if args.regenerate and os.path.exists(path):
+        os.remove(path)
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ.setdefault('SERVER_NAME', 'localhost.localdomain')
+    os.environ.setdefault('SECRET_KEY', 'benchmark')
+    os.environ['MAIL_SUPPRESS_SEND'] = '1'
+    # Measure the notifier's own work, not the SMTP rate limit
+    os.environ['MAIL_RATE_PER_MINUTE'] = '0'
+    os.environ['MAIL_SEND_WINDOW'] = '0'
+    return path
+
+
+def timed(func, repeat, setup=None):
+    """ Run func repeat times, calling setup untimed beforehand. Returns the
+    list of durations in seconds and the SQL statements issued per run. """
+    from auto_maint.querycount import query_budget
+
+    runs = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        with query_budget() as queries:
+            start = time.perf_counter()
+            func()
+            runs.append(time.perf_counter() - start)
+    return runs, len(queries.queries)
+
+
+def summarize(timings, items):
+    """ Summary statistics for a benchmark's runs. """
+    runs, queries = timings
+    return {
+        'runs': runs,
+        'items': items,
+        'queries': queries,
+        'min': min(runs),
+        'median': statistics.median(runs),
+        'mean': statistics.mean(runs),
+        'per_item_median': statistics.median(runs) / items,
+    }
+
+
+def run_benchmarks(args):
+    """ Generate the fleet if needed and run each benchmark. """
+    from flask import render_template, session
+
+    from auto_maint import app, db
+    from auto_maint.dashboard import refresh_due_state
+    from auto_maint.forms import (EditVehicleForm, NewMaintenanceForm,
+                                  NewOdometerForm)
+    from auto_maint.helpers import outbox
+    from auto_maint.models import Maintenance, Vehicle
+    from auto_maint.reminders import render_reminder as render_reminder_email
+    from auto_maint.reminders import vehicle_summary
+    from auto_maint.scheduled_tasks import notify_users
+    from auto_maint.wake import WakeQueue
+    from benchmarks.fleet import generate_fleet
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    rand = random.Random(args.seed)
+    results = {}
+
+    with app.app_context():
+        db.create_all()
+        if not Vehicle.query.first():
+            print(f'Generating fleet of {args.rows} rows...')
+            start = time.perf_counter()
+            counts = generate_fleet(args.rows, args.seed)
+            print(f'Generated {counts} in '
+                  f'{time.perf_counter() - start:.1f}s')
+
+        vehicle_ids = [row[0] for row in db.session.query(Vehicle.vehicle_id)]
+        task_ids = [row[0] for row in db.session.query(
+            Maintenance.maintenance_id)]
+        sample_vehicles = rand.sample(
+            vehicle_ids, min(args.sample, len(vehicle_ids)))
+        sample_tasks = rand.sample(task_ids, min(args.sample, len(task_ids)))
+        sample_users = [
+            row[0] for row in db.session.query(Vehicle.user_id).filter(
+                Vehicle.vehicle_id.in_(sample_vehicles[:args.pages]))
+        ]
+
+        def fresh():
+            """ Start each run with an empty session so loads are timed. """
+            db.session.remove()
+
+        def est_mileage():
+            for vehicle_id in sample_vehicles:
+                Vehicle.query.get(vehicle_id).est_mileage()
+
+        def maintenance_status():
+            for maintenance_id in sample_tasks:
+                Maintenance.query.get(maintenance_id).status()
+
+        def render_reminder():
+            for vehicle_id in sample_vehicles[:args.pages]:
+                render_reminder_email(
+                    vehicle_summary(Vehicle.query.get(vehicle_id)))
+
+        results['est_mileage'] = summarize(
+            timed(est_mileage, args.repeat, fresh), len(sample_vehicles))
+        results['maintenance_status'] = summarize(
+            timed(maintenance_status, args.repeat, fresh), len(sample_tasks))
+        results['render_reminder'] = summarize(
+            timed(render_reminder, args.repeat, fresh),
+            len(sample_vehicles[:args.pages]))
+
+    # The dashboard's due state is kept up to date as vehicles change, so is
+    # calculated untimed
+    with app.app_context():
+        refresh_due_state(Vehicle.query)
+
+    def render_home():
+        for user_id in sample_users:
+            with app.test_request_context('/home'):
+                session['user_id'] = user_id
+                app.view_functions['home']()
+
+    def render_vehicle():
+        for vehicle_id in sample_vehicles[:args.pages]:
+            with app.test_request_context(f'/vehicle/{vehicle_id}'):
+                vehicle = Vehicle.query.get(vehicle_id)
+                session['user_id'] = vehicle.user_id
+                render_template(
+                    'vehicle.html',
+                    vehicle=vehicle,
+                    user=vehicle.user,
+                    odometer_form=NewOdometerForm(),
+                    edit_form=EditVehicleForm(),
+                    maintenance_form=NewMaintenanceForm())
+
+    def home_status():
+        for user_id in sample_users:
+            with app.test_request_context('/home'):
+                session['user_id'] = user_id
+                vehicle_ids = [
+                    row[0] for row in db.session.query(
+                        Vehicle.vehicle_id).filter(
+                            Vehicle.user_id == user_id).limit(
+                                app.config['HOME_STATUS_BATCH'])]
+            with app.test_request_context(
+                    '/home/status', query_string={'vehicle_id': vehicle_ids}):
+                session['user_id'] = user_id
+                app.view_functions['home_status']()
+
+    def home_summary():
+        for user_id in sample_users:
+            with app.test_request_context('/home/summary'):
+                session['user_id'] = user_id
+                app.view_functions['home_summary']()
+
+    results['render_home'] = summarize(
+        timed(render_home, args.repeat), len(sample_users))
+    results['home_status'] = summarize(
+        timed(home_status, args.repeat), len(sample_users))
+    results['home_summary'] = summarize(
+        timed(home_summary, args.repeat), len(sample_users))
+    results['render_vehicle'] = summarize(
+        timed(render_vehicle, args.repeat), len(sample_vehicles[:args.pages]))
+
+    # Vehicle page through the full request stack, buffered, compressed, and
+    # streamed and compressed, recording the bytes sent and time to the first
+    # chunk of the body
+    client = app.test_client()
+    with app.app_context():
+        owners = dict(
+            db.session.query(Vehicle.vehicle_id, Vehicle.user_id).filter(
+                Vehicle.vehicle_id.in_(sample_vehicles[:args.pages])))
+
+    def page_delivery(compress, stream):
+        app.config['COMPRESS_RESPONSES'] = compress
+        app.config['STREAM_PAGES'] = stream
+        first_chunks = []
+        sizes = []
+
+        def fetch():
+            for vehicle_id, user_id in owners.items():
+                with client.session_transaction() as client_session:
+                    client_session['user_id'] = user_id
+                start = time.perf_counter()
+                response = client.get(
+                    f'/vehicle/{vehicle_id}', buffered=False,
+                    headers={'Accept-Encoding': 'gzip'})
+                chunks = iter(response.response)
+                size = len(next(chunks))
+                first_chunks.append(time.perf_counter() - start)
+                size += sum(len(chunk) for chunk in chunks)
+                sizes.append(size)
+                response.close()
+
+        result = summarize(timed(fetch, args.repeat), len(owners))
+        result['ttfb_median'] = statistics.median(first_chunks)
+        result['bytes'] = sum(sizes) // len(sizes)
+        return result
+
+    results['vehicle_page'] = page_delivery(False, False)
+    results['vehicle_page_gzip'] = page_delivery(True, False)
+    results['vehicle_page_streamed'] = page_delivery(True, True)
+    app.config['COMPRESS_RESPONSES'] = app.config['STREAM_PAGES'] = False
+
+    # Add vehicle flow through the full request stack
+    with client.session_transaction() as client_session:
+        client_session['user_id'] = sample_users[0]
+
+    def add_vehicle():
+        for _ in range(args.pages):
+            response = client.post('/home', data={
+                'name': 'Benchmark Vehicle',
+                'manufactured': '2015-06-01',
+                'current_mileage': '60000',
+                'standard_schedule': 'y',
+            })
+            assert response.get_json() == {'status': 'ok'}, response.data
+
+    def remove_added():
+        with app.app_context():
+            for vehicle in Vehicle.query.filter(
+                    Vehicle.vehicle_name == 'Benchmark Vehicle'):
+                vehicle.delete()
+
+    results['add_vehicle'] = summarize(
+        timed(add_vehicle, args.repeat, remove_added), args.pages)
+    remove_added()
+
+    # Full notifier run over the fleet, with every vehicle needing a check
+    def reset_notifications():
+        outbox.clear()
+        with app.app_context():
+            Vehicle.query.update({'last_notification': None,
+                                  'next_check': None})
+            db.session.commit()
+
+    results['notify_users'] = summarize(
+        timed(lambda: notify_users(defaultdict(WakeQueue)), args.notify_repeat,
+              reset_notifications), len(vehicle_ids))
+    results['notify_users']['emails'] = len(outbox)
+
+    # Notifier run straight after a full run, when nothing has changed
+    results['notify_users_idle'] = summarize(
+        timed(lambda: notify_users(defaultdict(WakeQueue)), args.notify_repeat),
+        len(vehicle_ids))
+
+    return results
+
+
+def compare(base, current, threshold):
+    """ Print the change in median time and SQL statements per benchmark
+    against a previous results file. Returns the names of benchmarks that
+    slowed by more than the threshold or issued more statements. """
+    regressions = []
+    print(f"\n{'benchmark':<22}{'base':>12}{'current':>12}{'change':>10}"
+          f"{'queries':>16}")
+    for name, result in current['results'].items():
+        if name not in base['results']:
+            continue
+        before = base['results'][name]['per_item_median']
+        after = result['per_item_median']
+        change = (after - before) / before
+        queries_before = base['results'][name].get('queries')
+        queries_after = result['queries']
+        flag = ''
+        if change > threshold or (queries_before is not None
+                                  and queries_after > queries_before):
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f'{name:<22}{before * 1000:>10.3f}ms{after * 1000:>10.3f}ms'
+              f'{change:>+10.1%}{queries_before!s:>8}{queries_after:>8}'
+              f'{flag}')
+    return regressions
+
+
+def main():
+    """ Parse arguments, run the suite and write the results file. """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=10000,
+                        help='approximate rows in the synthetic fleet')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='SQLite file to use')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='rebuild the synthetic fleet')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--notify-repeat', type=int, default=1)
+    parser.add_argument('--sample', type=int, default=200,
+                        help='vehicles and tasks sampled per benchmark')
+    parser.add_argument('--pages', type=int, default=20,
+                        help='pages rendered or posted per benchmark')
+    parser.add_argument('--output', help='results JSON file')
+    parser.add_argument('--compare', help='previous results JSON file')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='slowdown reported as a regression')
+    args = parser.parse_args()
+
+    configure(args)
+    results = run_benchmarks(args)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'rows': args.rows,
+        'seed': args.seed,
+        'results': results,
+    }
+
+    output = args.output or os.path.join(RESULTS_DIR,
+                                         f'{commit}-{args.rows}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as results_file:
+        json.dump(report, results_file, indent=2)
+
+    for name, result in results.items():
+        print(f"{name:<22}{result['median'] * 1000:>10.1f}ms median "
+              f"({result['per_item_median'] * 1000:.3f}ms per item, "
+              f"{result['queries']} queries)")
+        if 'bytes' in result:
+            print(f"{'':<22}{result['ttfb_median'] * 1000:>10.1f}ms to first "
+                  f"byte, {result['bytes']:,} bytes")
+    print(f'Results written to {output}')
+
+    if args.compare:
+        with open(args.compare) as base_file:
+            regressions = compare(json.load(base_file), report,
+                                  args.threshold)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+""" Fast-forward simulation of the notifier over a synthetic fleet.
+
+    python -m benchmarks.simulate --rows 5000 --years 3
+    python -m benchmarks.simulate --rows 5000 --years 3 --compare old.json
+
+A fleet is generated as of the start date in a fresh SQLite database, then a
+virtual clock is advanced a day at a time. Each day vehicles are driven, some
+get odometer readings, owners service the vehicles they were reminded about
+and the notifier runs. The report gives the emails sent per day, the
+notifier's run time per day and the number of task status transitions, so
+changes to the notifier can be compared offline. Emails are captured in
+memory rather than sent.
+"""
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from collections import Counter, defaultdict
+
+from benchmarks.run import RESULTS_DIR, git_commit
+
+STATUSES = ('Good', 'Soon', 'Overdue')
+
+
+def configure(args):
+    """ Point the app at a fresh simulation database and capture emails. Must
+    run before auto_maint is imported. """
+    path = args.db or os.path.join(
+        tempfile.gettempdir(), f'auto_maint_sim_{args.rows}_{args.seed}.db')
+    if os.path.exists(path):
+        os.remove(path)
+
+    os.environ['DATABASE_URL'] = 'sqlite:///' + path
+    os.environ.setdefault('SERVER_NAME', 'localhost.localdomain')
+    os.environ.setdefault('SECRET_KEY', 'simulation')
+    os.environ['MAIL_SUPPRESS_SEND'] = '1'
+    os.environ['MAIL_RATE_PER_MINUTE'] = '0'
+    os.environ['MAIL_SEND_WINDOW'] = '0'
+    return path
+
+
+class Driving():
+    """ True mileage of each vehicle, driven at its own average rate with
+    daily variation, from which readings and logs are taken. """
+
+    def __init__(self, rand, today):
+        from auto_maint import db
+        from auto_maint.models import Odometer, Vehicle
+
+        self.rand = rand
+        self.mileage = {}
+        self.rates = {}
+        last = db.session.query(
+            Odometer.vehicle_id, db.func.max(Odometer.reading)).group_by(
+                Odometer.vehicle_id)
+        built = dict(db.session.query(Vehicle.vehicle_id,
+                                      Vehicle.vehicle_built))
+        for vehicle_id, reading in last:
+            age = max((today - built[vehicle_id]).days, 1)
+            self.mileage[vehicle_id] = float(reading)
+            self.rates[vehicle_id] = max(reading, age) / age
+
+    def drive(self):
+        """ Drive every vehicle for a day. """
+        for vehicle_id, rate in self.rates.items():
+            self.mileage[vehicle_id] += rate * self.rand.uniform(0, 2)
+
+    def reading(self, vehicle_id):
+        """ The vehicle's odometer reading. """
+        return int(self.mileage[vehicle_id])
+
+
+def add_readings(driving, chance, today, serviced):
+    """ Add a reading today to each vehicle with the given chance, other than
+    those serviced today which already have one. Returns the number added. """
+    from auto_maint import db
+    from auto_maint.models import Odometer, mark_changed
+
+    vehicle_ids = [vehicle_id for vehicle_id in driving.rates
+                   if driving.rand.random() < chance
+                   and vehicle_id not in serviced]
+    if vehicle_ids:
+        db.session.execute(Odometer.__table__.insert(), [{
+            'vehicle_id': vehicle_id,
+            'reading': driving.reading(vehicle_id),
+            'reading_date': today,
+        } for vehicle_id in vehicle_ids])
+        mark_changed(db.session, vehicle_ids)
+        db.session.commit()
+    return len(vehicle_ids)
+
+
+def service(driving, vehicle_ids, today):
+    """ Log every task of the vehicles which is Soon or Overdue, as done today
+    at the current mileage with a reading of it. Returns the number of tasks
+    logged. """
+    from sqlalchemy.orm import selectinload
+
+    from auto_maint import db
+    from auto_maint.models import Log, Maintenance, Odometer, Vehicle
+
+    logged = 0
+    if not vehicle_ids:
+        return logged
+    vehicles = Vehicle.query.filter(
+        Vehicle.vehicle_id.in_(vehicle_ids)).options(
+            selectinload(Vehicle.odo_readings),
+            selectinload(Vehicle.maintenance).selectinload(Maintenance.logs))
+    for vehicle in vehicles:
+        mileage = driving.reading(vehicle.vehicle_id)
+        due = [task for task in vehicle.maintenance
+               if task.status() != 'Good']
+        for task in due:
+            db.session.add(Log(maintenance_id=task.maintenance_id, date=today,
+                               mileage=mileage, notes='Simulated service.'))
+        if due:
+            db.session.add(Odometer(vehicle_id=vehicle.vehicle_id,
+                                    reading=mileage, reading_date=today))
+        logged += len(due)
+    db.session.commit()
+    return logged
+
+
+def task_statuses(today):
+    """ Returns the status of every task today, from the precomputed due
+    state. """
+    from auto_maint import db
+    from auto_maint.dashboard import refresh_due_state, status_column
+    from auto_maint.models import Maintenance, Vehicle
+
+    refresh_due_state(Vehicle.query)
+    return dict(db.session.query(Maintenance.maintenance_id,
+                                 status_column(Maintenance, today)))
+
+
+def simulate(args):
+    """ Generate the fleet and run the simulation. Returns the report. """
+    from auto_maint import app, db
+    from auto_maint.clock import VirtualClock, use_clock
+    from auto_maint.helpers import outbox
+    from auto_maint.models import Vehicle
+    from auto_maint.scheduled_tasks import notify_users
+    from auto_maint.wake import WakeQueue
+    from benchmarks.fleet import generate_fleet
+
+    rand = random.Random(args.seed)
+    start = datetime.datetime.combine(args.start, datetime.time(9))
+    clock = VirtualClock(start)
+    queues = defaultdict(WakeQueue)
+    # Vehicles to be serviced, by the day they will be
+    servicing = defaultdict(set)
+    days = []
+
+    with use_clock(clock):
+        with app.app_context():
+            db.create_all()
+            counts = generate_fleet(args.rows, args.seed, clock.today())
+            print(f'Generated {counts}, simulating {args.days} days from '
+                  f'{args.start}')
+            driving = Driving(rand, clock.today())
+            statuses = task_statuses(clock.today())
+
+        for day in range(args.days):
+            clock.advance(datetime.timedelta(days=1))
+            today = clock.today()
+
+            with app.app_context():
+                driving.drive()
+                serviced = servicing.pop(today, set())
+                logged = service(driving, serviced, today)
+                readings = add_readings(driving, args.reading_chance, today,
+                                        serviced)
+
+            outbox.clear()
+            tick = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                notify_users(queues)
+            notify_seconds = time.perf_counter() - tick
+
+            with app.app_context():
+                # Owners of reminded vehicles may book them in for a service
+                reminded = [row[0] for row in db.session.query(
+                    Vehicle.vehicle_id).filter(
+                        Vehicle.last_notification == clock.now())]
+                for vehicle_id in reminded:
+                    if rand.random() < args.response:
+                        servicing[today + datetime.timedelta(
+                            days=rand.randint(1, args.response_days))].add(
+                                vehicle_id)
+
+                current = task_statuses(today)
+                transitions = Counter(
+                    f'{statuses[task_id]}->{status}'
+                    for task_id, status in current.items()
+                    if task_id in statuses and statuses[task_id] != status)
+                statuses = current
+
+            days.append({
+                'date': today.isoformat(),
+                'emails': len(outbox),
+                'reminded_vehicles': len(reminded),
+                'notify_seconds': notify_seconds,
+                'readings': readings,
+                'tasks_logged': logged,
+                'statuses': dict(Counter(statuses.values())),
+                'transitions': dict(transitions),
+            })
+            if (day + 1) % 100 == 0:
+                print(f'{today}: {sum(d["emails"] for d in days)} emails '
+                      f'so far')
+
+    return {'fleet': counts, 'days': days, 'summary': summarize(days)}
+
+
+def summarize(days):
+    """ Summary of the simulated days. """
+    emails = [day['emails'] for day in days]
+    ticks = sorted(day['notify_seconds'] for day in days)
+    transitions = Counter()
+    for day in days:
+        transitions.update(day['transitions'])
+    final = days[-1]['statuses'] if days else {}
+    return {
+        'days': len(days),
+        'emails': sum(emails),
+        'emails_per_day_mean': statistics.mean(emails) if emails else 0,
+        'emails_per_day_max': max(emails, default=0),
+        'notify_median': statistics.median(ticks) if ticks else 0,
+        'notify_p95': ticks[int(len(ticks) * 0.95)] if ticks else 0,
+        'notify_max': max(ticks, default=0),
+        'tasks_logged': sum(day['tasks_logged'] for day in days),
+        'transitions': dict(transitions),
+        'final_statuses': {status: final.get(status, 0)
+                           for status in STATUSES},
+    }
+
+
+def print_summary(summary, base=None):
+    """ Print the summary, alongside a previous run's if given. """
+    rows = [
+        ('days', 'days', '{:d}'),
+        ('emails', 'emails', '{:d}'),
+        ('emails/day mean', 'emails_per_day_mean', '{:.2f}'),
+        ('emails/day max', 'emails_per_day_max', '{:d}'),
+        ('notify median ms', 'notify_median', '{:.2f}'),
+        ('notify p95 ms', 'notify_p95', '{:.2f}'),
+        ('notify max ms', 'notify_max', '{:.2f}'),
+        ('tasks logged', 'tasks_logged', '{:d}'),
+    ]
+    scale = {'notify_median': 1000, 'notify_p95': 1000, 'notify_max': 1000}
+
+    def value(result, key, template):
+        number = result.get(key, 0) * scale.get(key, 1)
+        return template.format(number)
+
+    print(f"\n{'':<20}{'base' if base else '':>12}{'current':>12}")
+    for label, key, template in rows:
+        before = value(base, key, template) if base else ''
+        print(f'{label:<20}{before:>12}{value(summary, key, template):>12}')
+    names = sorted(set(summary['transitions']) | set(
+        (base or {}).get('transitions', {})))
+    for name in names:
+        before = str(base['transitions'].get(name, 0)) if base else ''
+        print(f'{name:<20}{before:>12}{summary["transitions"].get(name, 0):>12}')
+
+
+def main():
+    """ Parse arguments, run the simulation and write the report. """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=5000,
+                        help='approximate rows in the synthetic fleet')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='SQLite file to use, replaced each run')
+    parser.add_argument('--start', type=datetime.date.fromisoformat,
+                        default=datetime.date(2020, 1, 1),
+                        help='first simulated day, as YYYY-MM-DD')
+    parser.add_argument('--years', type=float, default=1,
+                        help='years to simulate')
+    parser.add_argument('--reading-chance', type=float, default=0.05,
+                        help='daily chance of a vehicle getting a reading')
+    parser.add_argument('--response', type=float, default=0.7,
+                        help='chance of a reminder leading to a service')
+    parser.add_argument('--response-days', type=int, default=14,
+                        help='most days between a reminder and the service')
+    parser.add_argument('--output', help='report JSON file')
+    parser.add_argument('--compare', help='previous report JSON file')
+    args = parser.parse_args()
+    args.days = int(args.years * 365)
+
+    configure(args)
+    report = simulate(args)
+
+    commit = git_commit()
+    report.update({
+        'commit': commit,
+        'timestamp': datetime.datetime.now().isoformat(),
+        'rows': args.rows,
+        'seed': args.seed,
+        'start': args.start.isoformat(),
+        'reading_chance': args.reading_chance,
+        'response': args.response,
+        'response_days': args.response_days,
+    })
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f'simulate-{commit}-{args.rows}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    base = None
+    if args.compare:
+        with open(args.compare) as base_file:
+            base = json.load(base_file)['summary']
+    print_summary(report['summary'], base)
+    print(f'Report written to {output}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+""" Cold start time and memory of the gunicorn workers, with and without
+preloading the app.
+
+    python -m benchmarks.startup --workers 4
+    python -m benchmarks.startup --workers 4 --compare old.json
+
+gunicorn is started with gunicorn.conf.py against the benchmark database in
+each of three modes: each worker loading the app with no template bytecode
+cache, as before preloading, then with the cache the first run wrote, then
+with the app preloaded and warmed in the master. A user logs in and each page
+is requested by as many clients at once as there are workers, twice. The
+report gives the time from launch until the first round of every page was
+served, the first and second rounds' response times, and each worker's
+memory: its RSS, and where /proc gives them its proportional share of pages
+shared with other processes (PSS) and its private memory. Linux only.
+"""
+import argparse
+import datetime
+import http.cookiejar
+import json
+import os
+import re
+import shutil
+import socket
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.run import RESULTS_DIR, configure, git_commit
+
+# Modes run, with the settings of each
+MODES = {
+    'cold': {'GUNICORN_PRELOAD': '0'},
+    'bytecode_cache': {'GUNICORN_PRELOAD': '0'},
+    'preload': {'GUNICORN_PRELOAD': '1'},
+}
+
+CSRF_TOKEN = re.compile(r'name="csrf_token" type="hidden" value="([^"]+)"')
+
+
+def free_port():
+    """ Returns a free TCP port on localhost. """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def fleet_user(path):
+    """ Returns the email, a vehicle id and a task id of the benchmark user
+    with a vehicle. """
+    with sqlite3.connect(path) as connection:
+        return connection.execute(
+            'SELECT users.email, vehicles.vehicle_id, maintenance_id '
+            'FROM users JOIN vehicles USING (user_id) '
+            'JOIN maintenance USING (vehicle_id) '
+            'ORDER BY users.user_id LIMIT 1').fetchone()
+
+
+def worker_pids(master):
+    """ Returns the pids of the master process's children. """
+    pids = []
+    for name in os.listdir('/proc'):
+        if not name.isdigit():
+            continue
+        try:
+            with open(f'/proc/{name}/stat') as stat:
+                # The parent pid follows the command name in parentheses
+                fields = stat.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        if int(fields[1]) == master:
+            pids.append(int(name))
+    return sorted(pids)
+
+
+def memory(pid):
+    """ Returns the process's RSS, PSS and private memory in MB, the last two
+    None if the kernel doesn't give smaps_rollup. """
+    values = {}
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as smaps:
+            for line in smaps:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    values[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    except OSError:
+        with open(f'/proc/{pid}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    values['Rss'] = int(line.split()[1]) / 1024
+    private = (values['Private_Clean'] + values['Private_Dirty']
+               if 'Private_Dirty' in values else None)
+    return {'rss': values['Rss'], 'pss': values.get('Pss'),
+            'private': private}
+
+
+class Client():
+    """ Client of the gunicorn server, keeping the session cookie. """
+
+    def __init__(self, base):
+        self.base = base
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+
+    def get(self, path):
+        """ GET the path and return the response's body. """
+        with self.opener.open(self.base + path, timeout=60) as response:
+            return response.read().decode()
+
+    def login(self, email, password):
+        """ Log in with the index page's form. """
+        token = CSRF_TOKEN.search(self.get('/')).group(1)
+        data = urllib.parse.urlencode({
+            'csrf_token': token,
+            'email': email,
+            'password': password,
+            'submit_login': 'Login',
+        }).encode()
+        with self.opener.open(self.base + '/', data, timeout=60) as response:
+            if not response.geturl().endswith('/home'):
+                raise RuntimeError('Benchmark user could not log in')
+
+    def timed_get(self, path):
+        """ GET the path, returning the seconds taken. """
+        start = time.perf_counter()
+        self.get(path)
+        return time.perf_counter() - start
+
+
+def wait_ready(client, process, timeout=60):
+    """ Wait until the server answers. Returns the seconds waited. """
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited while starting')
+        try:
+            client.get('/')
+            return time.perf_counter() - start
+        except OSError:
+            time.sleep(0.01)
+    raise RuntimeError('gunicorn did not start')
+
+
+def run_mode(name, args, cache_dir, pages):
+    """ Start gunicorn in the mode, request the pages and measure the
+    workers. Returns the mode's results. """
+    port = free_port()
+    env = dict(os.environ, **MODES[name])
+    env.update({
+        'SERVER_NAME': f'localhost:{port}',
+        'TEMPLATE_CACHE_DIR': cache_dir,
+        'SLOW_QUERY_MS': '100000',
+        # Flask warns about the cookie domain of a local server
+        'PYTHONWARNINGS': 'ignore::UserWarning:flask.sessions',
+    })
+    gunicorn = os.path.join(os.path.dirname(sys.executable), 'gunicorn')
+    command = [gunicorn if os.path.exists(gunicorn) else 'gunicorn',
+               '-c', 'gunicorn.conf.py', '-b', f'127.0.0.1:{port}',
+               '-w', str(args.workers), '--log-level', 'warning',
+               'auto_maint:app']
+
+    launched = time.perf_counter()
+    process = subprocess.Popen(command, env=env)
+    try:
+        client = Client(f'http://localhost:{port}')
+        ready = wait_ready(client, process)
+        client.login(args.email, 'benchmark')
+
+        rounds = []
+        with ThreadPoolExecutor(args.workers) as executor:
+            for _ in range(2):
+                rounds.append({
+                    page: list(executor.map(client.timed_get,
+                                            [page] * args.workers))
+                    for page in pages
+                })
+                if len(rounds) == 1:
+                    served = time.perf_counter() - launched
+
+        workers = [memory(pid) for pid in worker_pids(process.pid)]
+        master = memory(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+    def total(key):
+        values = [worker[key] for worker in workers]
+        return None if None in values else sum(values)
+
+    return {
+        'ready_seconds': ready,
+        'first_round_served_seconds': served,
+        'first_round': rounds[0],
+        'second_round': rounds[1],
+        'first_round_max': max(max(times) for times in rounds[0].values()),
+        'first_round_median': statistics.median(
+            seconds for times in rounds[0].values() for seconds in times),
+        'second_round_median': statistics.median(
+            seconds for times in rounds[1].values() for seconds in times),
+        'master': master,
+        'workers': workers,
+        'worker_rss_mean': total('rss') / len(workers),
+        'worker_pss_total': total('pss'),
+        'worker_private_total': total('private'),
+    }
+
+
+def print_summary(results, base=None):
+    """ Print each mode's results, alongside a previous run's if given. """
+    rows = [
+        ('ready s', 'ready_seconds', 1, '{:.2f}'),
+        ('first round s', 'first_round_served_seconds', 1, '{:.2f}'),
+        ('first max ms', 'first_round_max', 1000, '{:.1f}'),
+        ('first median ms', 'first_round_median', 1000, '{:.1f}'),
+        ('second median ms', 'second_round_median', 1000, '{:.1f}'),
+        ('worker RSS MB', 'worker_rss_mean', 1, '{:.1f}'),
+        ('workers PSS MB', 'worker_pss_total', 1, '{:.1f}'),
+        ('private MB', 'worker_private_total', 1, '{:.1f}'),
+    ]
+
+    def value(result, key, scale, template):
+        number = (result or {}).get(key)
+        return '' if number is None else template.format(number * scale)
+
+    header = f"{'':<18}" + ''.join(
+        f'{name:>16}' for name in results)
+    for label, key, scale, template in rows:
+        if label == rows[0][0]:
+            print('\n' + header)
+        line = f'{label:<18}'
+        for name, result in results.items():
+            current = value(result, key, scale, template)
+            before = value((base or {}).get(name), key, scale, template)
+            line += f'{(before + " > " if before else "") + current:>16}'
+        print(line)
+
+
+def main():
+    """ Parse arguments, run each mode and write the report. """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--rows', type=int, default=2000,
+                        help='approximate rows in the synthetic fleet')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db', help='SQLite file to use')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='rebuild the database even if it exists')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--output', help='results JSON file')
+    parser.add_argument('--compare', help='previous results JSON file')
+    args = parser.parse_args()
+
+    path = configure(args)
+    if not os.path.exists(path):
+        subprocess.check_call([sys.executable, '-m', 'benchmarks.run',
+                               '--rows', str(args.rows), '--seed',
+                               str(args.seed), '--db', path, '--repeat',
+                               '1'])
+    args.email, vehicle_id, maintenance_id = fleet_user(path)
+    pages = ['/home', f'/vehicle/{vehicle_id}',
+             f'/maintenance/{maintenance_id}', '/settings']
+
+    cache_dir = tempfile.mkdtemp(prefix='auto_maint_templates_')
+    try:
+        results = {name: run_mode(name, args, cache_dir, pages)
+                   for name in MODES}
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    commit = git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.datetime.now().isoformat(),
+        'python': sys.version.split()[0],
+        'rows': args.rows,
+        'workers': args.workers,
+        'pages': pages,
+        'results': results,
+    }
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f'startup-{commit}-{args.workers}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w') as report_file:
+        json.dump(report, report_file, indent=2)
+
+    base = None
+    if args.compare:
+        with open(args.compare) as base_file:
+            base = json.load(base_file)['results']
+    print_summary(results, base)
+    print(f'Report written to {output}')
+
+
+if __name__ == '__main__':
+    main()
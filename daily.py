@@ -1,11 +1,19 @@
 """ Script to be run daily by Heroku Scheduler. This is used primarily for email
 notifications. """
+import os
+
+# The role is read when the app is imported, which builds its engine
+os.environ['DB_ROLE'] = 'notifier'
+
+from auto_maint.housekeeping import housekeeping
 from auto_maint.scheduled_tasks import notify_users
 
 
 def run():
     """ Functions to be run. """
     notify_users()
+    print('HOUSEKEEPING RUNNING')
+    print(housekeeping())
 
 if __name__ == '__main__':
     run()
@@ -0,0 +1,34 @@
+""" Gunicorn settings for the web app, see run.py. Workers and the port are
+taken from WEB_CONCURRENCY and PORT as usual.
+
+With GUNICORN_PRELOAD=1 (the default) the master imports the app and warms
+its templates, forms and schedule catalog before forking the workers, which
+start ready to serve and share that memory copy-on-write. """
+import gc
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') == '1'
+
+if preload_app:
+    # The app is imported after this file is read. Garbage collection stays
+    # off in the master so the workers' shared pages aren't left with holes.
+    gc.disable()
+
+
+def when_ready(server):
+    if preload_app:
+        from auto_maint.startup import warm
+        templates, forms = warm()
+        server.log.info('Warmed %d templates and %d forms', templates, forms)
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        from auto_maint.startup import before_fork
+        before_fork()
+
+
+def post_fork(server, worker):
+    if preload_app:
+        from auto_maint.startup import after_fork
+        after_fork()
@@ -0,0 +1,43 @@
+"""empty message
+
+Revision ID: 3f8a6c2d1e95
+Revises: b7d3e9a4c152
+Create Date: 2026-10-19 21:48:05.204117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f8a6c2d1e95'
+down_revision = 'b7d3e9a4c152'
+branch_labels = None
+depends_on = None
+
+# Full text search indexes, whose expressions the search's queries must match.
+# Other databases search an in-process index instead.
+INDEXES = {
+    'ix_vehicles_search': (
+        'vehicles', "to_tsvector('english', vehicle_name)"),
+    'ix_maintenance_search': (
+        'maintenance',
+        "to_tsvector('english', name || ' ' || coalesce(description, ''))"),
+    'ix_logs_search': (
+        'logs', "to_tsvector('english', coalesce(notes, ''))"),
+}
+
+
+def upgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, (table, expression) in INDEXES.items():
+        op.create_index(name, table, [sa.text(expression)],
+                        postgresql_using='gin')
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    for name, (table, expression) in INDEXES.items():
+        op.drop_index(name, table_name=table)
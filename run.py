@@ -3,13 +3,18 @@ import os
 
 from apscheduler.schedulers.background import BackgroundScheduler
 
+# This process only runs the notifier. The role is read when the app is
+# imported, which builds its engine. Gunicorn's workers are separate processes
+# using the web role.
+os.environ['DB_ROLE'] = 'notifier'
+
 from auto_maint.scheduled_tasks import notify_users
 
 
 def run_web_script():
     # start the gunicorn server with custom configuration
     # You can also using app.run() if you want to use the flask built-in server -- be careful about the port
-    os.system('gunicorn auto_maint:app')
+    os.system('DB_ROLE=web gunicorn -c gunicorn.conf.py auto_maint:app')
 
 
 def start_scheduler():
@@ -4,6 +4,9 @@ setup(
     name='auto_maint',
     packages=['auto_maint'],
     include_package_data=True,
+    package_data={
+        'auto_maint': ['data/*.json'],
+    },
     install_requires=[
         'flask',
     ],
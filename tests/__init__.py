@@ -0,0 +1,18 @@
+""" Tests of auto_maint, run from the repository root with
+
+    python -m unittest discover -s tests -t .
+
+The app is pointed at a throwaway SQLite database before any test imports
+it. """
+import os
+import tempfile
+
+DATABASE = os.path.join(tempfile.mkdtemp(prefix='auto_maint_tests_'),
+                        'app.db')
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + DATABASE
+os.environ.setdefault('SERVER_NAME', 'localhost.localdomain')
+os.environ.setdefault('SECRET_KEY', 'test')
+os.environ['MAIL_SUPPRESS_SEND'] = '1'
+os.environ['MAIL_RATE_PER_MINUTE'] = '0'
+os.environ['TEMPLATE_CACHE_DIR'] = ''
@@ -0,0 +1,98 @@
+""" Tests of fingerprinted static assets. """
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from flask import url_for
+
+from auto_maint import app, assets
+from auto_maint.assets import BUILD_DIR, build_assets, load_manifest
+
+STYLE = b'body { color: #333; }\n' * 100
+
+
+class AssetsTest(unittest.TestCase):
+    """ Built assets are linked by content hash and served precompressed in
+    the encoding the browser prefers. """
+
+    def setUp(self):
+        self.static_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.static_dir, 'style.css'), 'wb') as file:
+            file.write(STYLE)
+        os.makedirs(os.path.join(self.static_dir, 'img'))
+        with open(os.path.join(self.static_dir, 'img', 'logo.png'),
+                  'wb') as file:
+            file.write(b'\x89PNG')
+        self.static_folder = app.static_folder
+        self.manifest = assets.manifest
+        app.static_folder = self.static_dir
+        assets.manifest = build_assets(self.static_dir)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.static_folder = self.static_folder
+        assets.manifest = self.manifest
+        shutil.rmtree(self.static_dir)
+
+    def built(self, filename):
+        return os.path.join(self.static_dir, BUILD_DIR,
+                            assets.manifest[filename])
+
+    def test_build(self):
+        self.assertEqual(load_manifest(self.static_dir), assets.manifest)
+        self.assertRegex(assets.manifest['style.css'],
+                         r'^style\.[0-9a-f]{12}\.css$')
+        self.assertRegex(assets.manifest['img/logo.png'],
+                         r'^img/logo\.[0-9a-f]{12}\.png$')
+        with open(self.built('style.css') + '.gz', 'rb') as file:
+            self.assertEqual(gzip.decompress(file.read()), STYLE)
+        self.assertFalse(os.path.exists(self.built('img/logo.png') + '.gz'))
+
+    def test_name_changes_with_content(self):
+        name = assets.manifest['style.css']
+        self.assertEqual(build_assets(self.static_dir)['style.css'], name)
+        with open(os.path.join(self.static_dir, 'style.css'), 'ab') as file:
+            file.write(b'a { color: red; }\n')
+        self.assertNotEqual(build_assets(self.static_dir)['style.css'], name)
+
+    def test_url_for_links_built_name(self):
+        with app.test_request_context():
+            self.assertEqual(
+                url_for('static', filename='style.css'),
+                '/static/build/' + assets.manifest['style.css'])
+            self.assertEqual(url_for('static', filename='other.css'),
+                             '/static/other.css')
+
+    def get_style(self, accept_encoding):
+        url = '/static/build/' + assets.manifest['style.css']
+        return self.client.get(
+            url, headers={'Accept-Encoding': accept_encoding})
+
+    def test_serves_preferred_encoding(self):
+        # Brotli may not be installed, so stand in a variant
+        with open(self.built('style.css') + '.br', 'wb') as file:
+            file.write(b'brotli')
+
+        cases = [
+            ('gzip, deflate, br', 'br'),
+            ('gzip', 'gzip'),
+            ('gzip, br;q=0', 'gzip'),
+            ('br;q=0.5, gzip', 'gzip'),
+            ('*', 'br'),
+            ('br;q=0, gzip;q=0', None),
+            ('identity', None),
+        ]
+        for accept_encoding, encoding in cases:
+            response = self.get_style(accept_encoding)
+            self.assertEqual(response.headers.get('Content-Encoding'),
+                             encoding, accept_encoding)
+            self.assertEqual(response.headers['Vary'], 'Accept-Encoding')
+            self.assertEqual(response.headers['Cache-Control'],
+                             assets.IMMUTABLE)
+            response.close()
+
+        response = self.get_style('identity')
+        self.assertEqual(response.get_data(), STYLE)
+        response.close()
@@ -0,0 +1,107 @@
+""" Tests of resumable backfills. """
+import importlib.util
+import os
+import unittest
+
+from alembic.migration import MigrationContext
+from alembic.operations import Operations
+
+from auto_maint import app, db
+from auto_maint.backfill import BACKFILLS, Backfill, enqueue, pending
+from auto_maint.models import BackfillCheckpoint, User
+
+MIGRATION = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'migrations', 'versions', '8c4e2f1a9d37_.py')
+
+users = User.__table__
+
+
+def quiet(message):
+    """ Discard a backfill's progress report. """
+
+
+class BackfillTest(unittest.TestCase):
+    """ Backfills resume from their checkpoint. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        for number in range(5):
+            User(f'backfill{number}@example.com', 'hash', 'Backfill')
+        db.session.execute(users.update().values(created_at=None))
+        db.session.commit()
+        self.keys = [row[0] for row in db.session.query(
+            users.c.user_id).order_by(users.c.user_id)]
+        self.processed = []
+        self.fail_after = None
+
+    def tearDown(self):
+        BACKFILLS.pop('test_fill', None)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def process(self, connection, keys):
+        if self.fail_after is not None and len(
+                self.processed) >= self.fail_after:
+            raise RuntimeError('interrupted')
+        self.processed += keys
+        connection.execute(users.update().where(
+            users.c.user_id.in_(keys)).values(created_at=db.func.now()))
+
+    def checkpoint(self, name):
+        db.session.expire_all()
+        return BackfillCheckpoint.query.get(name)
+
+    def test_resume_after_interruption(self):
+        backfill = Backfill('test_fill', users.c.user_id, self.process,
+                            where=users.c.created_at.is_(None))
+        self.fail_after = 4
+        with self.assertRaises(RuntimeError):
+            backfill.run(db.engine, batch_size=2, report=quiet)
+        self.assertEqual(self.processed, self.keys[:4])
+        checkpoint = self.checkpoint('test_fill')
+        self.assertEqual(checkpoint.last_key, self.keys[3])
+        self.assertEqual(checkpoint.rows_done, 4)
+        self.assertIsNone(checkpoint.finished_at)
+        self.assertEqual(pending(db.engine), ['test_fill'])
+
+        self.fail_after = None
+        self.assertEqual(backfill.run(db.engine, batch_size=2, report=quiet),
+                         1)
+        self.assertEqual(self.processed, self.keys)
+        checkpoint = self.checkpoint('test_fill')
+        self.assertEqual(checkpoint.rows_done, 5)
+        self.assertIsNotNone(checkpoint.finished_at)
+        self.assertEqual(pending(db.engine), [])
+
+    def test_finished_backfill_restarts(self):
+        backfill = Backfill('test_fill', users.c.user_id, self.process)
+        self.assertEqual(backfill.run(db.engine, batch_size=2, report=quiet),
+                         5)
+        self.assertEqual(backfill.run(db.engine, batch_size=10,
+                                      report=quiet), 5)
+        self.assertEqual(self.processed, self.keys * 2)
+        self.assertEqual(self.checkpoint('test_fill').rows_done, 5)
+
+    def test_queued_created_at_backfill(self):
+        enqueue(db.engine, 'user_created_at')
+        self.assertEqual(pending(db.engine), ['user_created_at'])
+        BACKFILLS['user_created_at'].run(db.engine, batch_size=2,
+                                         report=quiet)
+        self.assertEqual(pending(db.engine), [])
+        self.assertEqual(db.session.query(users).filter(
+            users.c.created_at.is_(None)).count(), 0)
+
+    def test_migration_queues_created_at_backfill(self):
+        spec = importlib.util.spec_from_file_location('migration', MIGRATION)
+        migration = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(migration)
+
+        BackfillCheckpoint.__table__.drop(db.engine)
+        with db.engine.begin() as connection:
+            with Operations.context(MigrationContext.configure(connection)):
+                migration.upgrade()
+        self.assertEqual(pending(db.engine), ['user_created_at'])
@@ -0,0 +1,59 @@
+""" Tests of bulk actions. """
+import datetime
+import unittest
+
+from auto_maint import app, clock, db
+from auto_maint.bulk import bulk_action
+from auto_maint.models import Maintenance, Odometer, User, Vehicle
+
+
+class BulkLogTest(unittest.TestCase):
+    """ Bulk logs of tasks, which add their mileage as a reading. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.today = clock.today()
+        self.user = User('bulk@example.com', 'hash', 'Bulk')
+        self.vehicle = Vehicle(self.user.user_id, 'Car',
+                               self.today - datetime.timedelta(days=1000))
+        self.vehicle.add_odom_reading(30000)
+        self.task = Maintenance(self.vehicle.vehicle_id, 'Oil Change', None,
+                                5000, 6)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def log(self, miles):
+        return {'maintenance_id': self.task.maintenance_id,
+                'log_date': self.today.isoformat(), 'log_miles': miles}
+
+    def readings_today(self):
+        return [row[0] for row in db.session.query(Odometer.reading).filter(
+            Odometer.vehicle_id == self.vehicle.vehicle_id,
+            Odometer.reading_date == self.today)]
+
+    def test_log_replaces_reading_on_same_date(self):
+        results = bulk_action(self.user.user_id, 'add_log',
+                              [self.log(30010)])
+
+        self.assertEqual(results[0]['status'], 'ok')
+        self.assertEqual(self.readings_today(), [30010])
+        db.session.expire_all()
+        vehicle = Vehicle.query.get(self.vehicle.vehicle_id)
+        self.assertAlmostEqual(vehicle.mileage_rate(), 30010 / 1000)
+
+    def test_logs_on_same_date_in_one_batch(self):
+        results = bulk_action(self.user.user_id, 'add_log',
+                              [self.log(30010), self.log(30020)])
+
+        self.assertEqual([result['status'] for result in results],
+                         ['ok', 'ok'])
+        self.assertEqual(self.readings_today(), [30020])
+
+
+if __name__ == '__main__':
+    unittest.main()
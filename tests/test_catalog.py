@@ -0,0 +1,96 @@
+""" Tests of the schedule catalog and applying schedules. """
+import datetime
+import unittest
+
+from auto_maint import app, clock, db
+from auto_maint.catalog import (STANDARD_SCHEDULE, ScheduleCatalog,
+                                apply_schedule, catalog)
+from auto_maint.models import ESTIMATED_LOG_NOTES, Maintenance, User, Vehicle
+
+
+class CatalogTest(unittest.TestCase):
+    """ The bundled catalog is indexed by model, year and prefix. """
+
+    def test_bundled_catalog_loads(self):
+        self.assertGreater(len(catalog()), 1)
+        self.assertIsNotNone(catalog().lookup(*STANDARD_SCHEDULE))
+
+    def test_lookup_by_year(self):
+        first = catalog().lookup('Honda Accord', 1998)
+        self.assertEqual(first, catalog().lookup('  honda   ACCORD ', 2002))
+        self.assertEqual((first.first_year, first.last_year), (1998, 2002))
+        self.assertEqual(catalog().lookup('Honda Accord', 2003).first_year,
+                         2003)
+        self.assertIsNone(catalog().lookup('Honda Accord', 1997))
+        self.assertIsNone(catalog().lookup('Honda Prelude', 2001))
+
+    def test_search(self):
+        self.assertEqual(catalog().search('acc'), ['Honda Accord'])
+        self.assertEqual(catalog().search('Honda'),
+                         ['Honda Accord', 'Honda Civic'])
+        self.assertEqual(len(catalog().search('', limit=3)), 3)
+        self.assertEqual(catalog().search('zzz'), [])
+
+    def test_gap_in_years(self):
+        schedules = [schedule for name in ('Honda Civic', 'Honda Accord')
+                     for schedule in catalog().schedules[name.lower()]]
+        gapped = ScheduleCatalog(
+            schedule._replace(last_year=schedule.first_year)
+            for schedule in schedules)
+        self.assertIsNotNone(gapped.lookup('Honda Civic', 2001))
+        self.assertIsNone(gapped.lookup('Honda Civic', 2002))
+
+
+class ApplyScheduleTest(unittest.TestCase):
+    """ Applying a schedule adds its tasks and estimated logs to each
+    vehicle. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.schedule = catalog().lookup(*STANDARD_SCHEDULE)
+        user = User('catalog@example.com', 'hash', 'Catalog')
+        built = clock.today() - datetime.timedelta(days=365 * 5)
+        self.vehicle_ids = []
+        for number in range(3):
+            vehicle = Vehicle(user.user_id, f'Accord {number}', built)
+            vehicle.add_odom_reading(40000 * (number + 1))
+            self.vehicle_ids.append(vehicle.vehicle_id)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_apply(self):
+        apply_schedule(self.schedule, self.vehicle_ids)
+        for vehicle_id in self.vehicle_ids:
+            tasks = Maintenance.query.filter(
+                Maintenance.vehicle_id == vehicle_id).all()
+            self.assertEqual(sorted(task.name for task in tasks),
+                             sorted(task.name for task in self.schedule.tasks))
+            for task in tasks:
+                self.assertLessEqual(len(task.logs), 1)
+                for log in task.logs:
+                    self.assertEqual(log.notes, ESTIMATED_LOG_NOTES)
+            self.assertTrue(any(task.logs for task in tasks))
+            self.assertIsNone(Vehicle.query.get(vehicle_id).due_state_at)
+
+    def test_reapply_logs_new_tasks(self):
+        vehicle_id = self.vehicle_ids[0]
+        apply_schedule(self.schedule, [vehicle_id])
+        first = {task.maintenance_id for task in Maintenance.query}
+
+        apply_schedule(self.schedule, self.vehicle_ids)
+        tasks = Maintenance.query.filter(
+            Maintenance.vehicle_id == vehicle_id).all()
+        self.assertEqual(len(tasks), 2 * len(self.schedule.tasks))
+        logged = [
+            sorted(task.name for task in tasks
+                   if task.logs and (task.maintenance_id in first) == old)
+            for old in (True, False)]
+        self.assertTrue(logged[0])
+        self.assertEqual(logged[0], logged[1])
+        for task in tasks:
+            self.assertLessEqual(len(task.logs), 1)
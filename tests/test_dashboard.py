@@ -0,0 +1,76 @@
+""" Tests of the fleet dashboard queries. """
+import datetime
+import unittest
+
+from auto_maint import app, clock, db
+from auto_maint.dashboard import (SORTS, refresh_due_state, status_counts,
+                                  vehicle_page)
+from auto_maint.models import Maintenance, User, Vehicle
+
+
+class DashboardTest(unittest.TestCase):
+    """ A fleet with ties in every sort column. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.today = clock.today()
+        user = User('fleet@example.com', 'hash', 'Fleet')
+        self.user_id = user.user_id
+        for number in range(7):
+            built = self.today - datetime.timedelta(days=1000 + number % 2)
+            vehicle = Vehicle(user.user_id, f'Car {number % 3}', built)
+            vehicle.add_odom_reading(10000 * (number % 3 + 1))
+            Maintenance(vehicle.vehicle_id, 'Oil Change', None, 15000,
+                        36 + 12 * (number % 2))
+        self.vehicles = Vehicle.query.filter(Vehicle.user_id == user.user_id)
+        self.assertEqual(refresh_due_state(self.vehicles), 7)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def all_pages(self, sort, size):
+        ids, after, pages = [], None, 0
+        while True:
+            rows, after = vehicle_page(self.user_id, self.today, sort, after,
+                                       size)
+            ids += [vehicle.vehicle_id for vehicle, _, _ in rows]
+            pages += 1
+            if after is None:
+                return ids, pages
+
+    def test_pages_cover_every_vehicle_once_in_order(self):
+        for sort in SORTS:
+            everything, _ = vehicle_page(self.user_id, self.today, sort,
+                                         size=100)
+            paged, pages = self.all_pages(sort, 3)
+            self.assertEqual(paged, [vehicle.vehicle_id
+                                     for vehicle, _, _ in everything], sort)
+            self.assertEqual(pages, 3, sort)
+
+    def test_page_rows_match_models(self):
+        rows, _ = vehicle_page(self.user_id, self.today, 'mileage', size=100)
+        for vehicle, mileage, status in rows:
+            self.assertEqual(mileage, vehicle.est_mileage())
+            self.assertEqual(status, vehicle.status())
+        self.assertEqual([mileage for _, mileage, _ in rows],
+                         sorted((mileage for _, mileage, _ in rows),
+                                reverse=True))
+
+    def test_status_counts_match_models(self):
+        expected = {'Overdue': 0, 'Soon': 0, 'Good': 0}
+        for vehicle in self.vehicles:
+            expected[vehicle.status()] += 1
+        self.assertEqual(status_counts(self.user_id, self.today), expected)
+        self.assertNotEqual(sorted(expected.values()), [0, 0, 7])
+
+    def test_only_changed_vehicles_refreshed(self):
+        self.assertEqual(refresh_due_state(self.vehicles), 0)
+
+        vehicle = self.vehicles.first()
+        vehicle.add_odom_reading(40000)
+        self.assertIsNone(vehicle.due_state_at)
+        self.assertEqual(refresh_due_state(self.vehicles), 1)
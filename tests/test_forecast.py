@@ -0,0 +1,111 @@
+""" Tests of the maintenance forecast and calendar feed. """
+import datetime
+import unittest
+
+from auto_maint import app, clock, db, ts
+from auto_maint.models import Maintenance, User, Vehicle
+from auto_maint.forecast import user_forecast
+
+
+class ForecastTest(unittest.TestCase):
+    """ Projected occurrences of a user's tasks. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.today = clock.today()
+        user = User('forecast@example.com', 'hash', 'Forecast')
+        self.user_id = user.user_id
+        built = self.today - datetime.timedelta(days=100)
+
+        # Driven 10 miles a day, with a task due every 1000 miles
+        driven = Vehicle(user.user_id, 'Driven', built)
+        driven.add_odom_reading(1000)
+        Maintenance(driven.vehicle_id, 'Oil Change', None, 1000, 12)
+
+        # Never read, with a task due every 6 months
+        unread = Vehicle(user.user_id, 'Unread', built)
+        Maintenance(unread.vehicle_id, 'Wipers', None, 5000, 6)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_occurrences_in_date_order(self):
+        forecast = user_forecast(self.user_id, 8, self.today)
+
+        days = datetime.timedelta(days=1)
+        self.assertEqual(
+            [(event['name'], event['date'], event['est_mileage'],
+              event['overdue']) for event in forecast],
+            [('Oil Change', self.today.isoformat(), 1000, True),
+             ('Wipers', (self.today + 82 * days).isoformat(), 0, False),
+             ('Oil Change', (self.today + 100 * days).isoformat(), 2000,
+              False),
+             ('Oil Change', (self.today + 200 * days).isoformat(), 3000,
+              False)])
+
+
+class CalendarTest(unittest.TestCase):
+    """ The calendar feed, identified by a token holding the user's key. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        app.session_interface.db.create_all()
+        self.user = User('calendar@example.com', 'hash', 'Calendar')
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        app.session_interface.db.session.remove()
+        app.session_interface.db.drop_all()
+        db.drop_all()
+        self.context.pop()
+
+    def feed(self, token):
+        return self.client.get(f'/calendar/{token}.ics')
+
+    def test_feed_served_for_current_key(self):
+        response = self.feed(self.user.calendar_token())
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'text/calendar')
+        self.assertIn(b'BEGIN:VCALENDAR', response.data)
+
+    def test_reset_key_revokes_address(self):
+        token = self.user.calendar_token()
+        self.user.reset_calendar_key()
+
+        self.assertEqual(self.feed(token).status_code, 404)
+        self.assertEqual(
+            self.feed(self.user.calendar_token()).status_code, 200)
+
+    def test_invalid_tokens_not_found(self):
+        self.user.calendar_token()
+        for token in ('not-a-token',
+                      ts.dumps(self.user.user_id, salt='calendar-key'),
+                      ts.dumps([self.user.user_id, 'guess'],
+                               salt='calendar-key')):
+            self.assertEqual(self.feed(token).status_code, 404)
+
+    def test_settings_page_resets_address(self):
+        token = self.user.calendar_token()
+        key = self.user.calendar_key
+        with self.client.session_transaction() as session:
+            session['user_id'] = self.user.user_id
+        self.assertIn(token, self.client.get('/settings').get_data(True))
+
+        app.config['WTF_CSRF_ENABLED'] = False
+        try:
+            self.client.post('/settings',
+                             data={'submit_calendar': 'Reset Address'})
+        finally:
+            app.config['WTF_CSRF_ENABLED'] = True
+
+        db.session.expire_all()
+        self.assertNotEqual(User.query.get(self.user.user_id).calendar_key,
+                            key)
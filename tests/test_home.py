@@ -0,0 +1,98 @@
+""" Tests of the home page and the status it loads separately. """
+import datetime
+import unittest
+
+from auto_maint import app, clock, db
+from auto_maint.dashboard import status_counts
+from auto_maint.models import Maintenance, User, Vehicle
+
+
+class HomeTest(unittest.TestCase):
+    """ The home page lists the user's vehicles, whose status and summary
+    are fetched as JSON. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        app.session_interface.db.create_all()
+        self.config = dict(app.config)
+        today = clock.today()
+
+        user = User('home@example.com', 'hash', 'Home')
+        self.user_id = user.user_id
+        self.vehicle_ids = []
+        for number, age in enumerate((1, 5, 10)):
+            vehicle = Vehicle(user.user_id, f'Car {number}',
+                              today - datetime.timedelta(days=365 * age))
+            vehicle.add_odom_reading(12000 * age)
+            Maintenance(vehicle.vehicle_id, 'Replace Brake Fluid', None,
+                        45000, 36)
+            self.vehicle_ids.append(vehicle.vehicle_id)
+
+        other = User('other@example.com', 'hash', 'Other')
+        vehicle = Vehicle(other.user_id, 'Not Mine', today)
+        vehicle.add_odom_reading(10)
+        self.other_vehicle_id = vehicle.vehicle_id
+
+        self.client = app.test_client()
+        with self.client.session_transaction() as session:
+            session['user_id'] = self.user_id
+
+    def tearDown(self):
+        app.config.update(self.config)
+        db.session.remove()
+        app.session_interface.db.session.remove()
+        app.session_interface.db.drop_all()
+        db.drop_all()
+        self.context.pop()
+
+    def status(self, *vehicle_ids):
+        return self.client.get('/home/status', query_string=[
+            ('vehicle_id', vehicle_id) for vehicle_id in vehicle_ids])
+
+    def test_home_lists_own_vehicles(self):
+        page = self.client.get('/home').get_data(as_text=True)
+        for vehicle_id in self.vehicle_ids:
+            self.assertIn(f'data-vehicle-id="{vehicle_id}"', page)
+        self.assertNotIn(f'data-vehicle-id="{self.other_vehicle_id}"', page)
+        self.assertNotIn('Not Mine', page)
+
+    def test_login_required(self):
+        with self.client.session_transaction() as session:
+            session.clear()
+        for url in ('/home', '/home/status', '/home/summary'):
+            self.assertEqual(self.client.get(url).status_code, 302)
+
+    def test_status_of_own_vehicles(self):
+        response = self.status(*self.vehicle_ids, self.other_vehicle_id)
+        self.assertEqual(response.status_code, 200)
+        rows = {row['vehicle_id']: row
+                for row in response.get_json()['vehicles']}
+        self.assertEqual(sorted(rows), self.vehicle_ids)
+        for vehicle_id, row in rows.items():
+            vehicle = Vehicle.query.get(vehicle_id)
+            self.assertEqual(row['status'], vehicle.status())
+            self.assertEqual(row['last_reading'],
+                             vehicle.last_odometer().reading)
+            self.assertEqual(row['est_mileage'], vehicle.est_mileage())
+
+    def test_status_batch_limit(self):
+        app.config['HOME_STATUS_BATCH'] = 2
+        self.assertEqual(self.status(*self.vehicle_ids[:2]).status_code, 200)
+        response = self.status(*self.vehicle_ids)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.get_json()['status'], 'error')
+
+    def test_summary(self):
+        summary = self.client.get('/home/summary').get_json()
+        today = clock.today()
+        self.assertEqual(summary['counts'],
+                         status_counts(self.user_id, today))
+        self.assertEqual(sum(summary['counts'].values()), 3)
+        self.assertGreater(summary['counts']['Overdue'], 0)
+        self.assertEqual(len(summary['overdue_tasks']),
+                         summary['counts']['Overdue'])
+        for task in summary['overdue_tasks']:
+            self.assertEqual(task['name'], 'Replace Brake Fluid')
+            self.assertLess(task['overdue_date'], today.isoformat())
@@ -0,0 +1,55 @@
+""" Tests of the housekeeping job. """
+import datetime
+import os
+import time
+import unittest
+
+from auto_maint import app, clock, db
+from auto_maint.housekeeping import housekeeping
+
+
+class ExpiredSessionsTest(unittest.TestCase):
+    """ Sessions, whose expiry Flask-Session writes in UTC, deleted by a
+    clock in local time. """
+
+    def setUp(self):
+        self.tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'America/New_York'
+        time.tzset()
+        self.context = app.app_context()
+        self.context.push()
+        db.create_all()
+        self.db = app.session_interface.db
+        self.db.create_all()
+        self.clock = clock.VirtualClock(datetime.datetime(2019, 6, 1, 12))
+        self.utcnow = datetime.datetime(2019, 6, 1, 16)
+
+    def tearDown(self):
+        self.db.session.remove()
+        self.db.drop_all()
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        if self.tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.tz
+        time.tzset()
+
+    def test_utcnow_of_virtual_clock(self):
+        self.assertEqual(self.clock.utcnow(), self.utcnow)
+
+    def test_deletes_sessions_expired_in_utc(self):
+        model = app.session_interface.sql_session_model
+        hour = datetime.timedelta(hours=1)
+        self.db.session.add_all([
+            model('expired', b'', self.utcnow - hour),
+            model('current', b'', self.utcnow + hour)])
+        self.db.session.commit()
+
+        with clock.use_clock(self.clock):
+            report = housekeeping(pause=0)
+
+        self.assertEqual(report['sessions'], 1)
+        self.assertEqual([row[0] for row in self.db.session.query(
+            model.session_id)], ['current'])
@@ -0,0 +1,39 @@
+""" Tests of the maintenance schedule models. """
+import datetime
+import unittest
+
+from auto_maint import app, clock, db
+from auto_maint.models import Maintenance, User, Vehicle
+
+
+class ScheduleNextCheckTest(unittest.TestCase):
+    """ Scheduling the notifier's next check of a vehicle. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.today = clock.today()
+        user = User('schedule@example.com', 'hash', 'Schedule')
+        # Driven exactly 10 miles a day
+        self.vehicle = Vehicle(user.user_id, 'Car',
+                               self.today - datetime.timedelta(days=1000))
+        self.vehicle.add_odom_reading(10000)
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_soon_estimated_for_today_is_checked_tomorrow(self):
+        # 500 miles to go today, so Soon from tomorrow's estimate
+        task = Maintenance(self.vehicle.vehicle_id, 'Oil Change', None,
+                           10500, 120)
+        self.assertEqual(task.status(), 'Good')
+        self.assertEqual(task.status_changes()[0], self.today)
+
+        self.vehicle.schedule_next_check()
+
+        tomorrow = self.today + datetime.timedelta(days=1)
+        self.assertEqual(self.vehicle.next_check,
+                         datetime.datetime.combine(tomorrow, datetime.time()))
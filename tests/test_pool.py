@@ -0,0 +1,86 @@
+""" Tests of connection pool configuration. """
+import os
+import subprocess
+import sys
+import unittest
+
+from sqlalchemy import create_engine
+
+from auto_maint import app
+from auto_maint.pool import engine_health
+from tests import DATABASE
+
+# Prints the pool of the engine an entry point's process uses
+POOL_SCRIPT = '''
+import {module}
+from auto_maint import app, db
+pool = db.get_engine(app).pool
+print(type(pool).__name__, pool.size(), pool._max_overflow, pool._timeout)
+'''
+
+
+def entry_point_pool(module):
+    """ Returns the pool class, size, overflow and timeout after importing
+    the entry point module in a new process. """
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + DATABASE)
+    env.pop('DB_ROLE', None)
+    output = subprocess.check_output(
+        [sys.executable, '-c', POOL_SCRIPT.format(module=module)], env=env,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    return output.decode().split()[-4:]
+
+
+class EntryPointPoolTest(unittest.TestCase):
+    """ The notifier's entry points use the notifier pool settings. """
+
+    def test_run_uses_notifier_pool(self):
+        self.assertEqual(entry_point_pool('run'),
+                         ['MonitoredQueuePool', '2', '0', '30'])
+
+    def test_daily_uses_notifier_pool(self):
+        self.assertEqual(entry_point_pool('daily'),
+                         ['MonitoredQueuePool', '2', '0', '30'])
+
+
+class HealthTest(unittest.TestCase):
+    """ The database health check is private and doesn't leak errors. """
+
+    def setUp(self):
+        self.config = dict(app.config)
+        self.client = app.test_client()
+
+    def tearDown(self):
+        app.config.update(self.config)
+
+    def test_disabled_without_token(self):
+        app.config['HEALTH_TOKEN'] = None
+        response = self.client.get('/health/db',
+                                   headers={'X-Health-Token': ''})
+        self.assertEqual(response.status_code, 404)
+
+    def test_requires_token(self):
+        app.config['HEALTH_TOKEN'] = 'secret'
+        self.assertEqual(self.client.get('/health/db').status_code, 404)
+        response = self.client.get('/health/db',
+                                   headers={'X-Health-Token': 'wrong'})
+        self.assertEqual(response.status_code, 404)
+
+        response = self.client.get('/health/db',
+                                   headers={'X-Health-Token': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.get_json()['engines']['primary'][
+            'reachable'])
+
+    def test_unreachable_error_is_generic(self):
+        missing = os.path.join(os.path.dirname(DATABASE), 'missing', 'x.db')
+        engine = create_engine('sqlite:///' + missing)
+        with self.assertLogs('flask.app', 'ERROR'):
+            health = engine_health(engine)
+        engine.dispose()
+        self.assertFalse(health['reachable'])
+        self.assertEqual(health['error'], 'Database unreachable')
+        self.assertNotIn('missing', str(health))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+""" Tests of rendering and sending reminder emails. """
+import datetime
+import multiprocessing
+import threading
+import unittest
+from collections import defaultdict
+from unittest import mock
+
+from auto_maint import app, clock, db, helpers
+from auto_maint.models import Maintenance, User, Vehicle
+from auto_maint.reminders import user_digests
+from auto_maint.scheduled_tasks import notify_users
+from auto_maint.wake import WakeQueue
+
+
+class UserDigestsTest(unittest.TestCase):
+    """ Grouping vehicle summaries into a digest per user. """
+
+    def summary(self, user_id, vehicle_id):
+        return {'shard': 0, 'user_id': user_id, 'user_name': 'Owner',
+                'email': f'{user_id}@example.com', 'vehicle_id': vehicle_id}
+
+    def test_groups_vehicles_by_user_in_order(self):
+        summaries = [self.summary(1, 10), self.summary(2, 20),
+                     self.summary(1, 11)]
+
+        digests = user_digests(summaries)
+
+        self.assertEqual([digest['user_id'] for digest in digests], [1, 2])
+        self.assertEqual(digests[0]['email'], '1@example.com')
+        self.assertEqual([vehicle['vehicle_id']
+                          for vehicle in digests[0]['vehicles']], [10, 11])
+        self.assertEqual(digests[1]['vehicles'], [summaries[1]])
+
+
+class NotifyUsersTest(unittest.TestCase):
+    """ Reminders rendered across processes and sent by Delivery. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.config = dict(app.config)
+        app.config.update(REMINDER_RENDER_PROCESSES=2,
+                          REMINDER_PARALLEL_MIN=1, REMINDER_DIGEST=True,
+                          MAIL_SEND_WINDOW=0)
+        # A digest for the first owner's two vehicles, which is sent before
+        # the others' reminders render
+        built = clock.today() - datetime.timedelta(days=1000)
+        for number, vehicles in enumerate((2, 1, 1)):
+            user = User(f'owner{number}@example.com', 'hash', 'Owner')
+            for _ in range(vehicles):
+                vehicle = Vehicle(user.user_id, 'Car', built)
+                vehicle.add_odom_reading(10000)
+                Maintenance(vehicle.vehicle_id, 'Oil Change', None, 5000, 6)
+        del helpers.outbox[:]
+
+    def tearDown(self):
+        app.config.clear()
+        app.config.update(self.config)
+        del helpers.outbox[:]
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_render_pool_forked_before_delivery_threads(self):
+        threads = []
+        make_pool = multiprocessing.Pool
+
+        def pool(*args, **kwargs):
+            threads.append(threading.active_count())
+            return make_pool(*args, **kwargs)
+
+        with mock.patch('auto_maint.reminders.multiprocessing.Pool', pool):
+            notify_users(defaultdict(WakeQueue))
+
+        self.assertEqual(threads, [1])
+        self.assertEqual(len(helpers.outbox), 3)
+
+    def test_digest_for_user_with_several_vehicles_due(self):
+        notify_users(defaultdict(WakeQueue))
+
+        subjects = sorted((message['To'], message['Subject'])
+                          for message in helpers.outbox)
+        self.assertEqual(subjects, [
+            ('owner0@example.com', 'Your vehicles are due maintenance'),
+            ('owner1@example.com', 'Your vehicle is due maintenance'),
+            ('owner2@example.com', 'Your vehicle is due maintenance')])
+        db.session.expire_all()
+        self.assertNotIn(None, [vehicle.last_notification
+                                for vehicle in Vehicle.query])
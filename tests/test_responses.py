@@ -0,0 +1,106 @@
+""" Tests of response compression and streamed pages. """
+import gzip
+import unittest
+import zlib
+
+from flask import Response
+
+from auto_maint import app
+from auto_maint.forms import ResetPassword
+from auto_maint.responses import (FLUSH_MARKER, chunked, compress_response,
+                                  compress_stream, render_page)
+
+TEXT = 'Oil Change due in 500 miles\n' * 100
+
+
+class CompressionTest(unittest.TestCase):
+    """ Text responses are compressed in an encoding the browser accepts. """
+
+    def setUp(self):
+        self.config = dict(app.config)
+        app.config['COMPRESS_RESPONSES'] = True
+
+    def tearDown(self):
+        app.config.update(self.config)
+
+    def compress(self, accept_encoding, body=TEXT, mimetype='text/html'):
+        with app.test_request_context(
+                headers={'Accept-Encoding': accept_encoding}):
+            return compress_response(Response(body, mimetype=mimetype))
+
+    def test_registered(self):
+        self.assertIn(compress_response, app.after_request_funcs[None])
+
+    def test_gzip(self):
+        response = self.compress('gzip, deflate')
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn('Accept-Encoding', response.vary)
+        self.assertEqual(gzip.decompress(response.get_data()).decode(), TEXT)
+        self.assertEqual(int(response.headers['Content-Length']),
+                         len(response.get_data()))
+
+    def test_refused_encoding(self):
+        for accept_encoding in ('', 'identity', 'gzip;q=0', 'deflate'):
+            response = self.compress(accept_encoding)
+            self.assertNotIn('Content-Encoding', response.headers)
+            self.assertEqual(response.get_data(as_text=True), TEXT)
+
+    def test_small_and_binary_left_alone(self):
+        self.assertNotIn('Content-Encoding',
+                         self.compress('gzip', body='short').headers)
+        self.assertNotIn('Content-Encoding',
+                         self.compress('gzip', mimetype='image/png').headers)
+
+    def test_disabled(self):
+        app.config['COMPRESS_RESPONSES'] = False
+        self.assertNotIn('Content-Encoding', self.compress('gzip').headers)
+
+
+class StreamingTest(unittest.TestCase):
+    """ Streamed pages are sent in chunks, each decodable on arrival. """
+
+    def setUp(self):
+        self.config = dict(app.config)
+
+    def tearDown(self):
+        app.config.update(self.config)
+
+    def test_chunked(self):
+        app.config['STREAM_CHUNK_BYTES'] = 10
+        pieces = ['<head>', FLUSH_MARKER, 'abc', 'defghijk', 'lm', 'n']
+        self.assertEqual(list(chunked(pieces)), [
+            '<head>' + FLUSH_MARKER, 'abcdefghijk', 'lmn'])
+
+    def test_compress_stream_flushes_each_chunk(self):
+        chunks = [b'<head>', b'<body>' * 50, b'</html>']
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        received = b''
+        with app.app_context():
+            for chunk, compressed in zip(chunks,
+                                         compress_stream(chunks, 'gzip')):
+                received += decompressor.decompress(compressed)
+                self.assertTrue(received.endswith(chunk))
+        self.assertEqual(received, b''.join(chunks))
+
+    def render(self, method='GET'):
+        with app.test_request_context(method=method):
+            response = render_page('password_reset.html',
+                                   reset_form=ResetPassword())
+            if isinstance(response, str):
+                return response
+            return list(response.response)
+
+    def test_render_page_streams_gets(self):
+        # Leave out the CSRF token, which differs between requests
+        app.config['WTF_CSRF_ENABLED'] = False
+        app.config['STREAM_PAGES'] = False
+        page = self.render()
+
+        app.config['STREAM_PAGES'] = True
+        app.config['STREAM_CHUNK_BYTES'] = 1 << 20
+        chunks = self.render()
+        self.assertGreater(len(chunks), 1)
+        self.assertIn(FLUSH_MARKER, chunks[0])
+        self.assertEqual(''.join(chunks), page)
+
+        self.assertEqual(self.render('POST'), page)
@@ -0,0 +1,80 @@
+""" Tests of routing reads to the read replica. """
+import os
+import unittest
+
+from auto_maint import app, db
+from auto_maint.models import User
+from auto_maint.routing import (REPLICA, primary_reads, replica_reads,
+                                route_request)
+from tests import DATABASE
+
+
+class ReplicaRoutingTest(unittest.TestCase):
+    """ Reads routed to a replica holding a different user to the primary,
+    so each query shows where it went. """
+
+    def setUp(self):
+        self.binds = app.config['SQLALCHEMY_BINDS']
+        self.replica = os.path.join(os.path.dirname(DATABASE), 'replica.db')
+        app.config['SQLALCHEMY_BINDS'] = dict(
+            self.binds or {}, **{REPLICA: 'sqlite:///' + self.replica})
+        app.session_interface.db.create_all()
+        with app.app_context():
+            db.create_all()
+            User('primary@example.com', 'hash', 'Primary')
+            replica = db.get_engine(app, bind=REPLICA)
+            db.Model.metadata.create_all(replica)
+            replica.execute(User.__table__.insert().values(
+                email='replica@example.com', password_hash='hash',
+                name='Replica'))
+
+    def tearDown(self):
+        app.session_interface.db.session.remove()
+        app.session_interface.db.drop_all()
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+        connectors = app.extensions['sqlalchemy'].connectors
+        connectors.pop(REPLICA).get_engine().dispose()
+        app.config['SQLALCHEMY_BINDS'] = self.binds
+        os.remove(self.replica)
+
+    def read(self):
+        return [user.name for user in User.query]
+
+    def test_get_requests_read_from_replica(self):
+        with app.test_request_context():
+            app.preprocess_request()
+            self.assertEqual(self.read(), ['Replica'])
+
+    def test_post_requests_read_from_primary(self):
+        with app.test_request_context(method='POST'):
+            route_request()
+            self.assertEqual(self.read(), ['Primary'])
+
+    def test_reads_after_a_write_stay_on_primary(self):
+        with app.test_request_context():
+            app.preprocess_request()
+            User('new@example.com', 'hash', 'New')
+            self.assertEqual(self.read(), ['Primary', 'New'])
+
+    def test_reads_stay_on_primary_after_recent_write(self):
+        with app.test_request_context() as context:
+            app.preprocess_request()
+            User('new@example.com', 'hash', 'New')
+            app.process_response(app.response_class())
+            last_write = context.session['last_write']
+
+        with app.test_request_context() as context:
+            context.session['last_write'] = last_write
+            app.preprocess_request()
+            self.assertEqual(self.read(), ['Primary', 'New'])
+
+    def test_replica_and_primary_read_blocks(self):
+        with app.app_context():
+            self.assertEqual(self.read(), ['Primary'])
+            with replica_reads():
+                self.assertEqual(self.read(), ['Replica'])
+                with primary_reads():
+                    self.assertEqual(self.read(), ['Primary'])
+                self.assertEqual(self.read(), ['Replica'])
@@ -0,0 +1,48 @@
+""" Tests of the in-process search indexes. """
+import datetime
+import threading
+import unittest
+
+from auto_maint import app, clock, db
+from auto_maint.models import User, Vehicle
+from auto_maint.search import index_search, indexes
+
+
+class IndexSearchTest(unittest.TestCase):
+    """ Searches of users' inverted indexes. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        indexes.clear()
+        purchased = clock.today() - datetime.timedelta(days=100)
+        self.users = []
+        for name in ('Busy', 'Other'):
+            user = User(f'{name.lower()}@example.com', 'hash', name)
+            Vehicle(user.user_id, f'{name} Car', purchased)
+            self.users.append(user.user_id)
+
+    def tearDown(self):
+        indexes.clear()
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def search_in_thread(self, user_id, results):
+        with app.app_context():
+            results.extend(index_search(user_id, ['car'], 0, 10))
+
+    def test_busy_index_does_not_block_other_users(self):
+        busy, other = self.users
+        self.assertEqual(len(index_search(busy, ['car'], 0, 10)), 1)
+
+        results = []
+        with indexes[busy].lock:
+            thread = threading.Thread(target=self.search_in_thread,
+                                      args=(other, results))
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        self.assertEqual([hit.vehicle_name for hit in results],
+                         ['Other Car'])
@@ -0,0 +1,124 @@
+""" Tests of sharding user data. """
+import datetime
+import os
+import unittest
+
+from flask import g, session
+from sqlalchemy import func, select
+
+from auto_maint import app, clock, db
+from auto_maint.models import (User, UserDirectory, Vehicle, email_registered,
+                               route_email, route_user)
+from auto_maint.sharding import place_user, route_shard, use_shard
+from tests import DATABASE
+
+SHARDS = ['shard0', 'shard1']
+
+
+class ShardingTest(unittest.TestCase):
+    """ User data split across two SQLite shards, with the directory in the
+    primary database. """
+
+    def setUp(self):
+        self.config = {name: app.config[name]
+                       for name in ('SQLALCHEMY_BINDS', 'SHARD_BINDS')}
+        self.files = [os.path.join(os.path.dirname(DATABASE), f'{bind}.db')
+                      for bind in SHARDS]
+        app.config['SQLALCHEMY_BINDS'] = dict(
+            self.config['SQLALCHEMY_BINDS'] or {},
+            **{bind: 'sqlite:///' + path
+               for bind, path in zip(SHARDS, self.files)})
+        app.config['SHARD_BINDS'] = SHARDS
+        app.session_interface.db.create_all()
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        for bind in SHARDS:
+            db.Model.metadata.create_all(db.get_engine(app, bind=bind))
+
+        # An email address placed in each shard
+        emails = (f'user{number}@example.com' for number in range(100))
+        self.emails = {}
+        for email in emails:
+            self.emails.setdefault(place_user(email), email)
+        self.assertEqual(sorted(self.emails), [0, 1])
+
+    def tearDown(self):
+        app.session_interface.db.session.remove()
+        app.session_interface.db.drop_all()
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+        connectors = app.extensions['sqlalchemy'].connectors
+        for bind in SHARDS:
+            connectors.pop(bind).get_engine().dispose()
+        app.config.update(self.config)
+        for path in self.files:
+            os.remove(path)
+
+    def shard_emails(self, bind):
+        return [row[0] for row in db.get_engine(app, bind=bind).execute(
+            select([User.__table__.c.email]))]
+
+    def register(self, shard):
+        user = User(self.emails[shard], 'hash', 'Sharded')
+        user_id = user.user_id
+        built = clock.today() - datetime.timedelta(days=365)
+        vehicle = Vehicle(user_id, 'Sharded Car', built)
+        vehicle.add_odom_reading(1000)
+        db.session.remove()
+        g.pop('shard', None)
+        return user_id
+
+    def test_users_kept_in_their_shard(self):
+        ids = [self.register(shard) for shard in (0, 1)]
+        for shard, bind in enumerate(SHARDS):
+            self.assertEqual(self.shard_emails(bind), [self.emails[shard]])
+            count = db.get_engine(app, bind=bind).execute(
+                select([func.count()]).select_from(
+                    Vehicle.__table__)).scalar()
+            self.assertEqual(count, 1)
+
+        self.assertEqual(
+            [(entry.user_id, entry.shard)
+             for entry in UserDirectory.query.order_by(
+                 UserDirectory.user_id)],
+            list(zip(ids, (0, 1))))
+        self.assertEqual(len(set(ids)), 2)
+
+    def test_route_by_email_and_id(self):
+        user_id = self.register(1)
+        self.assertTrue(email_registered(self.emails[1]))
+        self.assertFalse(email_registered(self.emails[0]))
+        self.assertFalse(route_email(self.emails[0]))
+
+        self.assertTrue(route_email(self.emails[1]))
+        self.assertEqual(g.shard, 1)
+        self.assertEqual(User.query.get(user_id).email, self.emails[1])
+
+        g.shard = 0
+        self.assertTrue(route_user(user_id))
+        self.assertEqual(g.shard, 1)
+        self.assertEqual(len(Vehicle.query.filter(
+            Vehicle.user_id == user_id).all()), 1)
+
+    def test_use_shard(self):
+        user_id = self.register(0)
+        with use_shard(1):
+            self.assertIsNone(User.query.get(user_id))
+            with use_shard(0):
+                self.assertIsNotNone(User.query.get(user_id))
+            self.assertEqual(g.shard, 1)
+        self.assertIsNone(g.get('shard'))
+
+    def test_user_data_needs_a_shard(self):
+        with self.assertRaises(RuntimeError):
+            User.query.all()
+        self.assertEqual(UserDirectory.query.all(), [])
+
+    def test_requests_use_the_session_shard(self):
+        user_id = self.register(1)
+        with app.test_request_context():
+            session['shard'] = 1
+            route_shard()
+            self.assertEqual(User.query.get(user_id).email, self.emails[1])
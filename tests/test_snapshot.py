@@ -0,0 +1,119 @@
+""" Tests of the columnar fleet snapshot. """
+import datetime
+import shutil
+import tempfile
+import unittest
+
+import numpy as np
+
+from auto_maint import app, clock, db
+from auto_maint.models import Maintenance, User, Vehicle
+from auto_maint.snapshot import (ARRAYS, FleetArrays, build_snapshot, merge,
+                                 query_arrays, select_vehicles)
+
+
+def fleet_arrays():
+    """ Arrays of three vehicles: two readings, none and one reading. """
+    day = np.datetime64('2019-01-01', 'D')
+    return {
+        'vehicle_id': np.array([1, 2, 3], np.int64),
+        'vehicle_built': np.array([day - 100, day - 50, day - 10]),
+        'odo_date': np.array([day - 50, day, day]),
+        'odo_reading': np.array([1000, 2000, 500], np.int64),
+        'odo_offsets': np.array([0, 2, 2, 3], np.int64),
+        'task_id': np.array([10, 11, 30], np.int64),
+        'task_freq_miles': np.array([5000, 1000, 5000], np.int64),
+        'task_freq_months': np.array([12, 12, 12], np.int64),
+        'task_last_date': np.array(['NaT', 'NaT', 'NaT'], 'datetime64[D]'),
+        'task_last_mileage': np.array([0, 0, 0], np.int64),
+        'task_offsets': np.array([0, 2, 2, 3], np.int64),
+    }
+
+
+class FleetArraysTest(unittest.TestCase):
+    """ Vectorised per vehicle calculations. """
+
+    def setUp(self):
+        self.fleet = FleetArrays(fleet_arrays())
+        self.today = datetime.date(2019, 1, 11)
+
+    def test_mileage_rates(self):
+        rates = self.fleet.mileage_rates()
+        self.assertEqual(rates[0], (1000 / 50 + 1000 / 50) / 2)
+        self.assertTrue(np.isnan(rates[1]))
+        self.assertEqual(rates[2], 50)
+
+    def test_est_mileage_of_vehicle_without_readings_is_zero(self):
+        self.assertEqual(self.fleet.est_mileage(self.today).tolist(),
+                         [2200, 0, 1000])
+
+    def test_vehicle_status(self):
+        # The second task of the first vehicle is 1200 miles past due
+        self.assertEqual(self.fleet.vehicle_status(self.today).tolist(),
+                         [2, 0, 0])
+
+
+class MergeTest(unittest.TestCase):
+    """ Selecting and merging the arrays of sets of vehicles. """
+
+    def assert_arrays_equal(self, first, second):
+        for name in ARRAYS:
+            np.testing.assert_array_equal(first[name], second[name],
+                                          err_msg=name)
+
+    def test_selected_parts_merge_to_the_whole(self):
+        arrays = fleet_arrays()
+        keep = np.array([False, True, True])
+
+        merged = merge(select_vehicles(arrays, keep),
+                       select_vehicles(arrays, ~keep))
+
+        self.assert_arrays_equal(merged, arrays)
+
+    def test_select_keeps_vehicle_rows(self):
+        selected = select_vehicles(fleet_arrays(),
+                                   np.array([True, False, True]))
+
+        self.assertEqual(selected['vehicle_id'].tolist(), [1, 3])
+        self.assertEqual(selected['odo_reading'].tolist(), [1000, 2000, 500])
+        self.assertEqual(selected['odo_offsets'].tolist(), [0, 2, 3])
+        self.assertEqual(selected['task_id'].tolist(), [10, 11, 30])
+
+
+class BuildSnapshotTest(unittest.TestCase):
+    """ Full and incremental builds from the database. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.path = tempfile.mkdtemp()
+        user = User('snapshot@example.com', 'hash', 'Snapshot')
+        built = clock.today() - datetime.timedelta(days=500)
+        self.vehicles = []
+        for number in range(3):
+            vehicle = Vehicle(user.user_id, f'Car {number}', built)
+            vehicle.add_odom_reading(10000 * (number + 1))
+            Maintenance(vehicle.vehicle_id, 'Oil Change', None, 5000, 6)
+            self.vehicles.append(vehicle)
+
+    def tearDown(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def test_incremental_build_matches_full(self):
+        build_snapshot(self.path, full=True)
+        changed, deleted = self.vehicles[0], self.vehicles[2]
+        Maintenance(changed.vehicle_id, 'Tyres', None, 20000, 48)
+        Vehicle.query.filter_by(vehicle_id=deleted.vehicle_id).delete()
+        db.session.commit()
+
+        snapshot = build_snapshot(self.path)
+
+        current = query_arrays(Vehicle.vehicle_id.isnot(None))
+        for name in ARRAYS:
+            np.testing.assert_array_equal(getattr(snapshot, name),
+                                          current[name], err_msg=name)
+        self.assertEqual(len(snapshot), 2)
@@ -0,0 +1,29 @@
+""" Tests of warming the app in gunicorn's master. """
+import unittest
+
+from auto_maint import app, db
+from auto_maint.startup import warm
+
+
+class WarmTest(unittest.TestCase):
+    """ Warming the app before the workers are forked. """
+
+    def setUp(self):
+        with app.app_context():
+            db.create_all()
+
+    def tearDown(self):
+        with app.app_context():
+            db.session.remove()
+            db.drop_all()
+
+    def test_leaves_no_connections_for_workers_to_inherit(self):
+        with app.app_context():
+            db.session.execute('SELECT 1')
+            db.session.remove()
+        warm()
+
+        connectors = app.extensions['sqlalchemy'].connectors.values()
+        self.assertTrue(connectors)
+        for connector in connectors:
+            self.assertEqual(connector.get_engine().pool.checkedin(), 0)
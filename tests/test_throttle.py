@@ -0,0 +1,50 @@
+""" Tests of the failed login counts. """
+import unittest
+
+from auto_maint import app, db
+from auto_maint.models import User
+from auto_maint.throttle import FailedLogins
+
+
+class FailedLoginsTest(unittest.TestCase):
+    """ Failed logins kept in memory until they are flushed. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.flush_seconds = app.config['LOGIN_FLUSH_SECONDS']
+        app.config['LOGIN_FLUSH_SECONDS'] = 0.01
+        self.user = User('throttle@example.com', 'hash', 'Throttle')
+        self.failed_logins = FailedLogins()
+
+    def tearDown(self):
+        app.config['LOGIN_FLUSH_SECONDS'] = self.flush_seconds
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def stored_count(self):
+        db.session.expire_all()
+        return db.session.query(User.failed_logins).filter(
+            User.user_id == self.user.user_id).scalar()
+
+    def test_timer_writes_counts_without_another_failure(self):
+        self.failed_logins.record(self.user)
+        self.failed_logins.record(self.user)
+        timer = self.failed_logins.timer
+        timer.join(5)
+
+        self.assertFalse(timer.is_alive())
+        self.assertIsNone(self.failed_logins.timer)
+        self.assertEqual(self.stored_count(), 2)
+
+    def test_flush_cancels_timer(self):
+        app.config['LOGIN_FLUSH_SECONDS'] = 60
+        self.failed_logins.record(self.user)
+        timer = self.failed_logins.timer
+        self.failed_logins.flush()
+
+        timer.join(5)
+        self.assertFalse(timer.is_alive())
+        self.assertEqual(self.stored_count(), 1)
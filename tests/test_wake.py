@@ -0,0 +1,121 @@
+""" Tests of the notifier's wake queue and rescheduling. """
+import datetime
+import unittest
+from collections import defaultdict
+from unittest import mock
+
+from auto_maint import app, clock, db, helpers
+from auto_maint.models import (NEVER, RENOTIFY_AFTER, DeadLetter,
+                               Maintenance, User, Vehicle)
+from auto_maint.scheduled_tasks import notify_users
+from auto_maint.wake import WakeQueue
+
+
+class WakeQueueTest(unittest.TestCase):
+    """ Vehicles woken by their next_check. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.now = datetime.datetime(2019, 6, 1, 12)
+        user = User('wake@example.com', 'hash', 'Wake')
+        self.vehicles = [Vehicle(user.user_id, f'Car {number}',
+                                 datetime.date(2015, 1, 1))
+                         for number in range(4)]
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def schedule(self, *next_checks):
+        for vehicle, next_check in zip(self.vehicles, next_checks):
+            vehicle.next_check = next_check
+        db.session.commit()
+        return [vehicle.vehicle_id for vehicle in self.vehicles]
+
+    def test_due_wakes_unscheduled_and_arrived_vehicles(self):
+        hour = datetime.timedelta(hours=1)
+        unscheduled, arrived, later, never = self.schedule(
+            None, self.now - hour, self.now + hour, NEVER)
+        queue = WakeQueue()
+
+        self.assertEqual(queue.due(self.now), [unscheduled, arrived])
+        self.assertEqual(queue.due(self.now + hour), [unscheduled, later])
+
+    def test_vehicles_skips_those_rescheduled_since_queued(self):
+        hour = datetime.timedelta(hours=1)
+        first = self.schedule(self.now, self.now, NEVER, NEVER)[0]
+        queue = WakeQueue()
+        due = queue.due(self.now)
+        self.vehicles[1].next_check = self.now + hour
+        db.session.commit()
+
+        loaded = [vehicle.vehicle_id
+                  for vehicles in queue.vehicles(due, self.now)
+                  for vehicle in vehicles]
+        self.assertEqual(loaded, [first])
+
+    def test_push_keeps_vehicles_within_the_window(self):
+        queue = WakeQueue()
+        queue.due(self.now)
+        soon, later = self.vehicles[:2]
+        soon.next_check = self.now + datetime.timedelta(hours=2)
+        later.next_check = self.now + datetime.timedelta(days=2)
+        queue.push(soon)
+        queue.push(later)
+
+        self.assertEqual(queue.heap, [(soon.next_check, soon.vehicle_id)])
+
+
+class NotifierRescheduleTest(unittest.TestCase):
+    """ Rescheduling vehicles after their reminder is sent or fails. """
+
+    def setUp(self):
+        self.context = app.test_request_context()
+        self.context.push()
+        db.create_all()
+        self.config = dict(app.config)
+        app.config.update(REMINDER_RENDER_PROCESSES=1, MAIL_SEND_WINDOW=0,
+                          MAIL_RETRIES=0)
+        user = User('due@example.com', 'hash', 'Due')
+        vehicle = Vehicle(user.user_id, 'Car',
+                          clock.today() - datetime.timedelta(days=1000))
+        vehicle.add_odom_reading(10000)
+        Maintenance(vehicle.vehicle_id, 'Oil Change', None, 5000, 6)
+        self.vehicle_id = vehicle.vehicle_id
+        del helpers.outbox[:]
+
+    def tearDown(self):
+        app.config.clear()
+        app.config.update(self.config)
+        del helpers.outbox[:]
+        db.session.remove()
+        db.drop_all()
+        self.context.pop()
+
+    def vehicle_state(self):
+        db.session.expire_all()
+        vehicle = Vehicle.query.get(self.vehicle_id)
+        return vehicle.last_notification, vehicle.next_check
+
+    def test_sent_reminder_reschedules_after_backoff(self):
+        notify_users(defaultdict(WakeQueue))
+
+        last_notification, next_check = self.vehicle_state()
+        self.assertEqual(len(helpers.outbox), 1)
+        self.assertEqual(next_check, last_notification + RENOTIFY_AFTER)
+
+    def test_failed_reminder_is_retried_on_next_run(self):
+        queues = defaultdict(WakeQueue)
+        with mock.patch('auto_maint.delivery.send_email',
+                        side_effect=ValueError('Bad address')):
+            notify_users(queues)
+
+        self.assertEqual(DeadLetter.query.count(), 1)
+        self.assertEqual(self.vehicle_state(), (None, None))
+
+        notify_users(queues)
+        self.assertEqual(len(helpers.outbox), 1)
+        self.assertIsNotNone(self.vehicle_state()[0])